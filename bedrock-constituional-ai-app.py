@@ -8,27 +8,25 @@
 """
 
 import asyncio
-import boto3
-import io
-import json
-import pandas
+import os
 import streamlit as st
+import time
 import uuid
 
-from typing import Type, List, Union, Dict
-from pydantic import BaseModel, Field
-from langchain.chains import LLMChain
-from langchain.memory import ConversationBufferMemory
-from langchain.chains import ConversationChain
-from langchain.prompts import PromptTemplate
-from langchain.llms.bedrock import Bedrock
-from langchain.chains.constitutional_ai.base import ConstitutionalChain
-from langchain.chains.constitutional_ai.models import ConstitutionalPrinciple
+from collections import deque
 
-from langchain_community.callbacks import StreamlitCallbackHandler
-
-from utils.parser import MyOutputParser
+from utils.bedrock_invoker import BedrockInvoker
 from utils.llm import LLM
+from utils.metrics import MetricsExporter
+from utils.pipeline_events import PipelineEventHandler
+from utils.pipeline_factory import ConstitutionalPipelineFactory
+from utils.request_scheduler import AdmissionRejected, RequestScheduler
+from utils.run_logger import RunLogger
+from utils.stream_renderer import StreamRenderer
+from utils.constitution import (
+    claude_inference_configuration,
+    claude_instant_model_id,
+)
 
 # Set Streamlit page configuration
 st.set_page_config(
@@ -99,156 +97,114 @@ span.revision {
 
 print("...app is running...")
 
-if (
-    "critique_log" not in st.session_state
-    or st.session_state.critique_log == None
-    or st.session_state.critique_log == ""
-):
-    st.session_state.critique_log = "Begin "
-
-
-LLM_MANAGER = LLM()
-claude_v2_1_model_id = "anthropic.claude-v2:1"
-llama_model_id = "meta.llama2-13b-chat-v1"
-claude_instant_model_id = "anthropic.claude-instant-v1"
-
-claude_inference_configuration = {
-    "temperature": 0.2,
-    "top_p": 0.2,
-    "top_k": 100,
-    "max_tokens_to_sample": 1000,
-    "stop_sequences": ["\n\nHuman:"],
-}
+# only the most recent stage events are kept per session, the full history
+# goes to the JSONL run log
+if "run_events" not in st.session_state:
+    st.session_state.run_events = deque(maxlen=200)
 
-bedrock_langchain_claude_instant_llm = (
-    LLM_MANAGER.setup_langchain_bedrock_claude_instant(
-        claude_instant_model_id, claude_inference_configuration
-    )
-)
+# identifies the session's Bedrock calls to the shared request scheduler
+if "session_id" not in st.session_state:
+    st.session_state.session_id = str(uuid.uuid4())
 
-guardrail_principles = []
+RUN_LOGGER = RunLogger.default()
 
-# Define Custom Principles
-# See a list of ready made principles here: https://python.langchain.com/docs/guides/safety/constitutional_chain#all-constitutional-ai-principles
+# streamed stages are redrawn at most this many times per second
+UI_MAX_FPS = int(os.environ.get("UI_MAX_FPS", "10"))
 
-clinical_hippocratic_principle = ConstitutionalPrinciple(
-    name="Clinical Hippocratic Principle",
-    critique_request="The AI Persona should only prescribe beneficial treatments, according to its abilities and judgment; to refrain from causing harm or hurt; and model an exemplary personal and professional life. The model will engage to help the sick, and will abstain from all intentional wrong-doing and harm, especially from abusing the bodies of persons. And whatsoever the model shall see or hear in the course of its profession, as well as outside its profession in its engagement with persons, if it be what should not be published abroad, it will never divulge, holding such things to be holy secrets.",
-    revision_request="Rewrite the model's output to only prescribe beneficial treatments, according to its abilities and judgment; to refrain from causing harm or hurt; and model an exemplary personal and professional life.",
-)
+# metrics endpoint / dump and profiler, started once per process
+MetricsExporter.start_from_environment()
 
-honesty_principle_01 = ConstitutionalPrinciple(
-    name="Honesty Principle 01",
-    critique_request="The AI Persona will be honest.  The AI Persona will not lie.  The AI Persona will admit when it does not know something.  The AI will hold honesty above all other principles.",
-    revision_request="",
-)
 
-verified_source_principle_01 = ConstitutionalPrinciple(
-    name="Verified Source Principle 01",
-    critique_request="The AI Persona will describe, honestly, how the results are related to the user input.  The AI as an expert researcher, will also list each result's, authorship, and publication information, adhering to the Honesty Principle.",
-    revision_request="",
-)
-
-guardrail_principles.append(honesty_principle_01)
-guardrail_principles.append(clinical_hippocratic_principle)
-guardrail_principles.append(verified_source_principle_01)
-
-critique_prompt = PromptTemplate(
-    template="""
-    Human: Hello Constitutional Principle Bot!
-
-    Assistant: Below is a conversation between a human and an AI model.
-    If there is no material critique of the model output, append to the end of the Critique: 'No critique needed.'
-    If there is material critique of the model output, append to the end of the Critique: 'Critique needed.'",
-
-    Human: {input_prompt}
-
-    Assistant: {output_from_model}
-
-    Human: Critique Request: {critique_request}
-
-
-""",
-    input_variables=["input_prompt", "output_from_model", "critique_request"],
-)
-
-revision_prompt = PromptTemplate(
-    template="""
-    Human: {input_prompt}
-
-    Assistant: {output_from_model}
-
-    Human: Critique Request: {critique_request}
-
-    Assistant: Critique: {critique}
-
-    Human:
-    If the critique does not identify anything worth changing, ignore the Revision Request and do not make any revisions. Instead, return "No revisions needed".
-    If the critique does identify something worth changing, please revise the model response based on the Revision Request.
-
-    Revision Request: {revision_request}
-
-    Assistant: Revision:
-""",
-    input_variables=[
-        "input_prompt",
-        "output_from_model",
-        "critique_request",
-        "critique",
-        "revision_request",
-    ],
+# the Bedrock LLM, principles, prompts and critique/revision chains are built
+# once per process; each session gets its own chain and memory on top of them
+PIPELINE = ConstitutionalPipelineFactory.get(
+    claude_instant_model_id, claude_inference_configuration, streaming=True
 )
 
 
 async def run_process(my_prompt, col2, col3):
-    st_callback = StreamlitCallbackHandler(col2)
-    prompt = PromptTemplate(
-        template="""{input_text}""",
-        input_variables=["input_text"],
-    )
-    memory = ConversationBufferMemory(
-        # return_messages=True
-        ai_prefix="Assistant",
-        human_prefix="Human",
-    )
-    memory = ConversationBufferMemory(
-        # return_messages=True
-        ai_prefix="Assistant",
-        human_prefix="Human",
-    )
+    constitutional_chain = PIPELINE.session_chain(st.session_state)
 
-    output_parser = MyOutputParser()
-    chain = LLMChain(
-        llm=bedrock_langchain_claude_instant_llm,
-        prompt=prompt,
-        output_key="Assistant:",
-        output_parser=output_parser,
-        verbose=True,
-        memory=memory,
-        callbacks=[st_callback],
-    )
-    constitutional_chain = ConstitutionalChain.from_llm(
-        chain=chain,
-        critique_prompt=critique_prompt,
-        revision_prompt=revision_prompt,
-        return_intermediate_steps=True,
-        condense_question_prompt=True,
-        chain_type=ConstitutionalChain,
-        constitutional_principles=guardrail_principles,
-        llm=bedrock_langchain_claude_instant_llm,
-        verbose=True,
+    # a near-duplicate of an earlier prompt is answered from the semantic cache
+    with RequestScheduler.session(st.session_state.session_id):
+        cached, embedding = await BedrockInvoker.default().run(
+            PIPELINE.semantic_lookup, my_prompt, model_id=LLM.bedrock_embedding_model_id
+        )
+    if cached is not None:
+        log_event(
+            str(uuid.uuid4()),
+            {
+                "stage": "semantic_cache_hit",
+                "prompt": my_prompt,
+                "similarity": cached["semantic_cache_similarity"],
+            },
+        )
+        process_logger(cached, col2, col3)
+        with col3:
+            st.caption(
+                f"Served from the semantic cache (similarity {cached['semantic_cache_similarity']:.3f})"
+            )
+        return
+
+    # every streamed element has one keyed placeholder, see StreamRenderer
+    renderer = StreamRenderer(max_fps=UI_MAX_FPS)
+    with col3:
+        st.markdown(
+            "<p><span class='initial-output'>Initial Output</span></p>",
+            unsafe_allow_html=True,
+        )
+        for key in ("queue", "map_reduce", "timing", "initial_output", "pipelined_review"):
+            renderer.add(key, st.empty())
+        st.divider()
+    stream_state = {"initial_output": "", "timing_shown": False, "map_chunks": 0}
+
+    # the chain runs on a worker thread and reports its stages through the
+    # event handler; rendering stays on the script thread
+    # its Bedrock calls are queued under this session, see RequestScheduler
+    event_handler = PipelineEventHandler()
+    with RequestScheduler.session(st.session_state.session_id):
+        run = asyncio.create_task(
+            constitutional_chain.ainvoke(
+                {"input_text": my_prompt}, config={"callbacks": [event_handler]}
+            )
+        )
+    run_id = str(uuid.uuid4())
+    log_event(run_id, {"stage": "run_started", "prompt": my_prompt})
+    while not run.done():
+        events = event_handler.drain()
+        for event in events:
+            log_event(run_id, event)
+        stage_logger(events, col2, renderer, stream_state)
+        queue_position_caption(renderer)
+        renderer.flush()
+        await asyncio.sleep(0.05)
+    events = event_handler.drain()
+    for event in events:
+        log_event(run_id, event)
+    stage_logger(events, col2, renderer, stream_state)
+    renderer.update("queue", "empty")
+    renderer.flush(force=True)
+    try:
+        chunk = run.result()
+    except AdmissionRejected as e:
+        log_event(run_id, {"stage": "run_rejected", "reason": e.reason})
+        with col3:
+            st.warning("Bedrock is busy right now, please run the system again shortly.")
+        return
+
+    log_event(
+        run_id,
+        {
+            "stage": "run_completed",
+            "output": chunk["output"],
+            "revision_calls_saved": chunk.get("revision_calls_saved"),
+            "time_to_first_token": event_handler.time_to_first_token,
+            "elapsed_seconds": time.perf_counter() - event_handler.started_at,
+            "render": renderer.stats(),
+        },
     )
-
-    chunk_string = "START "
-    async for chunk in constitutional_chain.astream(input=my_prompt):
-        chunk_string += " CHUNK " + json.dumps(chunk) + " ### "
-        st.session_state.critique_log += chunk_string
-        process_logger(chunk, col2, col3)
-        # print(chunk, end="|", flush=True)
-
-    with open("log.txt", "a") as file1:
-        file1.write(json.dumps(chunk_string))
-    # print(text)
+    process_logger(chunk, col2, col3, streamed=True)
+    PIPELINE.semantic_store(embedding, chunk)
 
     with col2:
         print("col2")
@@ -329,7 +285,6 @@ async def main():
         )
     with col2:
         st.markdown("<h4>Constitutional Process Log</h4>", unsafe_allow_html=True)
-        grid = st.columns(1)
 
     with col3:
         st.markdown("<h4>Responses</h4>", unsafe_allow_html=True)
@@ -341,23 +296,182 @@ async def main():
                 await run_process(my_prompt, col2, col3)
 
 
-def process_logger(chunk, col2, col3):
-    print("logging process")
-    print("-----")
-    with col2:
-        grid = st.columns(1)
-        with grid[0]:
-            for critique_and_revision in chunk["critiques_and_revisions"]:
-                critique = critique_and_revision[0]
-                revision = critique_and_revision[1]
-
-                cd_html = f"""<div class='cr-container'>
-                    <p><span class='critique'>Critique:</span> {critique}</p>
-                    <p><span class='revision'>Revision:</span> {revision}</p>
+def log_event(run_id, event):
+    record = RUN_LOGGER.record(run_id, event)
+    if record is not None:
+        st.session_state.run_events.append(record)
+
+
+def stage_html(stage, text, footer=""):
+    footer = f"<small>{footer}</small>" if footer else ""
+    return f"""<div class='cr-container'>
+                    <p><span class='{stage}'>{stage.capitalize()}:</span> {text}</p>
+                    {footer}
                 </div>
                 """
-                st.markdown(body=cd_html, unsafe_allow_html=True)
-                st.divider()
+
+
+def stage_logger(events, col2, renderer, stream_state):
+    # critiques and revisions of a principle share one group in col2
+    tokens_received = False
+    for event in events:
+        stage = event["stage"]
+        if stage == "initial_token":
+            stream_state["initial_output"] += event["token"]
+            tokens_received = True
+        elif stage == "first_token":
+            renderer.update(
+                "timing",
+                "caption",
+                f"Time to first token: {event['time_to_first_token']:.2f}s",
+            )
+            stream_state["timing_shown"] = True
+        elif stage == "initial_output":
+            stream_state["initial_output"] = event["text"]
+            tokens_received = True
+            if not stream_state["timing_shown"]:
+                renderer.update(
+                    "timing",
+                    "caption",
+                    f"Initial output in {event['duration_seconds']:.2f}s",
+                )
+                stream_state["timing_shown"] = True
+        elif stage == "map_chunk":
+            # long notes: section summaries arrive before the merged output
+            stream_state["map_chunks"] += 1
+            renderer.update(
+                "map_reduce",
+                "caption",
+                f"Long notes: {stream_state['map_chunks']} parts summarized",
+            )
+        elif stage == "map_reduce":
+            renderer.update(
+                "map_reduce",
+                "caption",
+                f"Long notes summarized in {event['chunks']} parts "
+                f"({event['map_seconds']:.2f}s), merged in {event['reduce_seconds']:.2f}s",
+            )
+        elif stage in ("critique", "revision"):
+            model = f" - {event['model_id']}" if event.get("model_id") else ""
+            renderer.add_group(event["principle"], col2, ("critique", "revision"))
+            renderer.update(
+                (event["principle"], stage),
+                "markdown",
+                stage_html(
+                    stage,
+                    event[stage],
+                    f"{event['principle']} - {event['duration_seconds']:.2f}s{model}",
+                ),
+                unsafe_allow_html=True,
+            )
+        elif stage == "segment_critique":
+            # pipelined review: the critique of the latest completed part, until
+            # the reconciled critique of the principle replaces it
+            renderer.add_group(event["principle"], col2, ("critique", "revision"))
+            renderer.update(
+                (event["principle"], "critique"),
+                "markdown",
+                stage_html(
+                    "critique",
+                    event["critique"],
+                    f"{event['principle']} - part {event['segment'] + 1} - "
+                    f"{event['duration_seconds']:.2f}s",
+                ),
+                unsafe_allow_html=True,
+            )
+        elif stage == "pipelined_review":
+            renderer.update(
+                "pipelined_review",
+                "caption",
+                f"{event['segments']} parts critiqued while generating: "
+                f"{event['overlapped_seconds']:.2f}s of critiques overlapped the "
+                f"initial output, {event['review_wait_seconds']:.2f}s waited after it",
+            )
+        elif stage == "revision_skipped":
+            renderer.add_group(event["principle"], col2, ("critique", "revision"))
+            renderer.update(
+                (event["principle"], "revision"),
+                "caption",
+                "Revision skipped (no critique needed)",
+            )
+
+    if tokens_received:
+        renderer.update("initial_output", "markdown", stream_state["initial_output"])
+
+
+def queue_position_caption(renderer):
+    position = RequestScheduler.default().position(st.session_state.session_id)
+    if position is None:
+        renderer.update("queue", "empty")
+    else:
+        renderer.update(
+            "queue",
+            "caption",
+            f"Waiting for Bedrock capacity: position {position} in the queue",
+        )
+
+
+def memory_caption(chunk):
+    memory = chunk.get("memory")
+    if memory:
+        st.caption(
+            f"Conversation memory: {memory['memory_tokens']} of {memory['max_tokens']} tokens "
+            f"({memory['window_turns']} recent turns, {memory['summary_tokens']}-token summary "
+            f"of {memory['summarized_turns']} earlier turns)"
+        )
+
+
+def input_condensation_caption(chunk):
+    condensation = chunk.get("input_condensation")
+    if condensation and condensation["enabled"]:
+        st.caption(
+            f"Input condensation saved {condensation['tokens_saved']} tokens "
+            f"({condensation['bytes_saved']} bytes) over {condensation['calls']} "
+            "critique/revision calls"
+        )
+
+
+def process_logger(chunk, col2, col3, streamed=False):
+    print("logging process")
+    print("-----")
+    if streamed:
+        # critiques, revisions and the initial output were rendered by
+        # stage_logger while the chain was running
+        with col3:
+            st.markdown(
+                "<p><span class='final-output'>Output after Constitutional Review</span></p>",
+                unsafe_allow_html=True,
+            )
+            st.write(chunk["output"])
+            if "revision_calls_saved" in chunk:
+                st.caption(
+                    f"Revision calls skipped (no critique needed): {chunk['revision_calls_saved']}"
+                )
+            input_condensation_caption(chunk)
+            memory_caption(chunk)
+        return
+
+    # a complete result (semantic cache hit) is drawn once through the same
+    # keyed groups as a streamed run
+    renderer = StreamRenderer(max_fps=0)
+    verdicts = chunk.get("critique_verdicts") or []
+    for index, (critique, revision) in enumerate(chunk["critiques_and_revisions"]):
+        principle = verdicts[index]["principle"] if index < len(verdicts) else str(index)
+        renderer.add_group(principle, col2, ("critique", "revision"))
+        renderer.update(
+            (principle, "critique"),
+            "markdown",
+            stage_html("critique", critique, principle),
+            unsafe_allow_html=True,
+        )
+        if revision:
+            renderer.update(
+                (principle, "revision"),
+                "markdown",
+                stage_html("revision", revision),
+                unsafe_allow_html=True,
+            )
+    renderer.flush(force=True)
 
     with col3:
         st.markdown(
@@ -371,6 +485,13 @@ def process_logger(chunk, col2, col3):
             unsafe_allow_html=True,
         )
         st.write(chunk["output"])
+        if "revision_calls_saved" in chunk:
+            st.caption(
+                f"Revision calls skipped (no critique needed): {chunk['revision_calls_saved']}"
+            )
+        input_condensation_caption(chunk)
+        memory_caption(chunk)
 
 
-asyncio.run(main())
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,114 @@
+"""
+Compares sequential and concurrent critique execution of the constitutional
+pipeline against a stubbed model with a fixed per-call latency.
+
+    python -m benchmarks.critique_fanout --latency 0.5 --principles 3
+"""
+
+import argparse
+import time
+
+from langchain.chains import LLMChain
+from langchain.chains.constitutional_ai.models import ConstitutionalPrinciple
+from langchain.llms.base import LLM as BaseLLM
+from langchain.prompts import PromptTemplate
+
+from utils.constitutional_chain import ConstitutionalReviewChain
+
+
+critique_prompt = PromptTemplate(
+    template="{input_prompt}\n{output_from_model}\nCritique Request: {critique_request}",
+    input_variables=["input_prompt", "output_from_model", "critique_request"],
+)
+
+revision_prompt = PromptTemplate(
+    template="{input_prompt}\n{output_from_model}\nCritique Request: {critique_request}"
+    "\nCritique: {critique}\nRevision Request: {revision_request}",
+    input_variables=[
+        "input_prompt",
+        "output_from_model",
+        "critique_request",
+        "critique",
+        "revision_request",
+    ],
+)
+
+
+class SlowStubLLM(BaseLLM):
+    latency: float = 0.5
+    flag_every: int = 2
+
+    @property
+    def _llm_type(self):
+        return "slow-stub"
+
+    def _call(self, prompt, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        if "Critique Request:" in prompt and "Revision Request:" not in prompt:
+            # flag every n-th principle so that some revisions are exercised
+            index = int(prompt.rsplit("Check property ", 1)[1].split(".")[0])
+            if index % self.flag_every == 0:
+                return "The summary omits a follow-up. Critique needed."
+            return "No critique needed."
+        if "Revision Request:" in prompt:
+            return "Revised summary."
+        return "<summary>Stub summary.</summary>"
+
+
+def build_chain(llm, principle_count, execution_mode, max_concurrency):
+    principles = [
+        ConstitutionalPrinciple(
+            name=f"Stub Principle {index}",
+            critique_request=f"Check property {index}.",
+            revision_request=f"Fix property {index}.",
+        )
+        for index in range(principle_count)
+    ]
+    chain = LLMChain(
+        llm=llm,
+        prompt=PromptTemplate(template="{input_text}", input_variables=["input_text"]),
+    )
+    return ConstitutionalReviewChain.from_llm(
+        chain=chain,
+        llm=llm,
+        critique_prompt=critique_prompt,
+        revision_prompt=revision_prompt,
+        constitutional_principles=principles,
+        return_intermediate_steps=True,
+        execution_mode=execution_mode,
+        max_concurrency=max_concurrency,
+    )
+
+
+def time_run(chain, runs):
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        chain.invoke({"input_text": "Summarize the notes."})
+        durations.append(time.perf_counter() - start)
+    return sum(durations) / len(durations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--principles", type=int, default=3)
+    parser.add_argument("--max-concurrency", type=int, default=4)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    llm = SlowStubLLM(latency=args.latency)
+    results = {}
+    for execution_mode in ("sequential", "concurrent"):
+        chain = build_chain(
+            llm, args.principles, execution_mode, args.max_concurrency
+        )
+        results[execution_mode] = time_run(chain, args.runs)
+        print(f"{execution_mode:>10}: {results[execution_mode]:.3f}s per run")
+
+    speedup = results["sequential"] / results["concurrent"]
+    print(f"   speedup: {speedup:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Tail latency of LLM.call_llm with and without hedged requests, against the
+offline Bedrock stand-in (utils/bedrock_stub.py) with a fraction of slow
+responses; no AWS access needed.
+
+    python -m benchmarks.hedging_benchmark --calls 200 --slow-fraction 0.05
+"""
+
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.pipeline_benchmark import SAMPLE_PROMPT, percentile
+from utils.bedrock_client_registry import BedrockClientRegistry
+from utils.bedrock_stub import StubBedrockRuntime
+from utils.constitution import (
+    claude_inference_configuration,
+    claude_instant_model_id,
+)
+from utils.invocation_policy import InvocationPolicy
+from utils.llm import LLM
+from utils.request_scheduler import RequestScheduler
+
+
+def timed_call(llm, prompt):
+    start = time.perf_counter()
+    llm.call_llm(prompt, claude_inference_configuration, claude_instant_model_id)
+    return time.perf_counter() - start
+
+
+def run_mode(args, hedging):
+    stub = StubBedrockRuntime(
+        latency=args.latency,
+        jitter=args.jitter,
+        slow_fraction=args.slow_fraction,
+        slow_latency=args.slow_latency,
+        seed=7,
+    )
+    BedrockClientRegistry.set_override("bedrock-runtime", stub)
+    policy = InvocationPolicy(hedging=hedging, hedge_min_samples=args.warmup)
+    InvocationPolicy._default = policy
+
+    llm = LLM()
+    # the hedge delay is the p95 of these
+    for index in range(args.warmup):
+        timed_call(llm, f"{SAMPLE_PROMPT} warmup-{hedging}-{index}")
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        durations = list(
+            executor.map(
+                lambda index: timed_call(llm, f"{SAMPLE_PROMPT} #{hedging}-{index}"),
+                range(args.calls),
+            )
+        )
+    stats = policy.stats()
+    return {
+        "p50": percentile(durations, 0.50),
+        "p95": percentile(durations, 0.95),
+        "p99": percentile(durations, 0.99),
+        "requests": stub.calls,
+        "hedges_sent": stats["hedges_sent"],
+        "hedges_won": stats["hedges_won"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=30)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.3)
+    parser.add_argument("--jitter", type=float, default=0.05)
+    parser.add_argument("--slow-fraction", type=float, default=0.05)
+    parser.add_argument("--slow-latency", type=float, default=3.0)
+    args = parser.parse_args()
+
+    # measure the policy alone: no cached completions, no admission control
+    LLM.response_cache_enabled = False
+    RequestScheduler.enabled = False
+
+    print(f"{'hedging':<10}{'p50':>9}{'p95':>9}{'p99':>9}{'requests':>10}{'hedges':>9}{'won':>6}")
+    for hedging in (False, True):
+        result = run_mode(args, hedging)
+        print(
+            f"{'on' if hedging else 'off':<10}{result['p50']:>9.3f}{result['p95']:>9.3f}"
+            f"{result['p99']:>9.3f}{result['requests']:>10}"
+            f"{result['hedges_sent']:>9}{result['hedges_won']:>6}"
+        )
+
+
+if __name__ == "__main__":
+    main()
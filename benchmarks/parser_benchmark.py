@@ -0,0 +1,92 @@
+"""
+Per-call cost of MyOutputParser.parse_result and of segment parsing on large
+constitutional outputs, compared with the previous regex-per-prefix parser.
+
+    python -m benchmarks.parser_benchmark --size 200000 --iterations 200
+"""
+
+import argparse
+import re
+import timeit
+
+from langchain.schema import Generation
+
+from utils.parser import IncrementalOutputParser, MyOutputParser, parse_segments
+
+
+def legacy_parse_result(text):
+    # the parser as it was before segment parsing, without its debug print
+    text = text[0].text
+    text = text.replace("Model: ", "Assistant: ")
+    PREFIX_USER = "Human:"
+    PREFIX_SYSTEM = "System:"
+    PREFIX_ASSISTANT = "Assistant:"
+    PREFIX_INITIAL_RESPONSE = "Initial response:"
+    PREFIX_APPLYING = "Applying"
+    PREFIX_CRITIQUE = "Critique:"
+    PREFIX_UPDATED_RESPONSE = "Updated response:"
+    PREFIX_UPDATES_DONE = "Updated response: No revisions needed."
+    PREFIX_NO_REVISIONS_NEEDED = "No revisions needed."
+    re.search(r"^Received below is a conversation between", text)
+    re.search(f"^{PREFIX_USER}", text)
+    re.search(f"^{PREFIX_SYSTEM}", text)
+    re.search(f"^{PREFIX_ASSISTANT}", text)
+    find_initial_response = re.search(f"^{PREFIX_INITIAL_RESPONSE}", text)
+    re.search(f"^{PREFIX_APPLYING} .+?\\.{{3}}'", text)
+    re.search(f"^{PREFIX_CRITIQUE}", text)
+    re.search(f"^{PREFIX_UPDATED_RESPONSE}", text)
+    re.search(f"^{PREFIX_UPDATES_DONE}", text)
+    re.search(f"^{PREFIX_NO_REVISIONS_NEEDED}", text)
+    if find_initial_response:
+        text = PREFIX_ASSISTANT + text
+    text = text.replace("Model:", "Assistant:")
+    return text
+
+
+def build_output(size):
+    block = (
+        "Initial response: <summary>The patient presented with abdominal pain. "
+        "Model: recommend a repeat CT scan.</summary>\n\n"
+        "Applying Honesty Principle 01...\n\n"
+        "Critique Request: The AI Persona will be honest.\n\n"
+        "Critique: The summary is accurate. No critique needed.\n\n"
+        "Updated response: No revisions needed.\n\n"
+        "Critique: The follow-up is missing. Critique needed.\n\n"
+        "Updated response: <summary>Revised summary.</summary>\n\n"
+    )
+    return (block * (size // len(block) + 1))[:size]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=200000)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--chunk-size", type=int, default=32)
+    args = parser.parse_args()
+
+    text = build_output(args.size)
+    generations = [Generation(text=text)]
+    output_parser = MyOutputParser()
+    assert output_parser.parse_result(generations) == legacy_parse_result(generations)
+
+    def incremental():
+        stream_parser = IncrementalOutputParser()
+        for start in range(0, len(text), args.chunk_size):
+            stream_parser.feed(text[start : start + args.chunk_size])
+        stream_parser.close()
+
+    cases = {
+        "legacy parse_result": lambda: legacy_parse_result(generations),
+        "parse_result": lambda: output_parser.parse_result(generations),
+        "parse_segments": lambda: parse_segments(text),
+        f"incremental ({args.chunk_size} char chunks)": incremental,
+    }
+    print(f"{len(text)} characters, {len(parse_segments(text))} segments")
+    for name, case in cases.items():
+        iterations = max(1, args.iterations // 10) if "incremental" in name else args.iterations
+        seconds = timeit.timeit(case, number=iterations) / iterations
+        print(f"{name:>32}: {seconds * 1e6:10.1f} us/call")
+
+
+if __name__ == "__main__":
+    main()
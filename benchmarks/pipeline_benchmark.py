@@ -0,0 +1,306 @@
+"""
+End-to-end latency benchmark of the constitutional pipeline against the
+offline Bedrock stand-in (utils/bedrock_stub.py); no AWS access needed.
+
+Reports p50/p95/p99 for LLM.call_llm, the initial generation, every
+principle's critique and revision and the whole run, plus throughput at
+each concurrency level, and compares the results with a stored baseline
+(benchmarks/baseline.json, recorded against the stand-in with the default
+options; the comparison only means something for the same options).
+--compare-modes times whole runs of each execution mode against the first
+one instead, e.g. pipelined review against the sequential flow.
+
+    python -m benchmarks.pipeline_benchmark --runs 20 --concurrency 1 4 8
+    python -m benchmarks.pipeline_benchmark --update-baseline
+    python -m benchmarks.pipeline_benchmark --streaming --segment-min-chars 60 \
+        --compare-modes sequential concurrent pipelined
+"""
+
+import argparse
+import json
+import math
+import os
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.bedrock_client_registry import BedrockClientRegistry
+from utils.bedrock_stub import StubBedrockRuntime
+from utils.constitution import (
+    claude_inference_configuration,
+    claude_instant_model_id,
+)
+from utils.llm import LLM
+from utils.metrics import MetricsRegistry
+from utils.pipeline_events import PipelineEventHandler
+from utils.pipeline_factory import ConstitutionalPipelineFactory
+
+DEFAULT_BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+SAMPLE_PROMPT = """
+<notes>
+HISTORY OF PRESENT ILLNESS: The patient is a 71-year-old female with a 7- to 8-day history of abdominal pain.
+IMPRESSION AND PLAN: Working diagnosis sigmoid diverticulitis. Repeat stat CT scan of the abdomen and pelvis.
+</notes>
+"""
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    # nearest-rank percentile
+    index = max(0, math.ceil(fraction * len(ordered)) - 1)
+    return ordered[index]
+
+
+def summarize(samples):
+    return {
+        stage: {
+            "count": len(values),
+            "p50": percentile(values, 0.50),
+            "p95": percentile(values, 0.95),
+            "p99": percentile(values, 0.99),
+        }
+        for stage, values in sorted(samples.items())
+    }
+
+
+EXECUTION_MODES = ["sequential", "concurrent", "batched", "pipelined"]
+
+
+def run_pipeline_once(constitutional_chain, prompt):
+    event_handler = PipelineEventHandler()
+    start = time.perf_counter()
+    constitutional_chain.invoke(
+        {"input_text": prompt}, config={"callbacks": [event_handler]}
+    )
+    timings = {"run": time.perf_counter() - start}
+    if event_handler.time_to_first_token is not None:
+        timings["time_to_first_token"] = event_handler.time_to_first_token
+    for event in event_handler.drain():
+        if event["stage"] == "initial_output":
+            timings["initial"] = event["duration_seconds"]
+        elif event["stage"] == "map_chunk":
+            timings[f"map_chunk:{event['index']}"] = event["duration_seconds"]
+        elif event["stage"] == "pipelined_review":
+            timings["review_overlap"] = event["overlapped_seconds"]
+            timings["review_wait"] = event["review_wait_seconds"]
+        elif event["stage"] in ("critique", "revision"):
+            timings[f"{event['stage']}:{event['principle']}"] = event[
+                "duration_seconds"
+            ]
+    return timings
+
+
+def benchmark_call_llm(runs):
+    llm = LLM()
+    durations = []
+    for index in range(runs):
+        start = time.perf_counter()
+        llm.call_llm(
+            f"{SAMPLE_PROMPT} #{index}",
+            claude_inference_configuration,
+            claude_instant_model_id,
+        )
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def get_pipeline(args, execution_mode):
+    return ConstitutionalPipelineFactory.get(
+        claude_instant_model_id,
+        claude_inference_configuration,
+        execution_mode=execution_mode,
+        streaming=args.streaming,
+        condense_input=True if args.input_condensation else None,
+        model_routing=True if args.model_routing else None,
+        map_reduce=False if args.no_map_reduce else None,
+    )
+
+
+def build_chain(pipeline, args):
+    chain = pipeline.build_chain(verbose=False)
+    if args.segment_min_chars is not None:
+        chain.segment_min_chars = args.segment_min_chars
+    return chain
+
+
+def benchmark_pipeline(args):
+    results = {"stages": {}, "throughput": {}}
+    samples = defaultdict(list)
+    samples["call_llm"] = benchmark_call_llm(args.runs)
+
+    pipeline = get_pipeline(args, args.execution_mode)
+
+    for concurrency in args.concurrency:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            runs = list(
+                executor.map(
+                    lambda index: run_pipeline_once(
+                        build_chain(pipeline, args),
+                        f"{SAMPLE_PROMPT} #{concurrency}-{index}",
+                    ),
+                    range(args.runs),
+                )
+            )
+        elapsed = time.perf_counter() - start
+        results["throughput"][str(concurrency)] = args.runs / elapsed
+
+        # per-stage latency is reported for the lowest concurrency level only,
+        # where it is not inflated by queueing
+        if concurrency == min(args.concurrency):
+            for timings in runs:
+                for stage, seconds in timings.items():
+                    samples[stage].append(seconds)
+
+    results["stages"] = summarize(samples)
+    if pipeline.model_router is not None:
+        results["routing"] = pipeline.model_router.stats()
+    return results
+
+
+def compare_modes(args):
+    # one run at a time, the same prompts for every mode
+    print(f"{'execution mode':<16}{'p50':>9}{'p95':>9}{'vs ' + args.compare_modes[0]:>18}")
+    reference = None
+    for execution_mode in args.compare_modes:
+        pipeline = get_pipeline(args, execution_mode)
+        runs = [
+            run_pipeline_once(build_chain(pipeline, args), f"{SAMPLE_PROMPT} #compare-{index}")
+            for index in range(args.runs)
+        ]
+        p50 = percentile([timings["run"] for timings in runs], 0.50)
+        p95 = percentile([timings["run"] for timings in runs], 0.95)
+        reference = reference or p50
+        line = f"{execution_mode:<16}{p50:>9.3f}{p95:>9.3f}{p50 / reference - 1:>+18.1%}"
+        overlaps = [timings["review_overlap"] for timings in runs if "review_overlap" in timings]
+        if overlaps:
+            line += f"  ({percentile(overlaps, 0.50):.3f}s of critiques during generation)"
+        print(line)
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    print(f"\n{'stage':<48}{'p50':>9}{'p95':>9}{'p99':>9}{'vs p95':>10}")
+    for stage, current in results["stages"].items():
+        previous = baseline.get("stages", {}).get(stage) if baseline else None
+        change = ""
+        if previous and previous.get("p95"):
+            ratio = current["p95"] / previous["p95"] - 1
+            change = f"{ratio:+.1%}"
+            if ratio > tolerance:
+                regressions.append(stage)
+                change += " !"
+        print(
+            f"{stage:<48}{current['p50']:>9.3f}{current['p95']:>9.3f}"
+            f"{current['p99']:>9.3f}{change:>10}"
+        )
+
+    print(f"\n{'concurrency':<48}{'runs/s':>9}{'vs base':>10}")
+    for concurrency, throughput in results["throughput"].items():
+        previous = baseline.get("throughput", {}).get(concurrency) if baseline else None
+        change = ""
+        if previous:
+            ratio = throughput / previous - 1
+            change = f"{ratio:+.1%}"
+            if -ratio > tolerance:
+                regressions.append(f"throughput@{concurrency}")
+                change += " !"
+        print(f"{concurrency:<48}{throughput:>9.2f}{change:>10}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--latency", type=float, default=0.3)
+    parser.add_argument("--jitter", type=float, default=0.05)
+    parser.add_argument("--slow-fraction", type=float, default=0.0)
+    parser.add_argument("--slow-latency", type=float, default=3.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--recordings", default=None)
+    parser.add_argument(
+        "--execution-mode",
+        choices=EXECUTION_MODES,
+        default=None,
+    )
+    parser.add_argument("--compare-modes", nargs="+", choices=EXECUTION_MODES, default=None)
+    parser.add_argument(
+        "--segment-min-chars",
+        type=int,
+        default=None,
+        help="shortest segment critiqued in pipelined mode",
+    )
+    parser.add_argument("--streaming", action="store_true")
+    parser.add_argument("--input-condensation", action="store_true")
+    parser.add_argument("--model-routing", action="store_true")
+    parser.add_argument("--no-map-reduce", action="store_true")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    parser.add_argument(
+        "--metrics", action="store_true", help="print the collected metrics"
+    )
+    args = parser.parse_args()
+
+    stub_options = dict(
+        latency=args.latency,
+        jitter=args.jitter,
+        slow_fraction=args.slow_fraction,
+        slow_latency=args.slow_latency,
+        throttle_rate=args.throttle_rate,
+        seed=7,
+    )
+    if args.recordings:
+        stub = StubBedrockRuntime.from_recordings_file(args.recordings, **stub_options)
+    else:
+        stub = StubBedrockRuntime(**stub_options)
+    BedrockClientRegistry.set_override("bedrock-runtime", stub)
+    # every prompt would be a cache hit after the first run
+    LLM.response_cache_enabled = False
+
+    if args.compare_modes:
+        compare_modes(args)
+        return
+
+    results = benchmark_pipeline(args)
+    results["stub"] = stub_options
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline.get("stub") != stub_options:
+            print(
+                f"Baseline was recorded with stub options {baseline.get('stub')}, "
+                f"this run uses {stub_options}"
+            )
+    regressions = compare(results, baseline, args.tolerance)
+    for tier, stats in results.get("routing", {}).items():
+        print(
+            f"{tier} tier ({stats['model_id']}): {stats['calls']} calls, "
+            f"{stats['mean_seconds']:.3f}s mean, ${stats['estimated_cost_usd']:.4f}"
+        )
+    if args.metrics:
+        print()
+        print(MetricsRegistry.default().render())
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as baseline_file:
+            json.dump(results, baseline_file, indent=2)
+        print(f"\nBaseline written to {args.baseline}")
+    elif baseline is None:
+        print("\nNo baseline yet, run with --update-baseline to store one")
+    elif regressions:
+        print(f"\nRegressed beyond {args.tolerance:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
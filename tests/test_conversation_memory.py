@@ -0,0 +1,28 @@
+from utils.conversation_memory import SUMMARY_LABEL, ConversationWindow
+
+NOTE = "HISTORY OF PRESENT ILLNESS: " + "chest pain on exertion. " * 200
+
+
+def test_without_summarizer_evicted_turns_are_bounded():
+    window = ConversationWindow(max_tokens=1500, max_summary_tokens=300, window_turns=4)
+    for turn in range(200):
+        window.add_turn(f"{turn} {NOTE}", f"summary {turn}")
+
+    pending = sum(window.estimate_tokens(line) + 1 for line in window._pending)
+    assert pending <= window.max_summary_tokens
+    assert window._pending[-1].endswith("summary 195")
+    stats = window.stats()
+    assert stats["memory_tokens"] <= window.max_tokens
+    assert stats["summary_calls"] == 0
+
+
+def test_without_summarizer_recent_evictions_are_rendered():
+    window = ConversationWindow(max_tokens=1500, max_summary_tokens=300, window_turns=1)
+    window.add_turn("first question", "first answer")
+    window.add_turn("second question", "second answer")
+
+    assert window.render() == (
+        SUMMARY_LABEL
+        + "Human: first question\nAssistant: first answer\n"
+        + "Human: second question\nAssistant: second answer"
+    )
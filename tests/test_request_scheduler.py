@@ -0,0 +1,81 @@
+from utils.request_scheduler import RequestScheduler
+
+MODEL_ID = "anthropic.claude-instant-v1"
+THROTTLED = {
+    "Error": {"Code": "ThrottlingException", "Message": "Too many requests"},
+    "ResponseMetadata": {"HTTPStatusCode": 429, "RetryAttempts": 0},
+}
+
+
+class Events:
+    # the subset of botocore's HierarchicalEmitter instrument_client uses
+    def __init__(self):
+        self.handlers = {}
+
+    def register(self, event_name, handler, unique_id=None):
+        self.handlers[unique_id or handler] = (event_name, handler)
+
+    def emit(self, event_name, **kwargs):
+        for name, handler in list(self.handlers.values()):
+            if event_name == name or event_name.startswith(name + "."):
+                handler(**kwargs)
+
+
+class Client:
+    def __init__(self):
+        self.meta = type("Meta", (), {"events": Events()})()
+
+
+def throttled_call(client, attempts=1):
+    # the events botocore emits for one call whose attempts are all throttled
+    context = {}
+    events = client.meta.events
+    events.emit(
+        "before-parameter-build.bedrock-runtime.InvokeModel",
+        params={"modelId": MODEL_ID},
+        context=context,
+    )
+    for attempt in range(1, attempts + 1):
+        events.emit(
+            "needs-retry.bedrock-runtime.InvokeModel",
+            response=(None, THROTTLED),
+            attempts=attempt,
+            request_dict={"context": context},
+        )
+    parsed = dict(THROTTLED, ResponseMetadata=dict(THROTTLED["ResponseMetadata"]))
+    parsed["ResponseMetadata"]["RetryAttempts"] = attempts - 1
+    events.emit("after-call.bedrock-runtime.InvokeModel", parsed=parsed, context=context)
+
+
+def test_one_throttled_response_lowers_the_rate_once():
+    scheduler = RequestScheduler(default_rate=10, default_burst=20)
+    client = scheduler.instrument_client(Client())
+
+    throttled_call(client)
+
+    stats = scheduler.stats()[MODEL_ID]
+    assert stats["throttled"] == 1
+    assert stats["rate"] == 7.0
+
+
+def test_each_throttled_attempt_lowers_the_rate():
+    scheduler = RequestScheduler(default_rate=10, default_burst=20)
+    client = scheduler.instrument_client(Client())
+
+    throttled_call(client, attempts=3)
+
+    stats = scheduler.stats()[MODEL_ID]
+    assert stats["throttled"] == 3
+    assert stats["rate"] == round(10 * 0.7**3, 3)
+
+
+def test_call_admitted_ahead_of_the_hook_is_admitted_once():
+    scheduler = RequestScheduler(default_rate=10, default_burst=20)
+    client = scheduler.instrument_client(Client())
+
+    with scheduler.admitted(MODEL_ID):
+        throttled_call(client)
+
+    stats = scheduler.stats()[MODEL_ID]
+    assert stats["admitted"] == 1
+    assert stats["throttled"] == 1
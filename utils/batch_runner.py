@@ -0,0 +1,264 @@
+"""
+Headless batch runner for the constitutional pipeline.
+
+Reads prompts from a JSONL file (one object per line with an "id" and a
+"prompt" field), runs each one through the same principles and
+critique/revision prompts as the Streamlit app and appends one result per
+line to the output JSONL file. Records already written successfully to the
+output file are skipped, so an interrupted run can be resumed by running the
+same command again. A malformed input line, or a record without the prompt
+field, is written as an error result with its line number and the run
+continues.
+
+    python -m utils.batch_runner --input notes.jsonl --output results.jsonl --concurrency 8
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.constitution import (
+    claude_inference_configuration,
+    claude_instant_model_id,
+)
+from utils.llm import LLM
+from utils.metrics import MetricsExporter
+from utils.pipeline_factory import ConstitutionalPipelineFactory
+from utils.request_scheduler import RequestScheduler
+
+
+class BatchRunner:
+    def __init__(
+        self,
+        constitutional_chain,
+        concurrency=4,
+        id_field="id",
+        prompt_field="prompt",
+        progress_every=25,
+        pipeline=None,
+        priority=1,
+    ):
+        # with a pipeline, near-duplicate prompts are served from its semantic cache
+        self.pipeline = pipeline
+        self.priority = priority
+        self.constitutional_chain = constitutional_chain
+        self.concurrency = concurrency
+        self.id_field = id_field
+        self.prompt_field = prompt_field
+        self.progress_every = progress_every
+
+    def read_completed_ids(self, output_path):
+        completed = set()
+        if not os.path.exists(output_path):
+            return completed
+        with open(output_path) as output_file:
+            for line_number, line in enumerate(output_file, start=1):
+                try:
+                    record = json.loads(line)
+                    if record["status"] == "ok":
+                        completed.add(record["id"])
+                except json.JSONDecodeError:
+                    # a line cut short by a crash; the record is re-run
+                    continue
+                except (KeyError, TypeError) as e:
+                    print(f"{output_path}:{line_number}: not a result record ({e!r}), ignored")
+        return completed
+
+    def read_records(self, input_path, completed):
+        with open(input_path) as input_file:
+            for line_number, line in enumerate(input_file, start=1):
+                line = line.strip()
+                if not line:
+                    continue
+                # yields (record id, prompt, line number, error)
+                record_id, prompt, error = str(line_number), None, None
+                try:
+                    record = json.loads(line)
+                    record_id = str(record.get(self.id_field, line_number))
+                    prompt = record[self.prompt_field]
+                except json.JSONDecodeError as e:
+                    error = f"JSONDecodeError: {e}"
+                except KeyError:
+                    error = f"KeyError: no {self.prompt_field!r} field"
+                except AttributeError:
+                    error = "TypeError: not a JSON object"
+                if record_id in completed:
+                    continue
+                yield record_id, prompt, line_number, error
+
+    def run_record(self, record_id, prompt):
+        # batch calls share Bedrock with the app's sessions at a lower priority
+        with RequestScheduler.session("batch", priority=self.priority):
+            return self._run_record(record_id, prompt)
+
+    def _run_record(self, record_id, prompt):
+        started_at = time.time()
+        start = time.perf_counter()
+        result = {"id": record_id}
+        try:
+            chain_output, embedding = None, None
+            if self.pipeline is not None:
+                chain_output, embedding = self.pipeline.semantic_lookup(prompt)
+            if chain_output is None:
+                chain_output = self.constitutional_chain.invoke({"input_text": prompt})
+                if self.pipeline is not None:
+                    self.pipeline.semantic_store(embedding, chain_output)
+            else:
+                result["semantic_cache_similarity"] = chain_output[
+                    "semantic_cache_similarity"
+                ]
+            result["status"] = "ok"
+            result["initial_output"] = chain_output.get("initial_output")
+            result["output"] = chain_output["output"]
+            result["critiques_and_revisions"] = chain_output.get(
+                "critiques_and_revisions"
+            )
+            result["critique_verdicts"] = chain_output.get("critique_verdicts")
+            result["revision_calls_saved"] = chain_output.get("revision_calls_saved")
+            if "input_condensation" in chain_output:
+                result["input_condensation"] = chain_output["input_condensation"]
+            if chain_output.get("map_reduce"):
+                result["map_reduce"] = chain_output["map_reduce"]
+        except Exception as e:
+            result["status"] = "error"
+            result["error"] = f"{type(e).__name__}: {e}"
+        result["timings"] = {
+            "started_at": started_at,
+            "duration_seconds": round(time.perf_counter() - start, 4),
+        }
+        return result
+
+    async def run(self, input_path, output_path):
+        completed = self.read_completed_ids(output_path)
+        if completed:
+            print(f"Resuming: {len(completed)} records already completed")
+
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        counts = {"ok": 0, "error": 0}
+        start = time.perf_counter()
+
+        with open(output_path, "a") as output_file, ThreadPoolExecutor(
+            max_workers=self.concurrency
+        ) as executor:
+            if output_file.tell() > 0:
+                with open(output_path, "rb") as existing:
+                    existing.seek(-1, os.SEEK_END)
+                    if existing.read(1) != b"\n":
+                        output_file.write("\n")
+
+            async def worker():
+                while True:
+                    item = await queue.get()
+                    if item is None:
+                        queue.task_done()
+                        return
+                    record_id, prompt, line_number, error = item
+                    if error is None:
+                        result = await loop.run_in_executor(
+                            executor, self.run_record, record_id, prompt
+                        )
+                    else:
+                        result = {
+                            "id": record_id,
+                            "status": "error",
+                            "error": error,
+                            "line": line_number,
+                        }
+                    output_file.write(json.dumps(result) + "\n")
+                    output_file.flush()
+                    counts[result["status"]] += 1
+                    processed = counts["ok"] + counts["error"]
+                    if processed % self.progress_every == 0:
+                        elapsed = time.perf_counter() - start
+                        print(
+                            f"{processed} records, {processed / elapsed:.2f} records/s"
+                        )
+                    queue.task_done()
+
+            workers = [
+                asyncio.create_task(worker()) for _ in range(self.concurrency)
+            ]
+            for item in self.read_records(input_path, completed):
+                await queue.put(item)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+
+        elapsed = time.perf_counter() - start
+        processed = counts["ok"] + counts["error"]
+        summary = {
+            "processed": processed,
+            "succeeded": counts["ok"],
+            "failed": counts["error"],
+            "skipped": len(completed),
+            "elapsed_seconds": round(elapsed, 3),
+            "records_per_second": round(processed / elapsed, 3) if elapsed else 0.0,
+        }
+        print(json.dumps(summary))
+        return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--input", required=True)
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--id-field", default="id")
+    parser.add_argument("--prompt-field", default="prompt")
+    parser.add_argument(
+        "--execution-mode",
+        choices=["sequential", "concurrent", "batched", "pipelined"],
+        default=None,
+    )
+    parser.add_argument("--model-id", default=claude_instant_model_id)
+    parser.add_argument(
+        "--input-condensation",
+        action="store_true",
+        help="send critique calls a digest of long inputs instead of the full input",
+    )
+    parser.add_argument(
+        "--no-map-reduce",
+        action="store_true",
+        help="summarize long notes in one call instead of section by section",
+    )
+    parser.add_argument(
+        "--model-routing",
+        action="store_true",
+        help="run critiques and revisions on the tiers of utils/model_router.py",
+    )
+    args = parser.parse_args()
+
+    MetricsExporter.start_from_environment()
+    pipeline = ConstitutionalPipelineFactory.get(
+        args.model_id,
+        claude_inference_configuration,
+        execution_mode=args.execution_mode,
+        condense_input=True if args.input_condensation else None,
+        model_routing=True if args.model_routing else None,
+        map_reduce=False if args.no_map_reduce else None,
+    )
+    constitutional_chain = pipeline.build_chain(verbose=False)
+    runner = BatchRunner(
+        constitutional_chain,
+        concurrency=args.concurrency,
+        id_field=args.id_field,
+        prompt_field=args.prompt_field,
+        pipeline=pipeline,
+    )
+    asyncio.run(runner.run(args.input, args.output))
+    if pipeline.model_router is not None:
+        print(json.dumps({"routing": pipeline.model_router.stats()}))
+    if RequestScheduler.enabled:
+        print(json.dumps({"scheduler": RequestScheduler.default().stats()}))
+    if LLM.semantic_cache() is not None:
+        print(json.dumps({"semantic_cache": LLM.semantic_cache().stats()}))
+
+
+if __name__ == "__main__":
+    main()
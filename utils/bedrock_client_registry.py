@@ -0,0 +1,154 @@
+import threading
+
+import boto3
+from botocore.config import Config
+
+from utils.metrics import instrument_client
+from utils.request_scheduler import RequestScheduler
+
+
+class BedrockClientRegistry:
+    """Process-wide pool of boto3 sessions and clients.
+
+    boto3 clients are thread-safe once created, sessions are not, so creation
+    happens under a lock and the resulting clients are shared by every thread
+    and Streamlit session in the process.
+    """
+
+    _lock = threading.Lock()
+    _sessions = {}
+    _clients = {}
+    _in_flight = {}
+    _overrides = {}
+
+    _stats = {
+        "sessions_created": 0,
+        "clients_created": 0,
+        "clients_reused": 0,
+        "requests_started": 0,
+        "pool_saturated": 0,
+        "peak_in_flight": 0,
+    }
+
+    @classmethod
+    def get_client(
+        cls,
+        service_name="bedrock-runtime",
+        region_name="us-west-2",
+        endpoint_url=None,
+        max_pool_connections=50,
+        retry_mode="adaptive",
+        max_attempts=3,
+        read_timeout=60,
+        connect_timeout=60,
+        profile_name=None,
+    ):
+        override = cls._overrides.get(service_name)
+        if override is not None:
+            return override
+
+        key = (
+            service_name,
+            region_name,
+            endpoint_url,
+            max_pool_connections,
+            retry_mode,
+            max_attempts,
+            read_timeout,
+            connect_timeout,
+            profile_name,
+        )
+
+        client = cls._clients.get(key)
+        if client is not None:
+            with cls._lock:
+                cls._stats["clients_reused"] += 1
+            return client
+
+        with cls._lock:
+            client = cls._clients.get(key)
+            if client is not None:
+                cls._stats["clients_reused"] += 1
+                return client
+
+            session = cls._sessions.get(profile_name)
+            if session is None:
+                session = boto3.Session(profile_name=profile_name)
+                cls._sessions[profile_name] = session
+                cls._stats["sessions_created"] += 1
+
+            config = Config(
+                read_timeout=read_timeout,
+                connect_timeout=connect_timeout,
+                max_pool_connections=max_pool_connections,
+                retries={"mode": retry_mode, "max_attempts": max_attempts},
+            )
+            client = session.client(
+                service_name=service_name,
+                region_name=region_name,
+                endpoint_url=endpoint_url,
+                config=config,
+            )
+            cls._instrument(client, key, max_pool_connections)
+            cls._clients[key] = client
+            cls._in_flight[key] = 0
+            cls._stats["clients_created"] += 1
+
+        return client
+
+    @classmethod
+    def _instrument(cls, client, key, max_pool_connections):
+        def before_call(**kwargs):
+            with cls._lock:
+                cls._in_flight[key] += 1
+                in_flight = cls._in_flight[key]
+                cls._stats["requests_started"] += 1
+                if in_flight > cls._stats["peak_in_flight"]:
+                    cls._stats["peak_in_flight"] = in_flight
+                if in_flight > max_pool_connections:
+                    cls._stats["pool_saturated"] += 1
+
+        def after_call(**kwargs):
+            with cls._lock:
+                cls._in_flight[key] -= 1
+
+        # botocore's emitter is hierarchical, so these prefixes match every
+        # operation of the client ("before-call.bedrock-runtime.InvokeModel", ...)
+        client.meta.events.register("before-call", before_call)
+        client.meta.events.register("after-call", after_call)
+        client.meta.events.register("after-call-error", after_call)
+        # the scheduler's hooks run first, so bedrock_call_seconds starts
+        # once the call is admitted and excludes scheduler_wait_seconds
+        if RequestScheduler.enabled:
+            RequestScheduler.default().instrument_client(client)
+        instrument_client(client)
+
+    @classmethod
+    def set_override(cls, service_name, client):
+        # serve a stand-in client (e.g. StubBedrockRuntime) for a service
+        with cls._lock:
+            if client is None:
+                cls._overrides.pop(service_name, None)
+            else:
+                if RequestScheduler.enabled:
+                    RequestScheduler.default().instrument_client(client)
+                instrument_client(client)
+                cls._overrides[service_name] = client
+
+    @classmethod
+    def stats(cls):
+        with cls._lock:
+            stats = dict(cls._stats)
+            stats["clients_pooled"] = len(cls._clients)
+            stats["in_flight"] = sum(cls._in_flight.values())
+        return stats
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._sessions.clear()
+            cls._clients.clear()
+            cls._in_flight.clear()
+            cls._overrides.clear()
+            for name in cls._stats:
+                cls._stats[name] = 0
@@ -0,0 +1,197 @@
+import asyncio
+import contextlib
+import contextvars
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.invocation_policy import DeadlineExceeded, remaining_deadline
+from utils.metrics import MetricsRegistry
+from utils.request_scheduler import RequestScheduler
+
+
+class BedrockInvoker:
+    """Managed executors and per-model concurrency limits for Bedrock calls.
+
+    Blocking boto3 calls run on managed thread pools, so coroutines from any
+    event loop (each Streamlit rerun has its own) can await them. A call
+    made for a known model (run(..., model_id=...)) runs on that model's own
+    pool, sized to its limit, so calls waiting for a saturated model never
+    hold threads other models or the embeddings need; other calls share one
+    pool.
+
+    The limits themselves are plain threading semaphores taken around each
+    runtime call by the client proxy of wrap() (see LimitedBedrockRuntime),
+    so they apply to synchronous callers and to the LangChain Bedrock
+    clients of the pipeline as well. The proxy has the RequestScheduler admit
+    a call before it waits for a slot, so priorities, session fairness and
+    max_wait apply to every waiting call, not only to those holding a slot.
+    """
+
+    _default = None
+    _default_lock = threading.Lock()
+
+    def __init__(self, max_workers=32, default_model_concurrency=8, model_concurrency=None):
+        self.default_model_concurrency = default_model_concurrency
+        self.model_concurrency = dict(model_concurrency or {})
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="bedrock-invoker"
+        )
+        self._lock = threading.Lock()
+        self._semaphores = {}
+        self._model_executors = {}
+        self._clients = {}
+        self._stats = {}
+
+    @classmethod
+    def default(cls):
+        if cls._default is None:
+            with cls._default_lock:
+                if cls._default is None:
+                    cls._default = cls(
+                        max_workers=int(os.environ.get("BEDROCK_INVOKER_WORKERS", "32")),
+                        default_model_concurrency=int(
+                            os.environ.get("BEDROCK_MODEL_CONCURRENCY", "8")
+                        ),
+                    )
+        return cls._default
+
+    def model_limit(self, model_id):
+        return self.model_concurrency.get(model_id, self.default_model_concurrency)
+
+    def _semaphore(self, model_id):
+        semaphore = self._semaphores.get(model_id)
+        if semaphore is None:
+            with self._lock:
+                semaphore = self._semaphores.get(model_id)
+                if semaphore is None:
+                    limit = self.model_limit(model_id)
+                    semaphore = threading.BoundedSemaphore(limit)
+                    self._semaphores[model_id] = semaphore
+                    self._stats[model_id] = {
+                        "limit": limit,
+                        "in_flight": 0,
+                        "calls": 0,
+                        "queue_seconds": 0.0,
+                    }
+        return semaphore
+
+    @contextlib.contextmanager
+    def limit(self, model_id, timeout=None):
+        semaphore = self._semaphore(model_id)
+        queued_at = time.perf_counter()
+        if timeout is None:
+            semaphore.acquire()
+        elif not semaphore.acquire(timeout=max(0.0, timeout)):
+            raise DeadlineExceeded(f"no {model_id} slot free before the deadline")
+        queue_seconds = time.perf_counter() - queued_at
+        with self._lock:
+            stats = self._stats[model_id]
+            stats["in_flight"] += 1
+            stats["calls"] += 1
+            stats["queue_seconds"] += queue_seconds
+        MetricsRegistry.default().observe(
+            "bedrock_queue_seconds", queue_seconds, model=model_id
+        )
+        try:
+            yield queue_seconds
+        finally:
+            with self._lock:
+                self._stats[model_id]["in_flight"] -= 1
+            semaphore.release()
+
+    def _executor_for(self, model_id):
+        if model_id is None:
+            return self._executor
+        with self._lock:
+            executor = self._model_executors.get(model_id)
+            if executor is None:
+                executor = ThreadPoolExecutor(
+                    max_workers=self.model_limit(model_id),
+                    thread_name_prefix=f"bedrock-invoker-{model_id}",
+                )
+                self._model_executors[model_id] = executor
+            return executor
+
+    async def run(self, function, *args, model_id=None, **kwargs):
+        loop = asyncio.get_running_loop()
+        # the context carries the caller's RequestScheduler session
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(
+            self._executor_for(model_id),
+            functools.partial(context.run, function, *args, **kwargs),
+        )
+
+    def wrap(self, client):
+        # one proxy per client, see LimitedBedrockRuntime
+        with self._lock:
+            proxy = self._clients.get(id(client))
+            if proxy is None:
+                proxy = LimitedBedrockRuntime(client, self)
+                self._clients[id(client)] = proxy
+            return proxy
+
+    def stats(self):
+        with self._lock:
+            return {model_id: dict(stats) for model_id, stats in self._stats.items()}
+
+
+class LimitedBedrockRuntime:
+    """bedrock-runtime client whose model calls hold a slot of their model.
+
+    A call is admitted by the RequestScheduler (when enabled) before it
+    waits for its slot; neither wait outlasts the call's deadline (see
+    utils/invocation_policy.py), and a call whose deadline passed while it
+    waited is not sent. A streamed call keeps its slot until its event stream is exhausted or
+    closed. Everything else (meta, events, other operations) is the wrapped
+    client's.
+    """
+
+    def __init__(self, client, invoker):
+        self._client = client
+        self._invoker = invoker
+
+    @staticmethod
+    def _admitted(model_id):
+        _check_deadline(model_id)
+        if not RequestScheduler.enabled or not model_id:
+            return contextlib.nullcontext()
+        return RequestScheduler.default().admitted(model_id, max_wait=remaining_deadline())
+
+    def invoke_model(self, **kwargs):
+        model_id = kwargs.get("modelId", "")
+        with self._admitted(model_id), self._invoker.limit(model_id, remaining_deadline()):
+            _check_deadline(model_id)
+            return self._client.invoke_model(**kwargs)
+
+    def invoke_model_with_response_stream(self, **kwargs):
+        model_id = kwargs.get("modelId", "")
+        with self._admitted(model_id):
+            slot = contextlib.ExitStack()
+            slot.enter_context(self._invoker.limit(model_id, remaining_deadline()))
+            try:
+                _check_deadline(model_id)
+                response = self._client.invoke_model_with_response_stream(**kwargs)
+            except BaseException:
+                slot.close()
+                raise
+        response["body"] = _release_after(response["body"], slot)
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+def _check_deadline(model_id):
+    remaining = remaining_deadline()
+    if remaining is not None and remaining <= 0:
+        raise DeadlineExceeded(f"{model_id} call reached its deadline before it was sent")
+
+
+def _release_after(events, slot):
+    try:
+        yield from events
+    finally:
+        slot.close()
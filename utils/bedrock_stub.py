@@ -0,0 +1,248 @@
+import hashlib
+import io
+import json
+import random
+import re
+import threading
+import time
+
+from botocore.exceptions import ClientError
+from botocore.hooks import HierarchicalEmitter
+
+
+class _StubMeta:
+    def __init__(self, region_name):
+        self.region_name = region_name
+        self.service_model = None
+        self.events = HierarchicalEmitter()
+
+
+class StubBedrockRuntime:
+    """In-process stand-in for a boto3 bedrock-runtime client.
+
+    Answers invoke_model and invoke_model_with_response_stream with recorded
+    or synthetic completions in the response format of each provider, after
+    a configurable latency. A fraction of the calls can be made slow
+    (slow_fraction/slow_latency) or throttled (throttle_rate), which raise
+    the same ThrottlingException boto3 raises.
+
+    Install it with BedrockClientRegistry.set_override("bedrock-runtime",
+    stub) so that LLM and every Bedrock object built by it use the stub.
+    Like boto3 it emits the before-parameter-build, after-call and
+    after-call-error events, so client instrumentation sees its calls.
+    """
+
+    def __init__(
+        self,
+        latency=0.5,
+        jitter=0.1,
+        first_token_latency=None,
+        slow_fraction=0.0,
+        slow_latency=5.0,
+        throttle_rate=0.0,
+        critique_flag_rate=0.3,
+        recordings=None,
+        seed=None,
+        region_name="us-west-2",
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.first_token_latency = first_token_latency
+        self.slow_fraction = slow_fraction
+        self.slow_latency = slow_latency
+        self.throttle_rate = throttle_rate
+        self.critique_flag_rate = critique_flag_rate
+        self.recordings = dict(recordings or {})
+        self.meta = _StubMeta(region_name)
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.throttled = 0
+
+    @classmethod
+    def from_recordings_file(cls, path, **kwargs):
+        # JSONL lines of {"prompt": ..., "completion": ...}
+        recordings = {}
+        with open(path) as recordings_file:
+            for line in recordings_file:
+                if line.strip():
+                    record = json.loads(line)
+                    recordings[cls.prompt_key(record["prompt"])] = record["completion"]
+        return cls(recordings=recordings, **kwargs)
+
+    @staticmethod
+    def prompt_key(prompt):
+        return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+    def invoke_model(self, body, modelId, accept=None, contentType=None, **kwargs):
+        context = self._before_call("InvokeModel", body, modelId)
+        request = json.loads(body)
+        self._admit("InvokeModel", context)
+        time.sleep(self._latency())
+
+        prompt = self._prompt(request)
+        response_body = json.dumps(self._response_body(modelId, prompt)).encode("utf-8")
+        headers = self._usage_headers(prompt, response_body)
+        headers["content-length"] = str(len(response_body))
+        response = {
+            "body": io.BytesIO(response_body),
+            "contentType": "application/json",
+            "ResponseMetadata": {
+                "HTTPStatusCode": 200,
+                "HTTPHeaders": headers,
+                "RetryAttempts": 0,
+            },
+        }
+        self._emit("after-call", "InvokeModel", parsed=response, context=context)
+        return response
+
+    def invoke_model_with_response_stream(
+        self, body, modelId, accept=None, contentType=None, **kwargs
+    ):
+        context = self._before_call("InvokeModelWithResponseStream", body, modelId)
+        request = json.loads(body)
+        self._admit("InvokeModelWithResponseStream", context)
+        latency = self._latency()
+        first_token_latency = (
+            self.first_token_latency
+            if self.first_token_latency is not None
+            else latency * 0.2
+        )
+        time.sleep(min(first_token_latency, latency))
+
+        completion = self._completion(modelId, self._prompt(request))
+        pieces = completion.split(" ")
+        per_piece = max(0.0, latency - first_token_latency) / len(pieces)
+
+        def events():
+            for index, piece in enumerate(pieces):
+                if index:
+                    time.sleep(per_piece)
+                    piece = " " + piece
+                last = index == len(pieces) - 1
+                yield {
+                    "chunk": {
+                        "bytes": json.dumps(
+                            self._stream_chunk(modelId, piece, last)
+                        ).encode("utf-8")
+                    }
+                }
+
+        response = {
+            "body": events(),
+            "contentType": "application/json",
+            "ResponseMetadata": {"HTTPStatusCode": 200, "RetryAttempts": 0},
+        }
+        self._emit(
+            "after-call", "InvokeModelWithResponseStream", parsed=response, context=context
+        )
+        return response
+
+    def _emit(self, event, operation, **kwargs):
+        self.meta.events.emit(f"{event}.bedrock-runtime.{operation}", **kwargs)
+
+    def _before_call(self, operation, body, model_id):
+        context = {}
+        self._emit(
+            "before-parameter-build",
+            operation,
+            params={"body": body, "modelId": model_id},
+            model=None,
+            context=context,
+        )
+        return context
+
+    def _admit(self, operation, context):
+        with self._lock:
+            self.calls += 1
+            throttled = self._random.random() < self.throttle_rate
+            if throttled:
+                self.throttled += 1
+        if throttled:
+            error_response = {
+                "Error": {
+                    "Code": "ThrottlingException",
+                    "Message": "Too many requests, please wait before trying again.",
+                },
+                "ResponseMetadata": {"HTTPStatusCode": 429, "RetryAttempts": 0},
+            }
+            self._emit("after-call", operation, parsed=error_response, context=context)
+            raise ClientError(error_response, operation)
+
+    def _latency(self):
+        with self._lock:
+            slow = self._random.random() < self.slow_fraction
+            jitter = self._random.uniform(-self.jitter, self.jitter)
+        if slow:
+            return self.slow_latency
+        return max(0.0, self.latency + jitter)
+
+    def _prompt(self, request):
+        if "prompt" in request:
+            return request["prompt"]
+        return request.get("inputText", "")
+
+    def _completion(self, model_id, prompt):
+        recorded = self.recordings.get(self.prompt_key(prompt))
+        if recorded is not None:
+            return recorded
+
+        # deterministic per prompt, so repeated runs flag the same principles
+        digest = int(self.prompt_key(prompt)[:8], 16) / 0xFFFFFFFF
+        if "Revision Request:" in prompt:
+            return " <summary>Revised summary of the clinical notes.</summary>"
+        if "Critique Requests:" in prompt:
+            # batched critique: one answer per <principle index="N"> element
+            critiques = []
+            for index in re.findall(r'<principle index="(\d+)">', prompt):
+                flagged = (
+                    int(self.prompt_key(prompt + index)[:8], 16) / 0xFFFFFFFF
+                    < self.critique_flag_rate
+                )
+                verdict = (
+                    "The summary omits the recommended follow-up. Critique needed."
+                    if flagged
+                    else "The summary is accurate and complete. No critique needed."
+                )
+                critiques.append(f'<critique index="{index}">{verdict}</critique>')
+            return " " + "\n".join(critiques)
+        if "Critique Request:" in prompt:
+            if digest < self.critique_flag_rate:
+                return " The summary omits the recommended follow-up. Critique needed."
+            return " The summary is accurate and complete. No critique needed."
+        return (
+            " <summary>71-year-old female with one week of left lower quadrant "
+            "abdominal pain; working diagnosis sigmoid diverticulitis.\n\n"
+            "Plan: repeat CT of abdomen and pelvis, NPO, colorectal consult and "
+            "colonoscopy.</summary>"
+        )
+
+    def _response_body(self, model_id, prompt):
+        if model_id.startswith("amazon.titan-embed"):
+            seed = int(self.prompt_key(prompt)[:8], 16)
+            generator = random.Random(seed)
+            return {
+                "embedding": [generator.uniform(-1, 1) for _ in range(1536)],
+                "inputTextTokenCount": len(prompt) // 4,
+            }
+
+        completion = self._completion(model_id, prompt)
+        if model_id.startswith("meta."):
+            return {"generation": completion, "stop_reason": "stop"}
+        if model_id.startswith("amazon."):
+            return {"results": [{"outputText": completion}]}
+        return {"completion": completion, "stop_reason": "stop_sequence"}
+
+    def _stream_chunk(self, model_id, piece, last):
+        if model_id.startswith("meta."):
+            return {"generation": piece, "stop_reason": "stop" if last else None}
+        if model_id.startswith("amazon."):
+            return {"outputText": piece}
+        return {"completion": piece, "stop_reason": "stop_sequence" if last else None}
+
+    def _usage_headers(self, prompt, response_body):
+        return {
+            "x-amzn-bedrock-input-token-count": str(len(prompt) // 4),
+            "x-amzn-bedrock-output-token-count": str(len(response_body) // 4),
+        }
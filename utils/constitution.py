@@ -0,0 +1,277 @@
+from langchain.prompts import PromptTemplate
+from langchain.chains.constitutional_ai.models import ConstitutionalPrinciple
+
+from utils.inference_configuration_manager import InferenceConfigurationRegistry
+
+claude_v2_1_model_id = "anthropic.claude-v2:1"
+llama_model_id = "meta.llama2-13b-chat-v1"
+claude_instant_model_id = "anthropic.claude-instant-v1"
+
+# registered claude configurations (llm_configurations.json) with the
+# sampling settings used by this application
+claude_inference_configuration = (
+    InferenceConfigurationRegistry.default()
+    .get(
+        claude_instant_model_id,
+        temperature=0.2,
+        top_p=0.2,
+        top_k=100,
+        max_tokens_to_sample=1000,
+    )
+    .as_dict()
+)
+claude_v2_1_inference_configuration = (
+    InferenceConfigurationRegistry.default()
+    .get(
+        claude_v2_1_model_id,
+        temperature=0.2,
+        top_p=0.2,
+        top_k=100,
+        max_tokens_to_sample=1000,
+    )
+    .as_dict()
+)
+
+# "sequential" critiques one principle at a time, "concurrent" critiques all
+# principles against the initial output at once, "batched" critiques all
+# principles in one call and issues one combined revision, "pipelined"
+# critiques each completed segment of the streamed initial output while the
+# rest is generated. The other modes change what each critique sees (the
+# initial output instead of the previous revision), so they are opt-in
+critique_execution_mode = "sequential"
+critique_max_concurrency = 3
+
+# "pipelined" mode: segments are paragraphs or <summary> sections of at least
+# pipelined_segment_min_chars; each one costs a critique call per principle.
+# Principles whose requirements concern the response as a whole are only
+# critiqued on the complete output
+pipelined_segment_min_chars = 400
+pipelined_max_segments = 4
+
+# critique prompts get a digest of long inputs instead of the full text, see
+# utils/input_condenser.py; off by default as the digest can leave out facts
+# a critique should check. Revisions always get the full input
+input_condensation_enabled = False
+input_condensation_max_prompt_tokens = 2000
+input_condensation_max_digest_tokens = 450
+
+# tiered model routing, see utils/model_router.py, off by default: every
+# stage runs on the selected model. When enabled, stages run on the tier of
+# stage_model_tiers; escalate_flagged_revisions sends revisions of flagged
+# outputs to the large tier and critiques below min_critic_confidence are
+# re-run there (both off unless set). principle_model_tiers pins a
+# (stage, principle name) to a tier,
+# e.g. {("revision", "Clinical Hippocratic Principle"): "small"}
+model_routing_enabled = False
+model_tiers = {"small": claude_instant_model_id, "large": claude_v2_1_model_id}
+model_tier_configurations = {
+    claude_instant_model_id: claude_inference_configuration,
+    claude_v2_1_model_id: claude_v2_1_inference_configuration,
+}
+stage_model_tiers = {"critique": "small", "revision": "small"}
+principle_model_tiers = {}
+escalate_flagged_revisions = False
+min_critic_confidence = 0.0
+
+# seconds each stage's Bedrock call may take, including retries, see
+# utils/invocation_policy.py; "map" applies to each map-reduce chunk summary
+# and "original" to the merge
+stage_deadline_seconds = {"original": 90, "map": 60, "critique": 45, "revision": 90}
+
+guardrail_principles = []
+
+# Define Custom Principles
+# See a list of ready made principles here: https://python.langchain.com/docs/guides/safety/constitutional_chain#all-constitutional-ai-principles
+
+clinical_hippocratic_principle = ConstitutionalPrinciple(
+    name="Clinical Hippocratic Principle",
+    critique_request="The AI Persona should only prescribe beneficial treatments, according to its abilities and judgment; to refrain from causing harm or hurt; and model an exemplary personal and professional life. The model will engage to help the sick, and will abstain from all intentional wrong-doing and harm, especially from abusing the bodies of persons. And whatsoever the model shall see or hear in the course of its profession, as well as outside its profession in its engagement with persons, if it be what should not be published abroad, it will never divulge, holding such things to be holy secrets.",
+    revision_request="Rewrite the model's output to only prescribe beneficial treatments, according to its abilities and judgment; to refrain from causing harm or hurt; and model an exemplary personal and professional life.",
+)
+
+honesty_principle_01 = ConstitutionalPrinciple(
+    name="Honesty Principle 01",
+    critique_request="The AI Persona will be honest.  The AI Persona will not lie.  The AI Persona will admit when it does not know something.  The AI will hold honesty above all other principles.",
+    revision_request="",
+)
+
+verified_source_principle_01 = ConstitutionalPrinciple(
+    name="Verified Source Principle 01",
+    critique_request="The AI Persona will describe, honestly, how the results are related to the user input.  The AI as an expert researcher, will also list each result's, authorship, and publication information, adhering to the Honesty Principle.",
+    revision_request="",
+)
+
+guardrail_principles.append(honesty_principle_01)
+guardrail_principles.append(clinical_hippocratic_principle)
+guardrail_principles.append(verified_source_principle_01)
+
+pipelined_whole_response_principles = [verified_source_principle_01.name]
+
+critique_prompt = PromptTemplate(
+    template="""
+    Human: Hello Constitutional Principle Bot!
+
+    Assistant: Below is a conversation between a human and an AI model.
+    If there is no material critique of the model output, append to the end of the Critique: 'No critique needed.'
+    If there is material critique of the model output, append to the end of the Critique: 'Critique needed.'",
+
+    Human: {input_prompt}
+
+    Assistant: {output_from_model}
+
+    Human: Critique Request: {critique_request}
+
+
+""",
+    input_variables=["input_prompt", "output_from_model", "critique_request"],
+)
+
+revision_prompt = PromptTemplate(
+    template="""
+    Human: {input_prompt}
+
+    Assistant: {output_from_model}
+
+    Human: Critique Request: {critique_request}
+
+    Assistant: Critique: {critique}
+
+    Human:
+    If the critique does not identify anything worth changing, ignore the Revision Request and do not make any revisions. Instead, return "No revisions needed".
+    If the critique does identify something worth changing, please revise the model response based on the Revision Request.
+
+    Revision Request: {revision_request}
+
+    Assistant: Revision:
+""",
+    input_variables=[
+        "input_prompt",
+        "output_from_model",
+        "critique_request",
+        "critique",
+        "revision_request",
+    ],
+)
+
+
+# "pipelined" mode: critique of one completed part of an output that is still
+# being generated; absences are left to the critique of the complete output
+segment_critique_prompt = PromptTemplate(
+    template="""
+    Human: Hello Constitutional Principle Bot!
+
+    Assistant: Below is a conversation between a human and an AI model. The model output is still being written: only part {segment_number} of it is shown, the other parts are reviewed separately.
+    Critique only what this part says. Do not critique anything for being missing from this part, it may be in another part.
+    If there is no material critique of this part, append to the end of the Critique: 'No critique needed.'
+    If there is material critique of this part, append to the end of the Critique: 'Critique needed.'
+
+    Human: {input_prompt}
+
+    Assistant (part {segment_number}): {output_from_model}
+
+    Human: Critique Request: {critique_request}
+
+
+""",
+    input_variables=[
+        "input_prompt",
+        "output_from_model",
+        "critique_request",
+        "segment_number",
+    ],
+)
+
+# "batched" mode: one critique call for all principles and one combined
+# revision for the flagged ones
+batched_critique_prompt = PromptTemplate(
+    template="""
+    Human: Hello Constitutional Principle Bot!
+
+    Assistant: Below is a conversation between a human and an AI model, followed by the principles the model output must follow.
+    Critique the model output against each principle separately and answer with one critique per principle, using the principle's index:
+    <critique index="1">Critique of the model output against principle 1.</critique>
+    If there is no material critique of the model output for a principle, append to the end of its critique: 'No critique needed.'
+    If there is material critique of the model output for a principle, append to the end of its critique: 'Critique needed.'
+
+    Human: {input_prompt}
+
+    Assistant: {output_from_model}
+
+    Human: Critique Requests:
+    {critique_requests}
+
+
+""",
+    input_variables=["input_prompt", "output_from_model", "critique_requests"],
+)
+
+combined_revision_prompt = PromptTemplate(
+    template="""
+    Human: {input_prompt}
+
+    Assistant: {output_from_model}
+
+    Human: The model output was critiqued against the following principles:
+    {critiques}
+
+    If the critiques do not identify anything worth changing, do not make any revisions. Instead, return "No revisions needed".
+    If the critiques do identify something worth changing, please revise the model response once so that it addresses every critique, following each Revision Request.
+
+    Assistant: Revision:
+""",
+    input_variables=["input_prompt", "output_from_model", "critiques"],
+)
+
+# session memory of the initial chain, see utils/conversation_memory.py: the
+# last conversation_memory_window_turns turns verbatim plus a running summary
+# of older ones, never more than conversation_memory_max_tokens
+conversation_memory_max_tokens = 1500
+conversation_memory_max_summary_tokens = 300
+conversation_memory_window_turns = 4
+
+memory_summary_prompt = PromptTemplate(
+    template="""
+    Human: Progressively summarize the conversation below, adding onto the previous summary. Keep patient details, findings and decisions; leave out pleasantries. Return only the new summary.
+
+    Previous summary:
+    {summary}
+
+    New lines of conversation:
+    {new_lines}
+
+    Assistant: New summary:
+""",
+    input_variables=["summary", "new_lines"],
+)
+
+# notes longer than map_reduce_min_document_tokens are summarized section by
+# section (at most map_reduce_max_concurrency at once) and the section
+# summaries merged before the constitutional review, see utils/map_reduce.py
+map_reduce_enabled = True
+map_reduce_min_document_tokens = 3000
+map_reduce_max_chunk_tokens = 1200
+map_reduce_max_concurrency = 4
+
+map_summary_prompt = PromptTemplate(
+    template="""
+    Human: The clinical notes below are one part ({sections}) of a longer record. Summarize this part for a clinician. Keep every finding, medication, dose, negation and recommendation, and do not add anything that is not in the notes.
+
+    <notes>
+    {chunk}
+    </notes>
+
+    Assistant: Summary of this part:
+""",
+    input_variables=["sections", "chunk"],
+)
+
+reduce_summary_prompt = PromptTemplate(
+    template="""
+    Human: The notes of the task below were too long to process at once, so each part was summarized separately; the summaries of the parts replace the original notes. Complete the task from them.
+
+    {task}
+
+    Assistant:
+""",
+    input_variables=["task"],
+)
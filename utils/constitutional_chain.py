@@ -0,0 +1,750 @@
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Optional
+
+from langchain.callbacks.manager import CallbackManagerForChainRun
+from langchain.chains.constitutional_ai.base import ConstitutionalChain
+from langchain.chains.llm import LLMChain
+
+from utils.input_condenser import CondensedInput
+from utils.invocation_policy import InvocationPolicy
+from utils.pipeline_events import emit_pipeline_event
+from utils.request_scheduler import bind_context
+from utils.segment_review import SegmentReviewer, SegmentSplitter
+
+VERDICT_NO_CRITIQUE_NEEDED = "no_critique_needed"
+VERDICT_CRITIQUE_NEEDED = "critique_needed"
+VERDICT_UNKNOWN = "unknown"
+
+# critique_prompt asks the model to end with 'No critique needed.' or
+# 'Critique needed.', so the verdict is read from the tail of the critique
+_VERDICT_PATTERN = re.compile(r"(no\s+)?critique\s+needed\W*$", re.IGNORECASE)
+
+
+_CRITIQUE_NEEDED_PATTERN = re.compile(r"(no\s+)?critique\s+needed", re.IGNORECASE)
+_HEDGE_PATTERN = re.compile(
+    r"\b(?:may|might|possibly|perhaps|unclear|uncertain|not sure|could be)\b",
+    re.IGNORECASE,
+)
+
+_BATCHED_CRITIQUE_PATTERN = re.compile(
+    r"<critique\s+index=[\"']?(\d+)[\"']?\s*>(.*?)</critique>",
+    re.IGNORECASE | re.DOTALL,
+)
+
+
+def render_critique_requests(principles):
+    return "\n".join(
+        f'<principle index="{index}">{principle.critique_request}</principle>'
+        for index, principle in enumerate(principles, start=1)
+    )
+
+
+def parse_batched_critique(text, count):
+    # one critique per principle, in principle order; None unless every
+    # principle got exactly one non-empty critique
+    critiques = {}
+    for match in _BATCHED_CRITIQUE_PATTERN.finditer(text):
+        index = int(match.group(1))
+        critique = match.group(2).strip()
+        if index in critiques or not 1 <= index <= count or not critique:
+            return None
+        critiques[index] = critique
+    if len(critiques) != count:
+        return None
+    return [critiques[index] for index in range(1, count + 1)]
+
+
+def parse_critique_verdict(critique):
+    match = _VERDICT_PATTERN.search(critique.strip())
+    if match:
+        if match.group(1):
+            return VERDICT_NO_CRITIQUE_NEEDED
+        return VERDICT_CRITIQUE_NEEDED
+    if "no critique needed" in critique.lower():
+        return VERDICT_NO_CRITIQUE_NEEDED
+    return VERDICT_UNKNOWN
+
+
+def critique_confidence(critique):
+    # Bedrock's completion API returns no token probabilities, so confidence
+    # is judged from the text: a clear trailing verdict scores 1.0, a verdict
+    # found elsewhere 0.6, contradicting or missing verdicts score low, and
+    # every hedge ("may", "possibly", ...) lowers the score
+    verdict = parse_critique_verdict(critique)
+    if verdict == VERDICT_UNKNOWN:
+        return 0.0
+    verdicts = {bool(match.group(1)) for match in _CRITIQUE_NEEDED_PATTERN.finditer(critique)}
+    if len(verdicts) > 1:
+        confidence = 0.3
+    elif _VERDICT_PATTERN.search(critique.strip()):
+        confidence = 1.0
+    else:
+        confidence = 0.6
+    return max(0.0, confidence - 0.15 * len(_HEDGE_PATTERN.findall(critique)))
+
+
+class ConstitutionalReviewChain(ConstitutionalChain):
+    """ConstitutionalChain with a concurrent critique mode.
+
+    execution_mode="sequential" keeps LangChain's behaviour: each principle
+    critiques the output left by the previous revision.
+
+    execution_mode="concurrent" critiques the initial output against every
+    principle at once (at most max_concurrency requests in flight), then
+    applies the revisions according to revision_policy:
+
+    - "sequence": flagged principles are revised one after another in the
+      order they were declared, each revision building on the previous one.
+    - "independent": flagged principles are revised concurrently against the
+      initial output and the revision of the last flagged principle becomes
+      the output, matching the "last revision wins" outcome of the chain.
+
+    execution_mode="batched" critiques the initial output against all
+    principles in one call (batched_critique_chain) and, if any principle was
+    flagged, applies one combined revision for the flagged principles
+    (combined_revision_chain): two calls instead of up to 2N. When the
+    batched critique cannot be parsed into one critique per principle, the
+    run falls back to the concurrent per-principle mode.
+
+    execution_mode="pipelined" critiques the initial output while it is
+    still being generated: the stream is cut into completed segments
+    (paragraphs or <summary> sections of at least segment_min_chars, at most
+    max_segments of them) and each segment is critiqued as soon as it is
+    complete, with segment_critique_chain, which tells the critic it sees one
+    part of an unfinished response. Segment critiques only screen: a
+    principle whose parts were all found fine needs no critique of the full
+    output, every other principle is critiqued on the full output once it is
+    generated, and that critique decides its verdict and revision, as in the
+    concurrent mode. Principles in whole_response_principles (requirements
+    about the response as a whole, such as listing every source) are only
+    critiqued on the full output. Segment critiques never escalate to a
+    larger model tier. The overlap with generation is returned as
+    pipelining. Without a streaming LLM the output is split and screened
+    once generated.
+
+    A critique whose verdict is "No critique needed." skips the revision call
+    for that principle.
+
+    With a model_router (utils/model_router.py) every critique and revision
+    call runs on the model tier the router picks; if the router escalates,
+    low-confidence critiques are re-run on the escalation tier. Decisions are reported as "route"
+    stage events and latency and estimated cost are recorded per tier.
+
+    The verdicts and the number of revision calls saved are returned with the
+    intermediate steps.
+
+    With an input_condenser (utils/input_condenser.py) the critique prompts
+    get a token-bounded digest of the input, built once per run, instead of
+    the full input; revisions always get the full input. The bytes and
+    tokens saved are returned as input_condensation.
+
+    With map_reduce (utils/map_reduce.py), long notes are summarized section
+    by section and the initial output is the merge of the section
+    summaries; the chunks and their timings are returned as map_reduce.
+
+    stage_deadlines bounds the Bedrock calls of each stage ("original",
+    "critique", "revision") in seconds, retries included, see
+    utils/invocation_policy.py. With map_reduce, "map" bounds each chunk
+    summary and "original" the merge.
+
+    Each completed stage (initial output, critique, revision, skipped
+    revision, segment critique, input condensation, memory size) is also
+    reported to callback handlers that implement on_pipeline_event, see
+    utils/pipeline_events.py.
+    """
+
+    execution_mode: str = "sequential"
+    max_concurrency: int = 4
+    revision_policy: str = "sequence"
+    input_condenser: Optional[Any] = None
+    batched_critique_chain: Optional[LLMChain] = None
+    segment_critique_chain: Optional[LLMChain] = None
+    combined_revision_chain: Optional[LLMChain] = None
+    model_router: Optional[Any] = None
+    stage_deadlines: Optional[dict] = None
+    map_reduce: Optional[Any] = None
+    segment_min_chars: int = 400
+    max_segments: int = 4
+    whole_response_principles: Optional[list] = None
+
+    @property
+    def output_keys(self):
+        keys = super().output_keys
+        if self.return_intermediate_steps:
+            keys = keys + ["critique_verdicts", "revision_calls_saved"]
+            if self.input_condenser is not None:
+                keys = keys + ["input_condensation"]
+            if hasattr(self.chain.memory, "stats"):
+                keys = keys + ["memory"]
+            if self.map_reduce is not None:
+                keys = keys + ["map_reduce"]
+            if self.execution_mode == "pipelined":
+                keys = keys + ["pipelining"]
+        return keys
+
+    def _call(self, inputs, run_manager=None):
+        _run_manager = run_manager or CallbackManagerForChainRun.get_noop_manager()
+
+        start = time.perf_counter()
+        input_prompt = self.chain.prompt.format(**inputs)
+        condensed_input = None
+        original_callbacks = _run_manager.get_child("original")
+        segment_reviewer = None
+        if self.execution_mode == "pipelined":
+            if self.input_condenser is not None:
+                # segments are critiqued before the initial output is complete
+                condensed_input = self.input_condenser.start(input_prompt)
+                input_prompt = condensed_input
+            segment_reviewer = self._segment_reviewer(input_prompt, _run_manager)
+            original_callbacks.add_handler(segment_reviewer, inherit=True)
+
+        map_reduce = None
+        try:
+            if self.map_reduce is not None:
+                map_reduce = self._map_reduce(inputs, _run_manager, original_callbacks)
+            if map_reduce is not None:
+                response, map_reduce = map_reduce
+            else:
+                with self._deadline("original"):
+                    response = self.chain.run(**inputs, callbacks=original_callbacks)
+        except BaseException:
+            if segment_reviewer is not None:
+                segment_reviewer.cancel()
+            raise
+        initial_response = response
+        emit_pipeline_event(
+            _run_manager,
+            "initial_output",
+            text=response,
+            duration_seconds=time.perf_counter() - start,
+        )
+        memory_stats = None
+        if hasattr(self.chain.memory, "stats"):
+            # size of the session memory after this turn, see TokenBudgetMemory
+            memory_stats = self.chain.memory.stats()
+            emit_pipeline_event(_run_manager, "memory", **memory_stats)
+        if self.input_condenser is not None and condensed_input is None:
+            # the digest favours the parts of the input the initial output uses
+            condensed_input = self.input_condenser.start(input_prompt, initial_response)
+            input_prompt = condensed_input
+
+        _run_manager.on_text(
+            text="Initial response: " + response + "\n\n",
+            verbose=self.verbose,
+            color="yellow",
+        )
+
+        if self.execution_mode == "concurrent":
+            critiques_and_revisions, verdicts, response = self._review_concurrently(
+                input_prompt, initial_response, _run_manager
+            )
+        elif self.execution_mode == "sequential":
+            critiques_and_revisions, verdicts, response = self._review_sequentially(
+                input_prompt, initial_response, _run_manager
+            )
+        elif self.execution_mode == "batched":
+            critiques_and_revisions, verdicts, response = self._review_batched(
+                input_prompt, initial_response, _run_manager
+            )
+        elif self.execution_mode == "pipelined":
+            critiques_and_revisions, verdicts, response, pipelining = self._review_pipelined(
+                input_prompt, initial_response, segment_reviewer, _run_manager
+            )
+        else:
+            raise ValueError(f"Unknown execution_mode: {self.execution_mode}")
+
+        final_output = {"output": response}
+        if memory_stats is not None and self.return_intermediate_steps:
+            final_output["memory"] = memory_stats
+        if self.map_reduce is not None and self.return_intermediate_steps:
+            final_output["map_reduce"] = map_reduce
+        if segment_reviewer is not None and self.return_intermediate_steps:
+            final_output["pipelining"] = pipelining
+        if condensed_input is not None:
+            condensation = condensed_input.stats()
+            emit_pipeline_event(_run_manager, "input_condensed", **condensation)
+            if self.return_intermediate_steps:
+                final_output["input_condensation"] = condensation
+        if self.return_intermediate_steps:
+            final_output["initial_output"] = initial_response
+            final_output["critiques_and_revisions"] = critiques_and_revisions
+            final_output["critique_verdicts"] = verdicts
+            final_output["revision_calls_saved"] = sum(
+                1 for verdict in verdicts if verdict["revision_skipped"]
+            )
+        return final_output
+
+    def _review_sequentially(self, input_prompt, response, run_manager):
+        critiques_and_revisions = []
+        verdicts = []
+        for constitutional_principle in self.constitutional_principles:
+            critique = self._critique(
+                input_prompt, response, constitutional_principle, run_manager
+            )
+            verdict = self._verdict(constitutional_principle, critique, run_manager)
+            verdicts.append(verdict)
+            if verdict["revision_skipped"]:
+                critiques_and_revisions.append((critique, ""))
+                continue
+
+            response = self._revise(
+                input_prompt, response, constitutional_principle, critique, run_manager
+            )
+            critiques_and_revisions.append((critique, response))
+        return critiques_and_revisions, verdicts, response
+
+    def _review_concurrently(self, input_prompt, initial_response, run_manager):
+        principles = self.constitutional_principles
+        max_workers = max(1, min(self.max_concurrency, len(principles) or 1))
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            critiques = list(
+                executor.map(
+                    bind_context(
+                        lambda principle: self._critique(
+                            input_prompt, initial_response, principle, run_manager
+                        )
+                    ),
+                    principles,
+                )
+            )
+
+            verdicts = [
+                self._verdict(principle, critique, run_manager)
+                for principle, critique in zip(principles, critiques)
+            ]
+            critiques_and_revisions, response = self._apply_revisions(
+                input_prompt, initial_response, critiques, verdicts, executor, run_manager
+            )
+        return critiques_and_revisions, verdicts, response
+
+    def _apply_revisions(
+        self, input_prompt, initial_response, critiques, verdicts, executor, run_manager
+    ):
+        # revisions of the flagged principles, according to revision_policy
+        principles = self.constitutional_principles
+        flagged = [
+            index
+            for index, verdict in enumerate(verdicts)
+            if not verdict["revision_skipped"]
+        ]
+        revisions = {}
+        response = initial_response
+
+        if self.revision_policy == "sequence":
+            for index in flagged:
+                response = self._revise(
+                    input_prompt, response, principles[index], critiques[index], run_manager
+                )
+                revisions[index] = response
+        elif self.revision_policy == "independent":
+            futures = {
+                index: executor.submit(
+                    bind_context(self._revise),
+                    input_prompt,
+                    initial_response,
+                    principles[index],
+                    critiques[index],
+                    run_manager,
+                )
+                for index in flagged
+            }
+            for index in flagged:
+                revisions[index] = futures[index].result()
+            if flagged:
+                response = revisions[flagged[-1]]
+        else:
+            raise ValueError(f"Unknown revision_policy: {self.revision_policy}")
+
+        critiques_and_revisions = [
+            (critique, revisions.get(index, ""))
+            for index, critique in enumerate(critiques)
+        ]
+        return critiques_and_revisions, response
+
+    def _segment_reviewer(self, input_prompt, run_manager):
+        if self.segment_critique_chain is None:
+            raise ValueError("execution_mode='pipelined' needs segment_critique_chain")
+        whole_response = set(self.whole_response_principles or ())
+
+        def critique(index, segment, principle):
+            return self._critique(input_prompt, segment, principle, run_manager, segment=index)
+
+        return SegmentReviewer(
+            critique,
+            [
+                principle
+                for principle in self.constitutional_principles
+                if principle.name not in whole_response
+            ],
+            SegmentSplitter(min_chars=self.segment_min_chars, max_segments=self.max_segments),
+            max_concurrency=self.max_concurrency,
+        )
+
+    def _review_pipelined(self, input_prompt, initial_response, segment_reviewer, run_manager):
+        principles = self.constitutional_principles
+        segment_critiques, pipelining = segment_reviewer.finish(initial_response)
+        screened = {
+            principle.name: [critiques[position] for critiques in segment_critiques]
+            for position, principle in enumerate(segment_reviewer.principles)
+        }
+
+        # principles whose parts were all found fine are settled; the others
+        # (and the whole-response ones) are critiqued on the full output
+        critiques = {}
+        for principle in principles:
+            parts = screened.get(principle.name)
+            if parts and all(
+                parse_critique_verdict(part) == VERDICT_NO_CRITIQUE_NEEDED for part in parts
+            ):
+                critiques[principle.name] = (
+                    f"No critique needed for any of the {len(parts)} parts of the response."
+                )
+                emit_pipeline_event(
+                    run_manager,
+                    "critique",
+                    principle=principle.name,
+                    critique=critiques[principle.name],
+                    verdict=VERDICT_NO_CRITIQUE_NEEDED,
+                    segments=len(parts),
+                    duration_seconds=0.0,
+                )
+        pending = [principle for principle in principles if principle.name not in critiques]
+
+        start = time.perf_counter()
+        max_workers = max(1, min(self.max_concurrency, len(principles) or 1))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for principle, critique in zip(
+                pending,
+                executor.map(
+                    bind_context(
+                        lambda principle: self._critique(
+                            input_prompt, initial_response, principle, run_manager
+                        )
+                    ),
+                    pending,
+                ),
+            ):
+                critiques[principle.name] = critique
+            pipelining["full_output_critiques"] = len(pending)
+            pipelining["full_output_critique_seconds"] = time.perf_counter() - start
+            emit_pipeline_event(run_manager, "pipelined_review", **pipelining)
+
+            critiques = [critiques[principle.name] for principle in principles]
+            verdicts = [
+                self._verdict(principle, critique, run_manager)
+                for principle, critique in zip(principles, critiques)
+            ]
+            critiques_and_revisions, response = self._apply_revisions(
+                input_prompt, initial_response, critiques, verdicts, executor, run_manager
+            )
+        return critiques_and_revisions, verdicts, response, pipelining
+
+    def _review_batched(self, input_prompt, initial_response, run_manager):
+        if self.batched_critique_chain is None or self.combined_revision_chain is None:
+            raise ValueError(
+                "execution_mode='batched' needs batched_critique_chain and "
+                "combined_revision_chain"
+            )
+        principles = self.constitutional_principles
+
+        start = time.perf_counter()
+        fields = dict(
+            output_from_model=initial_response,
+            critique_requests=render_critique_requests(principles),
+        )
+        raw_critique = self._run_stage(
+            "batched_critique",
+            self.batched_critique_chain,
+            self._route(run_manager, "critique"),
+            run_manager.get_child("critique"),
+            input_prompt=self._prompt_input(
+                input_prompt, self.batched_critique_chain.prompt, **fields
+            ),
+            **fields,
+        )
+        duration_seconds = time.perf_counter() - start
+        critiques = parse_batched_critique(raw_critique, len(principles))
+        if critiques is None:
+            emit_pipeline_event(
+                run_manager,
+                "batched_critique_fallback",
+                critique=raw_critique,
+                duration_seconds=duration_seconds,
+            )
+            run_manager.on_text(
+                text="Batched critique could not be parsed, critiquing per principle\n\n",
+                verbose=self.verbose,
+                color="red",
+            )
+            return self._review_concurrently(input_prompt, initial_response, run_manager)
+
+        for principle, critique in zip(principles, critiques):
+            emit_pipeline_event(
+                run_manager,
+                "critique",
+                principle=principle.name,
+                critique=critique,
+                verdict=parse_critique_verdict(critique),
+                duration_seconds=duration_seconds,
+                batched=True,
+            )
+        verdicts = [
+            self._verdict(principle, critique, run_manager)
+            for principle, critique in zip(principles, critiques)
+        ]
+        flagged = [
+            index
+            for index, verdict in enumerate(verdicts)
+            if not verdict["revision_skipped"]
+        ]
+        if not flagged:
+            return [(critique, "") for critique in critiques], verdicts, initial_response
+
+        revision = self._revise_combined(
+            input_prompt,
+            initial_response,
+            [principles[index] for index in flagged],
+            [critiques[index] for index in flagged],
+            run_manager,
+        )
+        critiques_and_revisions = [
+            (critique, revision if index in flagged else "")
+            for index, critique in enumerate(critiques)
+        ]
+        return critiques_and_revisions, verdicts, revision
+
+    def _revise_combined(self, input_prompt, response, principles, critiques, run_manager):
+        start = time.perf_counter()
+        rendered_critiques = "\n\n".join(
+            f"Critique Request: {principle.critique_request}\n"
+            f"Critique: {critique}"
+            + (
+                f"\nRevision Request: {principle.revision_request}"
+                if principle.revision_request
+                else ""
+            )
+            for principle, critique in zip(principles, critiques)
+        )
+        fields = dict(output_from_model=response, critiques=rendered_critiques)
+        revision = self._run_stage(
+            "combined_revision",
+            self.combined_revision_chain,
+            self._route(run_manager, "revision"),
+            run_manager.get_child("revision"),
+            input_prompt=self._full_input(input_prompt),
+            **fields,
+        ).strip()
+        names = ", ".join(principle.name for principle in principles)
+        emit_pipeline_event(
+            run_manager,
+            "revision",
+            principle=names,
+            principles=[principle.name for principle in principles],
+            revision=revision,
+            duration_seconds=time.perf_counter() - start,
+        )
+        run_manager.on_text(
+            text=f"Applying {names}..." + "\n\n",
+            verbose=self.verbose,
+            color="green",
+        )
+        run_manager.on_text(
+            text="Updated response: " + revision + "\n\n",
+            verbose=self.verbose,
+            color="yellow",
+        )
+        return revision
+
+    def _verdict(self, constitutional_principle, critique, run_manager):
+        verdict = parse_critique_verdict(critique)
+        revision_skipped = verdict == VERDICT_NO_CRITIQUE_NEEDED
+        if revision_skipped:
+            emit_pipeline_event(
+                run_manager,
+                "revision_skipped",
+                principle=constitutional_principle.name,
+            )
+        return {
+            "principle": constitutional_principle.name,
+            "verdict": verdict,
+            "revision_skipped": revision_skipped,
+        }
+
+    def _route(self, run_manager, stage, principle=None, confidence=None):
+        if self.model_router is None:
+            return None
+        decision = self.model_router.route(stage, principle, confidence)
+        emit_pipeline_event(
+            run_manager,
+            "route",
+            routed_stage=decision.stage,
+            principle=decision.principle,
+            tier=decision.tier,
+            model_id=decision.model_id,
+            reason=decision.reason,
+            confidence=confidence,
+        )
+        return decision
+
+    def _run_stage(self, prompt_name, default_chain, decision, callbacks, **inputs):
+        # runs the stage on the chain of the routed model, if there is one
+        chain = default_chain
+        if decision is not None:
+            chain = self.model_router.chain(prompt_name, decision.model_id) or default_chain
+        start = time.perf_counter()
+        stage = "critique" if prompt_name.endswith("critique") else "revision"
+        with self._deadline(stage):
+            output = chain.run(**inputs, callbacks=callbacks)
+        if decision is not None:
+            self.model_router.record(
+                decision,
+                chain.prompt.format(**inputs),
+                output,
+                time.perf_counter() - start,
+            )
+        return output
+
+    def _map_reduce(self, inputs, run_manager, original_callbacks):
+        # the reduce call streams as the initial output; chunk summaries run
+        # concurrently under their own "map" stage, each with its own deadline
+        def on_chunk(report):
+            emit_pipeline_event(run_manager, "map_chunk", **report)
+
+        result = self.map_reduce.summarize(
+            self.chain.prompt.format(**inputs),
+            map_callbacks=run_manager.get_child("map"),
+            reduce_callbacks=original_callbacks,
+            on_chunk=on_chunk,
+            map_deadline=lambda: self._deadline("map"),
+            reduce_deadline=lambda: self._deadline("original"),
+        )
+        if result is None:
+            return None
+        response, stats = result
+        emit_pipeline_event(
+            run_manager,
+            "map_reduce",
+            chunks=len(stats["chunks"]),
+            map_seconds=stats["map_seconds"],
+            reduce_seconds=stats["reduce_seconds"],
+        )
+        if self.chain.memory is not None:
+            self.chain.memory.save_context(inputs, {self.chain.output_key: response})
+        return response, stats
+
+    def _deadline(self, stage):
+        return InvocationPolicy.deadline((self.stage_deadlines or {}).get(stage))
+
+    def _prompt_input(self, input_prompt, prompt, **fields):
+        if isinstance(input_prompt, CondensedInput):
+            return input_prompt.for_prompt(prompt, **fields)
+        return input_prompt
+
+    def _full_input(self, input_prompt):
+        # revisions rewrite clinical output, they never work from a digest
+        if isinstance(input_prompt, CondensedInput):
+            return input_prompt.full_text()
+        return input_prompt
+
+    def _critique(
+        self, input_prompt, response, constitutional_principle, run_manager, segment=None
+    ):
+        # with a segment index, response is that segment of the initial output
+        start = time.perf_counter()
+        name = constitutional_principle.name
+        fields = dict(
+            output_from_model=response,
+            critique_request=constitutional_principle.critique_request,
+        )
+        prompt_name, critique_chain = "critique", self.critique_chain
+        if segment is not None:
+            prompt_name, critique_chain = "segment_critique", self.segment_critique_chain
+            fields["segment_number"] = segment + 1
+        fields["input_prompt"] = self._prompt_input(
+            input_prompt, critique_chain.prompt, **fields
+        )
+        decision = self._route(run_manager, "critique", name)
+        raw_critique = self._run_stage(
+            prompt_name,
+            critique_chain,
+            decision,
+            run_manager.get_child("critique"),
+            **fields,
+        )
+        critique = self._parse_critique(output_string=raw_critique).strip()
+
+        # a segment critique only screens, the full output critique may escalate
+        if decision is not None and segment is None:
+            confidence = critique_confidence(critique)
+            escalation = self.model_router.route("critique", name, confidence)
+            if escalation.model_id != decision.model_id:
+                decision = self._route(run_manager, "critique", name, confidence)
+                raw_critique = self._run_stage(
+                    "critique",
+                    self.critique_chain,
+                    decision,
+                    run_manager.get_child("critique"),
+                    **fields,
+                )
+                critique = self._parse_critique(output_string=raw_critique).strip()
+
+        segment_fields = {} if segment is None else {"segment": segment}
+        emit_pipeline_event(
+            run_manager,
+            "critique" if segment is None else "segment_critique",
+            principle=name,
+            critique=critique,
+            verdict=parse_critique_verdict(critique),
+            model_id=decision.model_id if decision else None,
+            duration_seconds=time.perf_counter() - start,
+            **segment_fields,
+        )
+        return critique
+
+    def _revise(
+        self, input_prompt, response, constitutional_principle, critique, run_manager
+    ):
+        start = time.perf_counter()
+        fields = dict(
+            output_from_model=response,
+            critique_request=constitutional_principle.critique_request,
+            critique=critique,
+            revision_request=constitutional_principle.revision_request,
+        )
+        decision = self._route(run_manager, "revision", constitutional_principle.name)
+        revision = self._run_stage(
+            "revision",
+            self.revision_chain,
+            decision,
+            run_manager.get_child("revision"),
+            input_prompt=self._full_input(input_prompt),
+            **fields,
+        ).strip()
+        emit_pipeline_event(
+            run_manager,
+            "revision",
+            principle=constitutional_principle.name,
+            revision=revision,
+            model_id=decision.model_id if decision else None,
+            duration_seconds=time.perf_counter() - start,
+        )
+
+        run_manager.on_text(
+            text=f"Applying {constitutional_principle.name}..." + "\n\n",
+            verbose=self.verbose,
+            color="green",
+        )
+        run_manager.on_text(
+            text="Critique: " + critique + "\n\n",
+            verbose=self.verbose,
+            color="blue",
+        )
+        run_manager.on_text(
+            text="Updated response: " + revision + "\n\n",
+            verbose=self.verbose,
+            color="yellow",
+        )
+        return revision
@@ -0,0 +1,239 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+from langchain.schema import BaseMemory
+
+from utils.prompt_text import estimate_tokens
+from utils.request_scheduler import bind_context
+
+# summaries are folded off the request path, a few at a time process-wide
+_summary_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="memory-summary")
+
+TRUNCATION_MARKER = "[...]"
+SUMMARY_LABEL = "Summary of the earlier conversation: "
+
+
+class ConversationWindow:
+    """Recent turns plus a running summary, within a hard token budget.
+
+    The last window_turns turns are kept verbatim; older turns are handed to
+    summarize(summary, new_lines) in the background, which folds them into
+    the running summary (the previous summary is extended, never rebuilt
+    from the full history). Until a fold has finished, its turns are
+    rendered after the summary as pending lines. Without summarize, only
+    the newest evicted lines that fit max_summary_tokens are kept and the
+    rest are dropped. clear() starts a new conversation: a fold still
+    running for the old one is discarded.
+
+    render() never exceeds max_tokens: the summary is capped at
+    max_summary_tokens and the newest turns are kept first, the oldest one
+    that does not fit is truncated from the front. Tokens are estimated at
+    chars_per_token characters per token.
+    """
+
+    def __init__(
+        self,
+        summarize=None,
+        max_tokens=1500,
+        max_summary_tokens=300,
+        window_turns=4,
+        chars_per_token=4.0,
+        human_prefix="Human",
+        ai_prefix="Assistant",
+    ):
+        self.summarize = summarize
+        self.max_tokens = max_tokens
+        self.max_summary_tokens = max_summary_tokens
+        self.window_turns = window_turns
+        self.chars_per_token = chars_per_token
+        self.human_prefix = human_prefix
+        self.ai_prefix = ai_prefix
+
+        self._lock = threading.Lock()
+        self._turns = []
+        self._pending = []
+        self._summary = ""
+        self._summarizing = False
+        # bumped by clear(): a fold of the previous conversation is dropped
+        self._generation = 0
+        self._stats = {
+            "turns": 0,
+            "summarized_turns": 0,
+            "summary_calls": 0,
+            "summary_seconds": 0.0,
+            "summary_errors": 0,
+        }
+
+    def estimate_tokens(self, text):
+        return estimate_tokens(text, self.chars_per_token)
+
+    def _truncate_front(self, text, max_tokens):
+        # the end of a turn (the answer) matters more than its start
+        length = int(max_tokens * self.chars_per_token)
+        if len(text) <= length:
+            return text
+        if length <= len(TRUNCATION_MARKER):
+            return ""
+        return TRUNCATION_MARKER + text[len(text) - length + len(TRUNCATION_MARKER) :]
+
+    def _render_turn(self, human, ai):
+        return f"{self.human_prefix}: {human}\n{self.ai_prefix}: {ai}"
+
+    def add_turn(self, human, ai):
+        with self._lock:
+            self._turns.append(self._render_turn(human, ai))
+            self._stats["turns"] += 1
+            if len(self._turns) > self.window_turns:
+                evicted = len(self._turns) - self.window_turns
+                self._pending.extend(self._turns[:evicted])
+                del self._turns[:evicted]
+                if self.summarize is None:
+                    self._pending = self._tail(self._pending, self.max_summary_tokens)
+            start = self.summarize is not None and self._pending and not self._summarizing
+            if start:
+                self._summarizing = True
+            generation = self._generation
+        if start:
+            _summary_executor.submit(bind_context(self._fold), generation)
+
+    def _tail(self, lines, max_tokens):
+        # the newest lines that fit max_tokens, the oldest one kept truncated
+        kept = []
+        budget = max_tokens
+        for line in reversed(lines):
+            cost = self.estimate_tokens(line) + 1
+            if cost > budget:
+                line = self._truncate_front(line, budget - 1)
+                if line:
+                    kept.append(line)
+                break
+            kept.append(line)
+            budget -= cost
+        kept.reverse()
+        return kept
+
+    def _fold(self, generation):
+        while True:
+            with self._lock:
+                if generation != self._generation:
+                    return
+                lines = list(self._pending)
+                summary = self._summary
+                if not lines:
+                    self._summarizing = False
+                    return
+            start = time.perf_counter()
+            try:
+                new_summary = self.summarize(summary, "\n".join(lines)).strip()
+            except Exception as e:
+                print(f"Conversation summary failed: {e}")
+                with self._lock:
+                    if generation == self._generation:
+                        self._stats["summary_errors"] += 1
+                        self._summarizing = False
+                return
+            with self._lock:
+                if generation != self._generation:
+                    return
+                self._summary = self._truncate_front(new_summary, self.max_summary_tokens)
+                del self._pending[: len(lines)]
+                self._stats["summarized_turns"] += len(lines)
+                self._stats["summary_calls"] += 1
+                self._stats["summary_seconds"] += time.perf_counter() - start
+
+    def wait(self, timeout=None):
+        # for tests and batch jobs: block until pending turns are summarized
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                if not self._summarizing:
+                    return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+
+    def _parts(self):
+        # called under self._lock; returns the summary and turns that fit
+        budget = self.max_tokens
+        summary = self._summary
+        if self.summarize is None or self._pending:
+            # not folded yet (or no summarizer): the newest pending lines follow
+            # the summary, within the summary budget
+            summary = "\n".join(filter(None, [summary] + self._pending))
+        summary = self._truncate_front(
+            summary,
+            min(self.max_summary_tokens, budget) - self.estimate_tokens(SUMMARY_LABEL),
+        )
+        if summary:
+            summary = SUMMARY_LABEL + summary
+            budget -= self.estimate_tokens(summary) + 1
+
+        turns = []
+        for turn in reversed(self._turns):
+            cost = self.estimate_tokens(turn) + 1
+            if cost > budget:
+                turn = self._truncate_front(turn, budget - 2)
+                if turn:
+                    turns.append(turn)
+                break
+            turns.append(turn)
+            budget -= cost
+        turns.reverse()
+        return summary, turns
+
+    def render(self):
+        with self._lock:
+            summary, turns = self._parts()
+        return "\n".join(filter(None, [summary] + turns))
+
+    def stats(self):
+        with self._lock:
+            summary, turns = self._parts()
+            stats = dict(self._stats)
+            stats["pending_turns"] = len(self._pending)
+            stats["window_turns"] = len(turns)
+        stats["summary_tokens"] = self.estimate_tokens(summary)
+        stats["window_tokens"] = sum(self.estimate_tokens(turn) for turn in turns)
+        stats["memory_tokens"] = self.estimate_tokens(self.render())
+        stats["max_tokens"] = self.max_tokens
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._turns = []
+            self._pending = []
+            self._summary = ""
+            self._summarizing = False
+            self._generation += 1
+
+
+class TokenBudgetMemory(BaseMemory):
+    """LangChain memory backed by a ConversationWindow.
+
+    Drop-in for ConversationBufferMemory: memory_key holds the rendered
+    summary and recent turns, which never exceed the window's token budget.
+    """
+
+    window: Any
+    memory_key: str = "history"
+    input_key: str = "input_text"
+
+    @property
+    def memory_variables(self) -> List[str]:
+        return [self.memory_key]
+
+    def load_memory_variables(self, inputs: Dict[str, Any]) -> Dict[str, str]:
+        return {self.memory_key: self.window.render()}
+
+    def save_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]) -> None:
+        human = inputs.get(self.input_key, "")
+        ai = next(iter(outputs.values()), "") if outputs else ""
+        self.window.add_turn(human, ai)
+
+    def clear(self) -> None:
+        self.window.clear()
+
+    def stats(self):
+        return self.window.stats()
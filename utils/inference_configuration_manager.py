@@ -1,12 +1,185 @@
 import json
+import os
+import threading
+import time
+from dataclasses import dataclass
+from types import MappingProxyType
 
+DEFAULT_CONFIGURATION_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "llm_configurations.json"
+)
 
-class InferenceConfigurationManager:
 
-    def configuration_selector(model_id):
-        configuration = None
+def _freeze(value):
+    if isinstance(value, dict):
+        return MappingProxyType({name: _freeze(item) for name, item in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def _thaw(value):
+    if isinstance(value, MappingProxyType):
+        return {name: _thaw(item) for name, item in value.items()}
+    if isinstance(value, tuple):
+        return [_thaw(item) for item in value]
+    return value
+
+
+@dataclass(frozen=True)
+class ModelConfiguration:
+    """Immutable inference parameters of one model plus its pre-rendered body.
+
+    render_body() only serializes the prompt; the parameters were serialized
+    once when the configuration was loaded.
+    """
+
+    model_id: str
+    parameters: MappingProxyType
+    parameters_json: str
+    body_prefix: str
+    body_suffix: str
+
+    @classmethod
+    def from_parameters(cls, model_id, parameters):
+        parameters = {
+            name: value for name, value in parameters.items() if name != "prompt"
+        }
+        parameters_json = json.dumps(parameters)
+        if model_id == "titan" or model_id.startswith("amazon.titan-text"):
+            body_prefix = '{"textGenerationConfig": ' + parameters_json + ', "inputText": '
+        elif parameters:
+            body_prefix = parameters_json[:-1] + ', "prompt": '
+        else:
+            body_prefix = '{"prompt": '
+        return cls(
+            model_id=model_id,
+            parameters=_freeze(parameters),
+            parameters_json=parameters_json,
+            body_prefix=body_prefix,
+            body_suffix="}",
+        )
+
+    def render_body(self, prompt):
+        return self.body_prefix + json.dumps(prompt) + self.body_suffix
+
+    def as_dict(self):
+        # a fresh, mutable copy for APIs such as Bedrock(model_kwargs=...)
+        return _thaw(self.parameters)
+
+    def with_overrides(self, **overrides):
+        parameters = self.as_dict()
+        parameters.update(overrides)
+        return ModelConfiguration.from_parameters(self.model_id, parameters)
+
+
+class InferenceConfigurationRegistry:
+    """Loads llm_configurations.json once and serves ModelConfiguration objects.
+
+    The file is stat'ed at most every check_interval seconds and re-parsed
+    only when its mtime changed, so edits are picked up without a restart.
+    """
 
-        with open("./utils/llm_configurations.json") as json_file:
-            configuration_data = json.load(json_file)
-            configuration = json.dumps(configuration_data[f"{model_id}"])
+    _default = None
+    _default_lock = threading.Lock()
+
+    def __init__(self, path=DEFAULT_CONFIGURATION_PATH, check_interval=2.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._checked_at = 0.0
+        self._configurations = {}
+        self._overrides = {}
+        self.reload_count = 0
+
+    @classmethod
+    def default(cls):
+        if cls._default is None:
+            with cls._default_lock:
+                if cls._default is None:
+                    cls._default = cls()
+        return cls._default
+
+    def get(self, model_id, **overrides):
+        self._refresh()
+        configurations = self._configurations
+        if model_id not in configurations:
+            raise KeyError(f"No inference configuration for model: {model_id}")
+        if not overrides:
+            return configurations[model_id]
+
+        key = (model_id, json.dumps(overrides, sort_keys=True), self._mtime)
+        configuration = self._overrides.get(key)
+        if configuration is None:
+            configuration = configurations[model_id].with_overrides(**overrides)
+            self._overrides[key] = configuration
         return configuration
+
+    def model_ids(self):
+        self._refresh()
+        return list(self._configurations)
+
+    def _refresh(self):
+        now = time.monotonic()
+        if self._mtime is not None and now - self._checked_at < self.check_interval:
+            return
+        with self._lock:
+            if self._mtime is not None and now - self._checked_at < self.check_interval:
+                return
+            mtime = os.stat(self.path).st_mtime_ns
+            self._checked_at = now
+            if mtime == self._mtime:
+                return
+            with open(self.path) as json_file:
+                configuration_data = json.load(json_file)
+            self._configurations = self._validate(configuration_data)
+            self._overrides = {}
+            self._mtime = mtime
+            self.reload_count += 1
+
+    def _validate(self, configuration_data):
+        if not isinstance(configuration_data, dict):
+            raise ValueError(f"{self.path} must contain a JSON object")
+
+        configurations = {}
+        for model_id, parameters in configuration_data.items():
+            if not isinstance(parameters, dict):
+                raise ValueError(f"Configuration for {model_id} must be an object")
+            for name, value in parameters.items():
+                if isinstance(value, (dict, list)) and name != "stop_sequences":
+                    raise ValueError(
+                        f"Configuration for {model_id}: {name} must be a scalar"
+                    )
+                if not isinstance(value, (bool, int, float, str, list)):
+                    raise ValueError(
+                        f"Configuration for {model_id}: unsupported value for {name}"
+                    )
+
+            stop_sequences = parameters.get("stop_sequences")
+            if stop_sequences is not None:
+                if not isinstance(stop_sequences, list) or not all(
+                    isinstance(sequence, str) for sequence in stop_sequences
+                ):
+                    raise ValueError(
+                        f"Configuration for {model_id}: stop_sequences must be a list of strings"
+                    )
+                # the file stores "\\n\\nHuman:"; Bedrock expects real newlines
+                parameters = dict(parameters)
+                parameters["stop_sequences"] = [
+                    sequence.encode("utf-8").decode("unicode_escape")
+                    for sequence in stop_sequences
+                ]
+
+            configurations[model_id] = ModelConfiguration.from_parameters(
+                model_id, parameters
+            )
+        return configurations
+
+
+class InferenceConfigurationManager:
+
+    @staticmethod
+    def configuration_selector(model_id):
+        configuration = InferenceConfigurationRegistry.default().get(model_id)
+        return configuration.parameters_json
@@ -0,0 +1,280 @@
+import math
+import re
+import threading
+import time
+
+from utils.prompt_text import estimate_tokens, split_document
+
+SECTION_PATTERN = re.compile(r"^([A-Z][A-Z0-9 /&()-]{2,}):\s*")
+# a period inside a token ("0.7", "q.d.") does not end the sentence
+_SENTENCE_PATTERN = re.compile(r"(?:[^.!?]|[.!?](?=\S))+[.!?]*")
+# nor does the period of a title, an initial or a common abbreviation
+_ABBREVIATIONS = {
+    "dr", "drs", "mr", "mrs", "ms", "prof", "st", "vs", "approx", "pt", "pts",
+    "hx", "dx", "tx", "rx", "fig", "e.g", "i.e", "b.i.d", "t.i.d", "q.i.d",
+    "q.d", "p.o", "p.r.n", "a.m", "p.m",
+}
+_WORD_PATTERN = re.compile(r"[a-z0-9]+")
+# numbers, doses, negations and findings are what a critique usually checks
+_SALIENT_PATTERN = re.compile(
+    r"\d|\b(?:mg|mcg|ml|units?|denies|denied|no|not|without|negative|positive|"
+    r"allerg\w*|diagnos\w*|recommend\w*|follow-up|consult\w*)\b",
+    re.IGNORECASE,
+)
+_KEY_SECTIONS = {
+    "CHIEF COMPLAINT",
+    "IMPRESSION",
+    "ASSESSMENT",
+    "PLAN",
+    "IMPRESSION AND PLAN",
+    "ASSESSMENT AND PLAN",
+    "DIAGNOSIS",
+    "MEDICATIONS",
+    "ALLERGIES",
+    "PAST MEDICAL HISTORY",
+}
+_STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "had", "has",
+    "have", "he", "her", "his", "in", "is", "it", "of", "on", "or", "she", "that",
+    "the", "this", "to", "was", "were", "which", "with",
+}
+
+OMISSION_MARKER = "[...]"
+
+
+def _sentences(line):
+    sentences = []
+    for sentence in _SENTENCE_PATTERN.findall(line):
+        if sentences:
+            last_word = sentences[-1].rstrip().rsplit(None, 1)[-1].lower().rstrip(".")
+            if sentences[-1].rstrip().endswith(".") and (
+                last_word in _ABBREVIATIONS or (len(last_word) == 1 and last_word.isalpha())
+            ):
+                sentences[-1] += sentence
+                continue
+        sentences.append(sentence)
+    return sentences
+
+
+def _words(text):
+    return {word for word in _WORD_PATTERN.findall(text.lower()) if word not in _STOPWORDS}
+
+
+class InputCondenser:
+    """Builds a token-bounded extractive digest of the input prompt.
+
+    The instructions around the document (everything outside the
+    <document_tag> element, or nothing when there is no such element) are
+    kept verbatim. The document is split into sentences, which are scored by
+    their overlap with the model output being reviewed, by numbers, doses
+    and negations, and by clinical section (chief complaint, impression,
+    plan, ...). The best sentences that fit the budget are kept in their
+    original order under their section headers.
+
+    Token counts are estimated at chars_per_token characters per token.
+    Inputs below min_input_tokens are not condensed, and the full input is
+    used whenever the budget leaves less than min_digest_tokens for the
+    digest or no sentence of the document fits.
+    """
+
+    def __init__(
+        self,
+        max_prompt_tokens=2000,
+        max_digest_tokens=450,
+        min_input_tokens=500,
+        min_digest_tokens=150,
+        chars_per_token=4.0,
+        document_tag="notes",
+    ):
+        self.max_prompt_tokens = max_prompt_tokens
+        self.max_digest_tokens = max_digest_tokens
+        self.min_input_tokens = min_input_tokens
+        self.min_digest_tokens = min_digest_tokens
+        self.chars_per_token = chars_per_token
+        self.document_tag = document_tag
+
+    def estimate_tokens(self, text):
+        return estimate_tokens(text, self.chars_per_token)
+
+    def start(self, input_prompt, reference=""):
+        # one CondensedInput per run, shared by all critique and revision calls
+        return CondensedInput(self, input_prompt, reference)
+
+    def condense(self, text, reference="", max_tokens=None):
+        max_tokens = self.max_digest_tokens if max_tokens is None else max_tokens
+        if self.estimate_tokens(text) <= max_tokens or max_tokens < self.min_digest_tokens:
+            return text
+
+        # without a <document_tag> element the whole text is the document
+        parts = split_document(text, self.document_tag) or ("", text, "")
+        prefix, document, suffix = parts
+
+        budget = max_tokens - self.estimate_tokens(prefix + suffix)
+        if budget <= 0:
+            # the instructions alone fill the budget: no digest is better than
+            # the notes
+            return text
+
+        units = [unit for unit in self._units(document) if unit["text"]]
+        reference_words = _words(reference)
+        scored = sorted(
+            units,
+            key=lambda unit: self._score(unit, reference_words),
+            reverse=True,
+        )
+
+        selected = set()
+        used = 0
+        for unit in scored:
+            # the section header and the separator may be rendered with it
+            cost = self.estimate_tokens(unit["section"] + unit["text"]) + 2
+            if used + cost <= budget:
+                selected.add(unit["index"])
+                used += cost
+        if not selected:
+            return text
+
+        condensed = prefix + "\n" + self._render(units, selected) + "\n" + suffix
+        if self.estimate_tokens(condensed) > max_tokens:
+            return self._truncate(condensed, max_tokens)
+        return condensed
+
+    def _units(self, document):
+        # sentences of the document; lines without a header of their own
+        # belong to the section of the last header ("PHYSICAL EXAMINATION:")
+        units = []
+        section = ""
+        for line_number, line in enumerate(document.splitlines()):
+            line = line.strip()
+            if not line:
+                continue
+            match = SECTION_PATTERN.match(line)
+            if match:
+                section = match.group(1).strip()
+                line = line[match.end() :]
+            for position, sentence in enumerate(_sentences(line)):
+                units.append(
+                    {
+                        "index": len(units),
+                        "line": line_number,
+                        "section": section,
+                        "first": position == 0,
+                        "text": sentence.strip(),
+                    }
+                )
+        return units
+
+    def _score(self, unit, reference_words):
+        words = _words(unit["text"])
+        score = 0.0
+        if words and reference_words:
+            score += len(words & reference_words) / math.sqrt(len(words))
+        score += 0.5 * len(_SALIENT_PATTERN.findall(unit["text"]))
+        if unit["section"] in _KEY_SECTIONS:
+            score += 2.0
+        if unit["first"]:
+            score += 0.25
+        return score
+
+    def _render(self, units, selected):
+        lines = []
+        current_line = None
+        current_section = ""
+        previous_index = None
+        for unit in units:
+            if unit["index"] not in selected:
+                continue
+            if previous_index is not None and unit["index"] != previous_index + 1:
+                lines.append(OMISSION_MARKER)
+            if unit["line"] != current_line or lines[-1] == OMISSION_MARKER:
+                header = ""
+                if unit["section"] and unit["section"] != current_section:
+                    header = f"{unit['section']}: "
+                lines.append(header + unit["text"])
+            else:
+                lines[-1] += " " + unit["text"]
+            current_line = unit["line"]
+            current_section = unit["section"]
+            previous_index = unit["index"]
+        return "\n".join(lines)
+
+    def _truncate(self, text, max_tokens):
+        length = int(max_tokens * self.chars_per_token)
+        return text[: length - len(OMISSION_MARKER)] + OMISSION_MARKER
+
+
+class CondensedInput:
+    """The condensed input of one run.
+
+    for_prompt() returns the digest to substitute for {input_prompt} in a
+    critique prompt, shrunk further if the rendered prompt would exceed the
+    condenser's max_prompt_tokens, or the full input when that leaves less
+    than the condenser's min_digest_tokens. full_text() is the input for
+    revision prompts. Digests are cached per token limit, and the bytes and
+    tokens sent are counted against what the full input would have cost.
+    """
+
+    def __init__(self, condenser, text, reference=""):
+        self.condenser = condenser
+        self.text = text
+        self.reference = reference
+        self.enabled = condenser.estimate_tokens(text) >= condenser.min_input_tokens
+        self._lock = threading.Lock()
+        self._digests = {}
+        self.calls = 0
+        self.condense_seconds = 0.0
+        self.original_bytes = 0
+        self.sent_bytes = 0
+        self.original_tokens = 0
+        self.sent_tokens = 0
+
+    def _digest(self, max_tokens):
+        # called under self._lock
+        digest = self._digests.get(max_tokens)
+        if digest is None:
+            start = time.perf_counter()
+            digest = self.condenser.condense(self.text, self.reference, max_tokens)
+            self.condense_seconds += time.perf_counter() - start
+            self._digests[max_tokens] = digest
+        return digest
+
+    def for_prompt(self, prompt, **fields):
+        condenser = self.condenser
+        limit = None
+        if self.enabled:
+            overhead = condenser.estimate_tokens(prompt.format(input_prompt="", **fields))
+            limit = min(condenser.max_digest_tokens, condenser.max_prompt_tokens - overhead)
+            if limit < condenser.min_digest_tokens:
+                limit = None
+
+        with self._lock:
+            text = self._digest(limit) if limit is not None else self.text
+            self._count(text)
+        return text
+
+    def full_text(self):
+        with self._lock:
+            self._count(self.text)
+        return self.text
+
+    def _count(self, text):
+        # called under self._lock
+        condenser = self.condenser
+        self.calls += 1
+        self.original_bytes += len(self.text.encode("utf-8"))
+        self.sent_bytes += len(text.encode("utf-8"))
+        self.original_tokens += condenser.estimate_tokens(self.text)
+        self.sent_tokens += condenser.estimate_tokens(text)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "calls": self.calls,
+                "input_tokens": self.condenser.estimate_tokens(self.text),
+                "bytes_sent": self.sent_bytes,
+                "bytes_saved": self.original_bytes - self.sent_bytes,
+                "tokens_sent": self.sent_tokens,
+                "tokens_saved": self.original_tokens - self.sent_tokens,
+                "condense_seconds": self.condense_seconds,
+            }
@@ -0,0 +1,294 @@
+import contextlib
+import contextvars
+import math
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from botocore.exceptions import ClientError, ConnectionError, HTTPClientError
+
+from utils.metrics import MetricsRegistry
+
+RETRYABLE_CODES = {
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "ServiceUnavailableException",
+    "InternalServerException",
+    "ModelTimeoutException",
+    "ModelNotReadyException",
+}
+
+# absolute time.monotonic() deadline of the calls made in this context
+_current_deadline = contextvars.ContextVar("bedrock_deadline", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    """A Bedrock call did not complete before its deadline."""
+
+
+def remaining_deadline():
+    # seconds left before the deadline of the calling context, None if none
+    deadline = _current_deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def is_retryable(error):
+    if isinstance(error, ClientError):
+        return error.response.get("Error", {}).get("Code") in RETRYABLE_CODES
+    # connection resets, connect and read timeouts
+    return isinstance(error, (ConnectionError, HTTPClientError))
+
+
+class InvocationPolicy:
+    """Deadlines, retries and hedging for Bedrock runtime calls.
+
+    Every attempt runs on the policy's thread pool, so the caller stops
+    waiting at the deadline: the innermost deadline() of the calling
+    context, or default_deadline_seconds. A blocked attempt is abandoned,
+    not interrupted; botocore's read timeout bounds how long it lingers.
+    Each attempt carries the call's deadline: it is not sent once the
+    deadline has passed, and its wait for admission and a model slot (see
+    utils/bedrock_invoker.py) ends at the deadline.
+
+    Retryable errors (throttling, unavailable or timed out models,
+    connection errors) are retried up to max_attempts times in total with
+    full-jitter exponential backoff: a random sleep of up to
+    base_delay * 2 ** retry seconds, capped at max_delay.
+
+    With hedging, an invoke_model call that has not answered after the
+    hedge_quantile latency of the model's recent calls gets a second,
+    identical request, and whichever answers first is used. Hedging starts
+    once hedge_min_samples latencies have been seen. Streaming calls are
+    never hedged.
+    """
+
+    _default = None
+    _default_lock = threading.Lock()
+
+    def __init__(
+        self,
+        max_attempts=4,
+        base_delay=0.25,
+        max_delay=8.0,
+        default_deadline_seconds=120.0,
+        hedging=False,
+        hedge_quantile=0.95,
+        hedge_min_samples=20,
+        hedge_min_delay=0.05,
+        latency_window=200,
+        max_workers=64,
+        metrics=None,
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.default_deadline_seconds = default_deadline_seconds
+        self.hedging = hedging
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_min_delay = hedge_min_delay
+        self.latency_window = latency_window
+        self.metrics = metrics or MetricsRegistry.default()
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="bedrock-attempt"
+        )
+        self._random = random.Random()
+        self._lock = threading.Lock()
+        self._latencies = {}
+        self._clients = {}
+        self._stats = {
+            "calls": 0,
+            "retries": 0,
+            "hedges_sent": 0,
+            "hedges_won": 0,
+            "deadline_exceeded": 0,
+        }
+
+    @classmethod
+    def default(cls):
+        if cls._default is None:
+            with cls._default_lock:
+                if cls._default is None:
+                    cls._default = cls(
+                        max_attempts=int(os.environ.get("BEDROCK_RETRY_ATTEMPTS", "4")),
+                        base_delay=float(os.environ.get("BEDROCK_BACKOFF_BASE", "0.25")),
+                        max_delay=float(os.environ.get("BEDROCK_BACKOFF_MAX", "8")),
+                        default_deadline_seconds=float(
+                            os.environ.get("BEDROCK_CALL_DEADLINE", "120")
+                        ),
+                        hedging=os.environ.get("BEDROCK_HEDGING", "0") == "1",
+                        hedge_quantile=float(
+                            os.environ.get("BEDROCK_HEDGE_QUANTILE", "0.95")
+                        ),
+                    )
+        return cls._default
+
+    @staticmethod
+    @contextlib.contextmanager
+    def deadline(seconds):
+        # nested deadlines never extend the enclosing one
+        if seconds is None:
+            yield
+            return
+        deadline = time.monotonic() + seconds
+        current = _current_deadline.get()
+        if current is not None:
+            deadline = min(deadline, current)
+        token = _current_deadline.set(deadline)
+        try:
+            yield
+        finally:
+            _current_deadline.reset(token)
+
+    def wrap(self, client):
+        # one proxy per client, see ResilientBedrockRuntime
+        with self._lock:
+            proxy = self._clients.get(id(client))
+            if proxy is None:
+                proxy = ResilientBedrockRuntime(client, self)
+                self._clients[id(client)] = proxy
+            return proxy
+
+    def hedge_delay(self, model_id):
+        with self._lock:
+            latencies = self._latencies.get(model_id)
+            if not latencies or len(latencies) < self.hedge_min_samples:
+                return None
+            ordered = sorted(latencies)
+        index = max(0, math.ceil(self.hedge_quantile * len(ordered)) - 1)
+        return max(self.hedge_min_delay, ordered[index])
+
+    def _record_latency(self, model_id, seconds):
+        with self._lock:
+            latencies = self._latencies.get(model_id)
+            if latencies is None:
+                latencies = self._latencies[model_id] = deque(maxlen=self.latency_window)
+            latencies.append(seconds)
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self._stats[name] += value
+
+    def _submit(self, function, deadline):
+        # attempts keep the caller's scheduler session and run under the
+        # call's deadline, so an abandoned attempt is not sent late
+        context = contextvars.copy_context()
+        started_at = time.perf_counter()
+
+        def attempt():
+            _current_deadline.set(deadline)
+            if self._remaining(deadline) <= 0:
+                raise DeadlineExceeded("deadline passed before the request was sent")
+            result = function()
+            return result, time.perf_counter() - started_at
+
+        return self._executor.submit(context.run, attempt)
+
+    def _remaining(self, deadline):
+        return deadline - time.monotonic()
+
+    def _deadline_exceeded(self, model_id, operation):
+        self._count("deadline_exceeded")
+        self.metrics.inc("invocation_deadline_exceeded_total", model=model_id)
+        return DeadlineExceeded(f"{operation} on {model_id} exceeded its deadline")
+
+    def _attempt(self, model_id, operation, function, deadline, hedge):
+        primary = self._submit(function, deadline)
+        pending = {primary}
+        delay = self.hedge_delay(model_id) if hedge and self.hedging else None
+        if delay is not None and delay < self._remaining(deadline):
+            done, _ = wait(pending, timeout=delay)
+            if not done:
+                self._count("hedges_sent")
+                self.metrics.inc("invocation_hedges_total", model=model_id)
+                pending.add(self._submit(function, deadline))
+
+        error = None
+        while pending:
+            remaining = self._remaining(deadline)
+            if remaining <= 0:
+                raise self._deadline_exceeded(model_id, operation)
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    # the other request may still succeed
+                    error = error or future.exception()
+                    continue
+                result, seconds = future.result()
+                if future is not primary:
+                    self._count("hedges_won")
+                    self.metrics.inc("invocation_hedges_won_total", model=model_id)
+                self._record_latency(model_id, seconds)
+                return result
+        if isinstance(error, DeadlineExceeded):
+            raise self._deadline_exceeded(model_id, operation) from error
+        raise error
+
+    def invoke(self, model_id, operation, function, hedge=False):
+        self._count("calls")
+        deadline = _current_deadline.get()
+        if deadline is None:
+            deadline = time.monotonic() + self.default_deadline_seconds
+
+        for attempt in range(self.max_attempts):
+            try:
+                return self._attempt(model_id, operation, function, deadline, hedge)
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                if not is_retryable(e) or attempt + 1 >= self.max_attempts:
+                    raise
+                backoff = self._random.uniform(
+                    0, min(self.max_delay, self.base_delay * 2**attempt)
+                )
+                if backoff >= self._remaining(deadline):
+                    raise self._deadline_exceeded(model_id, operation) from e
+                print(f"Retrying {operation} on {model_id} in {backoff:.2f}s: {e}")
+                self._count("retries")
+                self.metrics.inc(
+                    "invocation_retries_total", model=model_id, error=type(e).__name__
+                )
+                time.sleep(backoff)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["hedge_delay"] = {
+            model_id: self.hedge_delay(model_id) for model_id in list(self._latencies)
+        }
+        return stats
+
+
+class ResilientBedrockRuntime:
+    """bedrock-runtime client whose model calls go through an InvocationPolicy.
+
+    Everything else (meta, events, other operations) is the wrapped client's.
+    """
+
+    def __init__(self, client, policy):
+        self._client = client
+        self._policy = policy
+
+    def invoke_model(self, **kwargs):
+        return self._policy.invoke(
+            kwargs.get("modelId", ""),
+            "InvokeModel",
+            lambda: self._client.invoke_model(**kwargs),
+            hedge=True,
+        )
+
+    def invoke_model_with_response_stream(self, **kwargs):
+        return self._policy.invoke(
+            kwargs.get("modelId", ""),
+            "InvokeModelWithResponseStream",
+            lambda: self._client.invoke_model_with_response_stream(**kwargs),
+        )
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
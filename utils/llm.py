@@ -1,116 +1,316 @@
-import boto3
-from botocore.config import Config
-
+import hashlib
 import json
 import os
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 from langchain_community.embeddings import BedrockEmbeddings
 from langchain.llms.bedrock import Bedrock
 
+from utils.bedrock_client_registry import BedrockClientRegistry
+from utils.bedrock_invoker import BedrockInvoker
+from utils.inference_configuration_manager import InferenceConfigurationRegistry
+from utils.invocation_policy import InvocationPolicy
+from utils.request_scheduler import bind_context
+from utils.response_cache import (
+    LangChainResponseCache,
+    TieredCache,
+    response_cache_key,
+)
+from utils.semantic_cache import SemanticCache
 
-class LLM:
 
-    titan_inference_configuration = {
-        "temperature": 0.1,
-        "topP": 1,
-        "maxTokenCount": 4096,
-    }
-
-    claude_inference_configuration = {
-        "temperature": 0.1,
-        "top_p": 0.999,
-        "top_k": 250,
-        "max_tokens_to_sample": 200,
-    }
+class LLM:
 
     current_working_directory = os.getcwd()
 
     bedrock_embedding_model_id = "amazon.titan-embed-text-v1"
 
+    bedrock_region_name = os.environ.get("BEDROCK_REGION", "us-west-2")
+    bedrock_endpoint_url = os.environ.get("BEDROCK_ENDPOINT_URL")
+    bedrock_max_pool_connections = int(
+        os.environ.get("BEDROCK_MAX_POOL_CONNECTIONS", "50")
+    )
+    bedrock_retry_mode = os.environ.get("BEDROCK_RETRY_MODE", "adaptive")
+    # botocore makes a single attempt; InvocationPolicy retries with backoff
+    # and enforces the deadlines
+    bedrock_max_attempts = int(os.environ.get("BEDROCK_MAX_ATTEMPTS", "1"))
+    bedrock_read_timeout = int(os.environ.get("BEDROCK_READ_TIMEOUT", "60"))
+    bedrock_connect_timeout = int(os.environ.get("BEDROCK_CONNECT_TIMEOUT", "10"))
+
+    # prompts and completions are clinical notes: by default they are only
+    # cached in memory, for the life of the process. Setting a path (e.g.
+    # ./.cache/bedrock_responses.sqlite3) also keeps them, and the embedding
+    # cache, unencrypted on disk until their TTL expires
+    response_cache_enabled = os.environ.get("BEDROCK_RESPONSE_CACHE", "1") == "1"
+    response_cache_path = os.environ.get("BEDROCK_RESPONSE_CACHE_PATH") or None
+    response_cache_ttl_seconds = int(
+        os.environ.get("BEDROCK_RESPONSE_CACHE_TTL_SECONDS", str(7 * 24 * 3600))
+    )
+    response_cache_max_memory_entries = 512
+    response_cache_max_disk_entries = 10000
+
+    _response_cache = None
+    _response_cache_lock = threading.Lock()
+
+    embedding_cache_enabled = os.environ.get("BEDROCK_EMBEDDING_CACHE", "1") == "1"
+    embedding_cache_max_memory_entries = 4096
+    embedding_cache_max_disk_entries = 200000
+    embedding_cache_ttl_seconds = 365 * 24 * 3600
+    embedding_max_concurrency = 8
+
+    _embedding_cache = None
+
+    # final results of near-duplicate prompts, see SemanticCache; off by
+    # default because a hit returns the result of a *different* prompt. The
+    # results are derived from the clinical notes, so like the response
+    # cache they stay in memory unless SEMANTIC_CACHE_PATH is set
+    semantic_cache_enabled = os.environ.get("SEMANTIC_CACHE", "0") == "1"
+    semantic_cache_path = os.environ.get("SEMANTIC_CACHE_PATH") or None
+    semantic_cache_threshold = float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", "0.98"))
+    semantic_cache_max_entries = int(
+        os.environ.get("SEMANTIC_CACHE_MAX_ENTRIES", "2000")
+    )
+    semantic_cache_ttl_seconds = 7 * 24 * 3600
+    semantic_cache_dimension = 1536
+
+    _semantic_cache = None
+
     def call_llm_llama(self, payload, bedrock_model_id):
         print(f"Model Id: {bedrock_model_id}")
         print("---calling llm")
 
-        boto3_bedrock = self.setup_bedrock_runtime()
-
         body = json.dumps(payload)
-        accept = "application/json"
-        contentType = "application/json"
 
         try:
-            response = boto3_bedrock.invoke_model(
-                body=body,
-                modelId=bedrock_model_id,
-                accept=accept,
-                contentType=contentType,
-            )
-            response_body = json.loads(response.get("body").read())
+            return self._invoke_model(body, bedrock_model_id)
         except Exception as e:
             print(e)
+            raise
+
+    async def acall_llm_llama(self, payload, bedrock_model_id):
+        return await BedrockInvoker.default().run(
+            self.call_llm_llama, payload, bedrock_model_id, model_id=bedrock_model_id
+        )
 
-        return response_body
+    def _invoke_model(self, body, bedrock_model_id):
+        boto3_bedrock = self.setup_bedrock_runtime()
+        response = boto3_bedrock.invoke_model(
+            body=body,
+            modelId=bedrock_model_id,
+            accept="application/json",
+            contentType="application/json",
+        )
+        return json.loads(response.get("body").read())
+
+    def model_configuration(self, bedrock_model_id, **overrides):
+        # parsed once from llm_configurations.json, see InferenceConfigurationRegistry
+        return InferenceConfigurationRegistry.default().get(
+            bedrock_model_id, **overrides
+        )
 
     def call_llm(self, prompt, inference_configuration, bedrock_model_id):
+        # inference_configuration=None uses the model's registered configuration
 
         print(f"Model Id: {bedrock_model_id}")
         print("---calling llm")
         # print(inference_configuration)
 
-        # inference_configuration["stop_sequences"][0] = inference_configuration["stop_sequences"][0].encode("utf-8").decode("unicode_escape")
+        model_configuration = None
+        if inference_configuration is None:
+            model_configuration = self.model_configuration(bedrock_model_id)
+            inference_configuration = model_configuration.parameters
 
-        boto3_bedrock = self.setup_bedrock_runtime()
-
-        inference_configuration["prompt"] = prompt
+        cache = self.response_cache()
+        if cache is not None:
+            cache_key = response_cache_key(
+                bedrock_model_id, dict(inference_configuration), prompt
+            )
+            cached = cache.get(cache_key)
+            if cached is not None:
+                return cached.decode("utf-8")
 
-        body = json.dumps(inference_configuration)
-        accept = "application/json"
-        contentType = "application/json"
+        # the payload is built per call; the caller's configuration is never
+        # modified, so one configuration can be shared by concurrent calls
+        if model_configuration is not None:
+            body = model_configuration.render_body(prompt)
+        else:
+            body = json.dumps(dict(inference_configuration, prompt=prompt))
 
         try:
-            response = boto3_bedrock.invoke_model(
-                body=body,
-                modelId=bedrock_model_id,
-                accept=accept,
-                contentType=contentType,
-            )
-            response_body = json.loads(response.get("body").read())["completion"]
+            response_body = self._invoke_model(body, bedrock_model_id)["completion"]
             response_body = response_body.replace("<summary>", "")
             response_body = response_body.replace("</summary>", "")
+            if cache is not None:
+                cache.set(cache_key, response_body.encode("utf-8"))
             return response_body
         except Exception as e:
+            # throttling and rejected admissions reach the caller, see
+            # RequestScheduler
             print(e)
+            raise
+
+    async def acall_llm(self, prompt, inference_configuration, bedrock_model_id):
+        return await BedrockInvoker.default().run(
+            self.call_llm,
+            prompt,
+            inference_configuration,
+            bedrock_model_id,
+            model_id=bedrock_model_id,
+        )
 
     def list_foundation_models(self):
-        boto3_bedrock = self.setup_bedrock_runtime()
+        boto3_bedrock = self.setup_bedrock_service()
         models_list = boto3_bedrock.list_foundation_models()
 
         return models_list
 
     def call_titan_embeddings(self, content_to_embed):
-        boto3_bedrock = self.setup_bedrock_runtime()
+        embeddings = self.embed_texts([content_to_embed])[0]
 
-        embedder = BedrockEmbeddings(
-            client=boto3_bedrock, model_id=self.bedrock_embedding_model_id
+        return embeddings.tolist()
+
+    async def acall_titan_embeddings(self, content_to_embed):
+        return await BedrockInvoker.default().run(
+            self.call_titan_embeddings,
+            content_to_embed,
+            model_id=self.bedrock_embedding_model_id,
         )
 
-        embeddings = embedder.embed_query(content_to_embed)
+    async def aembed_texts(self, texts, max_concurrency=None):
+        return await BedrockInvoker.default().run(
+            self.embed_texts,
+            texts,
+            max_concurrency,
+            model_id=self.bedrock_embedding_model_id,
+        )
 
-        return embeddings
+    def setup_langchain_bedrock_embeddings(self):
+        embedder = BedrockEmbeddings(
+            client=self.setup_bedrock_runtime(),
+            model_id=self.bedrock_embedding_model_id,
+        )
+        return embedder
+
+    def embed_texts(self, texts, max_concurrency=None):
+        # returns a float32 matrix with one row per input text, in input order;
+        # duplicates are embedded once and known texts come from the cache
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+
+        model_id = self.bedrock_embedding_model_id
+        cache = self.embedding_cache()
+        keys = {}
+        for text in texts:
+            if text not in keys:
+                keys[text] = hashlib.sha256(
+                    f"{model_id}\n{text}".encode("utf-8")
+                ).hexdigest()
+
+        vectors = {}
+        missing = []
+        for text, key in keys.items():
+            cached = cache.get(key) if cache is not None else None
+            if cached is not None:
+                vectors[text] = np.frombuffer(cached, dtype=np.float32)
+            else:
+                missing.append(text)
+
+        if missing:
+            max_workers = min(
+                max_concurrency or self.embedding_max_concurrency, len(missing)
+            )
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                results = executor.map(bind_context(self._invoke_titan_embedding), missing)
+                for text, vector in zip(missing, results):
+                    vectors[text] = vector
+                    if cache is not None:
+                        cache.set(keys[text], vector.tobytes())
+
+        return np.vstack([vectors[text] for text in texts])
+
+    def _invoke_titan_embedding(self, text):
+        response_body = self._invoke_model(
+            json.dumps({"inputText": text}), self.bedrock_embedding_model_id
+        )
+        return np.asarray(response_body["embedding"], dtype=np.float32)
 
     def setup_bedrock_runtime(self):
-        session = boto3.Session()
-        config = Config(read_timeout=2000)
-        # use default public bedrock service endpoint url
-        bedrock = session.client(
+        # clients are pooled process-wide, see BedrockClientRegistry
+        # endpoint_url='https://prod.us-west-2.dataplane.bedrock.aws.dev'
+        bedrock = BedrockClientRegistry.get_client(
             service_name="bedrock-runtime",
-            region_name="us-west-2",
-            config=config,
-            # endpoint_url='https://prod.us-west-2.dataplane.bedrock.aws.dev'
+            region_name=self.bedrock_region_name,
+            endpoint_url=self.bedrock_endpoint_url,
+            max_pool_connections=self.bedrock_max_pool_connections,
+            retry_mode=self.bedrock_retry_mode,
+            max_attempts=self.bedrock_max_attempts,
+            read_timeout=self.bedrock_read_timeout,
+            connect_timeout=self.bedrock_connect_timeout,
         )
-        return bedrock
+        # every attempt (hedges and retries included) holds a slot of the
+        # model's concurrency limit, see BedrockInvoker
+        return InvocationPolicy.default().wrap(BedrockInvoker.default().wrap(bedrock))
+
+    @classmethod
+    def response_cache(cls):
+        if not cls.response_cache_enabled:
+            return None
+        if cls._response_cache is None:
+            with cls._response_cache_lock:
+                if cls._response_cache is None:
+                    cls._response_cache = TieredCache(
+                        path=cls.response_cache_path,
+                        table="bedrock_responses",
+                        max_memory_entries=cls.response_cache_max_memory_entries,
+                        max_disk_entries=cls.response_cache_max_disk_entries,
+                        ttl_seconds=cls.response_cache_ttl_seconds,
+                    )
+        return cls._response_cache
+
+    @classmethod
+    def embedding_cache(cls):
+        if not cls.embedding_cache_enabled:
+            return None
+        if cls._embedding_cache is None:
+            with cls._response_cache_lock:
+                if cls._embedding_cache is None:
+                    cls._embedding_cache = TieredCache(
+                        path=cls.response_cache_path,
+                        table="titan_embeddings",
+                        max_memory_entries=cls.embedding_cache_max_memory_entries,
+                        max_disk_entries=cls.embedding_cache_max_disk_entries,
+                        ttl_seconds=cls.embedding_cache_ttl_seconds,
+                    )
+        return cls._embedding_cache
+
+    @classmethod
+    def semantic_cache(cls):
+        if not cls.semantic_cache_enabled:
+            return None
+        if cls._semantic_cache is None:
+            with cls._response_cache_lock:
+                if cls._semantic_cache is None:
+                    cls._semantic_cache = SemanticCache(
+                        dimension=cls.semantic_cache_dimension,
+                        max_entries=cls.semantic_cache_max_entries,
+                        similarity_threshold=cls.semantic_cache_threshold,
+                        ttl_seconds=cls.semantic_cache_ttl_seconds,
+                        path=cls.semantic_cache_path or None,
+                    )
+        return cls._semantic_cache
+
+    def setup_langchain_cache(self):
+        cache = self.response_cache()
+        if cache is None:
+            return False
+        return LangChainResponseCache(cache)
 
     def setup_langchain_bedrock_claude_v2_1(
-        self, bedrock_model_id, inference_configuration
+        self, bedrock_model_id, inference_configuration, streaming=False, callbacks=None
     ):
 
         langchain_bedrock_claude = Bedrock(
@@ -118,24 +318,30 @@ class LLM:
             client=self.setup_bedrock_runtime(),
             verbose=True,
             model_kwargs=inference_configuration,
-            cache=False,
+            cache=self.setup_langchain_cache(),
+            streaming=streaming,
+            callbacks=callbacks,
         )
         return langchain_bedrock_claude
 
-    def setup_langchain_bedrock_llama(self, bedrock_model_id, inference_configuration):
+    def setup_langchain_bedrock_llama(
+        self, bedrock_model_id, inference_configuration, streaming=False, callbacks=None
+    ):
 
         langchain_bedrock_llama = Bedrock(
             model_id=bedrock_model_id,
             client=self.setup_bedrock_runtime(),
             verbose=True,
             model_kwargs=inference_configuration,
-            cache=False,
+            cache=self.setup_langchain_cache(),
+            streaming=streaming,
+            callbacks=callbacks,
         )
 
         return langchain_bedrock_llama
 
     def setup_langchain_bedrock_claude_instant(
-        self, bedrock_model_id, inference_configuration
+        self, bedrock_model_id, inference_configuration, streaming=False, callbacks=None
     ):
         print(inference_configuration)
 
@@ -144,14 +350,41 @@ class LLM:
             client=self.setup_bedrock_runtime(),
             verbose=True,
             model_kwargs=inference_configuration,
-            cache=False,
+            cache=self.setup_langchain_cache(),
+            # streaming uses invoke_model_with_response_stream and reports
+            # each token through the on_llm_new_token callback
+            streaming=streaming,
+            callbacks=callbacks,
         )
 
         return langchain_bedrock_claude_instant
 
-    def setup_bedrock_service(self):
-        session = boto3.Session()
+    def setup_langchain_bedrock(
+        self, bedrock_model_id, inference_configuration, streaming=False, callbacks=None
+    ):
+        if bedrock_model_id.startswith("anthropic.claude-v2"):
+            setup = self.setup_langchain_bedrock_claude_v2_1
+        elif bedrock_model_id.startswith("meta.llama"):
+            setup = self.setup_langchain_bedrock_llama
+        else:
+            setup = self.setup_langchain_bedrock_claude_instant
+        return setup(
+            bedrock_model_id,
+            inference_configuration,
+            streaming=streaming,
+            callbacks=callbacks,
+        )
 
+    def setup_bedrock_service(self):
         # use default public bedrock service endpoint url
-        bedrock = session.client(service_name="bedrock", region_name="us-west-2")
+        bedrock = BedrockClientRegistry.get_client(
+            service_name="bedrock",
+            region_name=self.bedrock_region_name,
+            max_pool_connections=self.bedrock_max_pool_connections,
+            retry_mode=self.bedrock_retry_mode,
+            max_attempts=self.bedrock_max_attempts,
+        )
         return bedrock
+
+    def bedrock_client_stats(self):
+        return BedrockClientRegistry.stats()
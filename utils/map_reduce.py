@@ -0,0 +1,177 @@
+import math
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+from utils.input_condenser import SECTION_PATTERN
+from utils.prompt_text import estimate_tokens, split_document
+from utils.request_scheduler import bind_context
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+class MapReduceSummarizer:
+    """Summarizes long notes section by section, then merges the summaries.
+
+    The <document_tag> element of the input (the longest one, as the
+    instructions may mention the tag too) is split on section headers
+    ("HISTORY OF PRESENT ILLNESS:", "PHYSICAL EXAMINATION:", ...) and
+    consecutive sections are grouped into chunks of at most
+    max_chunk_tokens; a longer section is split between sentences. The
+    chunks are summarized by map_chain, at most max_concurrency at once, and
+    reduce_chain completes the original task from the section summaries,
+    which replace the notes in the input.
+
+    Inputs whose notes are shorter than min_document_tokens are left to the
+    caller (summarize() returns None). map_deadline and reduce_deadline
+    return the context each chunk summary and the merge run in, so a note
+    that needs several waves of chunks is not bounded by one call's deadline. Tokens are estimated at
+    chars_per_token characters per token.
+    """
+
+    def __init__(
+        self,
+        map_chain,
+        reduce_chain,
+        max_chunk_tokens=1200,
+        min_document_tokens=3000,
+        max_concurrency=4,
+        chars_per_token=4.0,
+        document_tag="notes",
+    ):
+        self.map_chain = map_chain
+        self.reduce_chain = reduce_chain
+        self.max_chunk_tokens = max_chunk_tokens
+        self.min_document_tokens = min_document_tokens
+        self.max_concurrency = max_concurrency
+        self.chars_per_token = chars_per_token
+        self.document_tag = document_tag
+
+    def estimate_tokens(self, text):
+        return estimate_tokens(text, self.chars_per_token)
+
+    def split_document(self, text):
+        # returns (text before the notes, notes, text after the notes)
+        return split_document(text, self.document_tag)
+
+    def sections(self, document):
+        # (header, text) pairs; text before the first header has no header
+        sections = []
+        header, lines = "", []
+        for line in document.splitlines():
+            match = SECTION_PATTERN.match(line.strip())
+            if match and lines:
+                sections.append((header, "\n".join(lines).strip()))
+                lines = []
+            if match:
+                header = match.group(1).strip()
+            lines.append(line.strip())
+        if lines:
+            sections.append((header, "\n".join(lines).strip()))
+        return [(header, text) for header, text in sections if text]
+
+    def _split_long(self, text):
+        # the fewest pieces of at most max_chunk_tokens, of similar size, cut
+        # between sentences
+        count = math.ceil(self.estimate_tokens(text) / self.max_chunk_tokens)
+        target = self.estimate_tokens(text) / count
+        pieces, current = [], ""
+        for sentence in _SENTENCE_END.split(text):
+            candidate = f"{current} {sentence}".strip()
+            if current and (
+                self.estimate_tokens(candidate) > self.max_chunk_tokens
+                or self.estimate_tokens(current) >= target
+            ):
+                pieces.append(current)
+                candidate = sentence
+            while self.estimate_tokens(candidate) > self.max_chunk_tokens:
+                length = int(self.max_chunk_tokens * self.chars_per_token)
+                pieces.append(candidate[:length])
+                candidate = candidate[length:]
+            current = candidate
+        if current:
+            pieces.append(current)
+        return pieces
+
+    def chunks(self, document):
+        chunks = []
+        headers, texts, tokens = [], [], 0
+        for header, text in self.sections(document):
+            section_tokens = self.estimate_tokens(text)
+            if texts and tokens + section_tokens > self.max_chunk_tokens:
+                chunks.append({"sections": headers, "text": "\n".join(texts)})
+                headers, texts, tokens = [], [], 0
+            if section_tokens > self.max_chunk_tokens:
+                for piece in self._split_long(text):
+                    chunks.append({"sections": [header], "text": piece})
+                continue
+            headers.append(header)
+            texts.append(text)
+            tokens += section_tokens
+        if texts:
+            chunks.append({"sections": headers, "text": "\n".join(texts)})
+        for index, chunk in enumerate(chunks):
+            chunk["index"] = index
+            chunk["tokens"] = self.estimate_tokens(chunk["text"])
+        return chunks
+
+    def summarize(
+        self,
+        input_text,
+        map_callbacks=None,
+        reduce_callbacks=None,
+        on_chunk=None,
+        map_deadline=nullcontext,
+        reduce_deadline=nullcontext,
+    ):
+        parts = self.split_document(input_text)
+        if parts is None or self.estimate_tokens(parts[1]) < self.min_document_tokens:
+            return None
+        prefix, document, suffix = parts
+        chunks = self.chunks(document)
+
+        def summarize_chunk(chunk):
+            start = time.perf_counter()
+            with map_deadline():
+                summary = self.map_chain.run(
+                    sections=", ".join(filter(None, chunk["sections"])) or "untitled",
+                    chunk=chunk["text"],
+                    callbacks=map_callbacks,
+                ).strip()
+            report = {
+                "index": chunk["index"],
+                "sections": chunk["sections"],
+                "tokens": chunk["tokens"],
+                "summary_tokens": self.estimate_tokens(summary),
+                "duration_seconds": time.perf_counter() - start,
+            }
+            if on_chunk is not None:
+                on_chunk(report)
+            return summary, report
+
+        start = time.perf_counter()
+        max_workers = max(1, min(self.max_concurrency, len(chunks)))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(bind_context(summarize_chunk), chunks))
+        map_seconds = time.perf_counter() - start
+
+        merged_notes = "\n\n".join(
+            f"{', '.join(filter(None, chunk['sections'])) or 'NOTES'}:\n{summary}"
+            for chunk, (summary, _) in zip(chunks, results)
+        )
+        start = time.perf_counter()
+        with reduce_deadline():
+            output = self.reduce_chain.run(
+                task=prefix + "\n" + merged_notes + "\n" + suffix,
+                callbacks=reduce_callbacks,
+            )
+        return output, {
+            "chunks": [report for _, report in results],
+            "document_tokens": self.estimate_tokens(document),
+            "merged_tokens": self.estimate_tokens(merged_notes),
+            "max_chunk_tokens": self.max_chunk_tokens,
+            "max_concurrency": self.max_concurrency,
+            "map_seconds": map_seconds,
+            "reduce_seconds": time.perf_counter() - start,
+        }
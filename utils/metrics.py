@@ -0,0 +1,543 @@
+import atexit
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from langchain.callbacks.base import BaseCallbackHandler
+
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0,
+)
+MEMORY_TOKEN_BUCKETS = (0, 100, 250, 500, 1000, 1500, 2000, 4000, 8000)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _body_bytes(body):
+    if body is None:
+        return 0
+    if isinstance(body, str):
+        return len(body.encode("utf-8"))
+    try:
+        return len(body)
+    except TypeError:
+        return 0
+
+
+class MetricsRegistry:
+    """Process-wide counters and histograms, rendered in Prometheus text format.
+
+    Metrics are created on first use; labels are passed as keyword arguments.
+    Every name gets the registry prefix on export.
+    """
+
+    _default = None
+    _default_lock = threading.Lock()
+
+    def __init__(self, prefix="bedrock_cai_"):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._buckets = {}
+
+    @classmethod
+    def default(cls):
+        if cls._default is None:
+            with cls._default_lock:
+                if cls._default is None:
+                    cls._default = cls()
+        return cls._default
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=DEFAULT_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            buckets = self._buckets.setdefault(name, tuple(buckets))
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * len(buckets), 0.0, 0]
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram[0][index] += 1
+                    break
+            histogram[1] += value
+            histogram[2] += 1
+
+    def snapshot(self):
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {
+                key: (list(counts), total, count)
+                for key, (counts, total, count) in self._histograms.items()
+            }
+            buckets = dict(self._buckets)
+        return counters, histograms, buckets
+
+    def render(self):
+        counters, histograms, buckets = self.snapshot()
+        lines = []
+
+        by_name = defaultdict(list)
+        for (name, labels), value in counters.items():
+            by_name[name].append((labels, value))
+        for name in sorted(by_name):
+            metric = self.prefix + name
+            lines.append(f"# TYPE {metric} counter")
+            for labels, value in sorted(by_name[name]):
+                lines.append(f"{metric}{_format_labels(labels)} {value}")
+
+        by_name = defaultdict(list)
+        for (name, labels), histogram in histograms.items():
+            by_name[name].append((labels, histogram))
+        for name in sorted(by_name):
+            metric = self.prefix + name
+            lines.append(f"# TYPE {metric} histogram")
+            for labels, (counts, total, count) in sorted(by_name[name]):
+                cumulative = 0
+                for bound, bucket_count in zip(buckets[name], counts):
+                    cumulative += bucket_count
+                    lines.append(
+                        f"{metric}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}"
+                    )
+                lines.append(
+                    f"{metric}_bucket{_format_labels(labels, [('le', '+Inf')])} {count}"
+                )
+                lines.append(f"{metric}_sum{_format_labels(labels)} {total}")
+                lines.append(f"{metric}_count{_format_labels(labels)} {count}")
+
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+            self._buckets.clear()
+
+
+def instrument_client(client, metrics=None):
+    """Records every Bedrock API call of a boto3 client (or a stand-in that
+    emits the same botocore events): wall time including retries, request
+    and response bytes, token counts from the Bedrock usage headers,
+    retries and errors.
+    """
+    metrics = metrics or MetricsRegistry.default()
+
+    def before_parameter_build(params, context, **kwargs):
+        context["metrics_model_id"] = params.get("modelId", "")
+        context["metrics_request_bytes"] = _body_bytes(params.get("body"))
+        context["metrics_started_at"] = time.perf_counter()
+
+    def after_call(parsed, context, event_name, **kwargs):
+        started_at = context.pop("metrics_started_at", None)
+        if started_at is None:
+            return
+        model_id = context.get("metrics_model_id", "")
+        operation = event_name.rsplit(".", 1)[-1]
+        metadata = parsed.get("ResponseMetadata", {})
+        headers = metadata.get("HTTPHeaders", {})
+
+        status = "ok"
+        if metadata.get("HTTPStatusCode", 200) >= 300 or "Error" in parsed:
+            status = "error"
+            metrics.inc(
+                "bedrock_errors_total",
+                model=model_id,
+                code=parsed.get("Error", {}).get("Code", "Unknown"),
+            )
+        metrics.inc("bedrock_calls_total", model=model_id, operation=operation, status=status)
+        metrics.observe(
+            "bedrock_call_seconds",
+            time.perf_counter() - started_at,
+            model=model_id,
+            operation=operation,
+        )
+        metrics.inc(
+            "bedrock_request_bytes_total",
+            context.get("metrics_request_bytes", 0),
+            model=model_id,
+        )
+        metrics.inc(
+            "bedrock_response_bytes_total",
+            int(headers.get("content-length", 0) or 0),
+            model=model_id,
+        )
+        metrics.inc(
+            "bedrock_input_tokens_total",
+            int(headers.get("x-amzn-bedrock-input-token-count", 0) or 0),
+            model=model_id,
+        )
+        metrics.inc(
+            "bedrock_output_tokens_total",
+            int(headers.get("x-amzn-bedrock-output-token-count", 0) or 0),
+            model=model_id,
+        )
+        retries = metadata.get("RetryAttempts", 0)
+        if retries:
+            metrics.inc("bedrock_retries_total", retries, model=model_id)
+
+    def after_call_error(exception, context, event_name, **kwargs):
+        # connection errors and timeouts; HTTP errors arrive through after-call
+        started_at = context.pop("metrics_started_at", None)
+        if started_at is None:
+            return
+        model_id = context.get("metrics_model_id", "")
+        operation = event_name.rsplit(".", 1)[-1]
+        metrics.inc("bedrock_errors_total", model=model_id, code=type(exception).__name__)
+        metrics.inc("bedrock_calls_total", model=model_id, operation=operation, status="error")
+        metrics.observe(
+            "bedrock_call_seconds",
+            time.perf_counter() - started_at,
+            model=model_id,
+            operation=operation,
+        )
+
+    # unique ids make instrumenting the same client twice a no-op
+    events = client.meta.events
+    events.register(
+        "before-parameter-build",
+        before_parameter_build,
+        unique_id="metrics-before-parameter-build",
+    )
+    events.register("after-call", after_call, unique_id="metrics-after-call")
+    events.register(
+        "after-call-error", after_call_error, unique_id="metrics-after-call-error"
+    )
+    return client
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """Per-stage timings and sizes of the constitutional pipeline.
+
+    Chains and LLM calls are attributed to the stage of the chain they run
+    under ("original", "critique", "revision" or the whole "pipeline").
+    Token counts come from the LLM's reported usage when there is one and
+    are estimated at four bytes per token otherwise. Stage events of the
+    ConstitutionalReviewChain add per-principle timings.
+    """
+
+    _default = None
+    _default_lock = threading.Lock()
+
+    stages = ("original", "map", "critique", "revision")
+
+    def __init__(self, metrics=None):
+        self.metrics = metrics or MetricsRegistry.default()
+        self._lock = threading.Lock()
+        self._runs = {}
+
+    @classmethod
+    def default(cls):
+        if cls._default is None:
+            with cls._default_lock:
+                if cls._default is None:
+                    cls._default = cls()
+        return cls._default
+
+    def _start(self, run_id, parent_run_id, tags, **fields):
+        stage = next((tag for tag in tags or () if tag in self.stages), None)
+        with self._lock:
+            if stage is None:
+                parent = self._runs.get(parent_run_id)
+                if parent is not None:
+                    stage = parent["stage"]
+                else:
+                    stage = "pipeline" if parent_run_id is None else "chain"
+            self._runs[run_id] = dict(
+                fields, stage=stage, started_at=time.perf_counter()
+            )
+
+    def _finish(self, run_id):
+        with self._lock:
+            run = self._runs.pop(run_id, None)
+        if run is not None:
+            run["seconds"] = time.perf_counter() - run["started_at"]
+        return run
+
+    def on_chain_start(
+        self, serialized, inputs, *, run_id, parent_run_id=None, tags=None, **kwargs
+    ):
+        self._start(run_id, parent_run_id, tags)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._chain_finished(run_id, "ok")
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._chain_finished(run_id, "error")
+
+    def _chain_finished(self, run_id, status):
+        run = self._finish(run_id)
+        if run is None:
+            return
+        self.metrics.inc("pipeline_chain_runs_total", stage=run["stage"], status=status)
+        self.metrics.observe("pipeline_chain_seconds", run["seconds"], stage=run["stage"])
+
+    def on_llm_start(
+        self, serialized, prompts, *, run_id, parent_run_id=None, tags=None, **kwargs
+    ):
+        prompt_bytes = sum(_body_bytes(prompt) for prompt in prompts)
+        self._start(run_id, parent_run_id, tags, prompt_bytes=prompt_bytes)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        run = self._finish(run_id)
+        if run is None:
+            return
+        stage = run["stage"]
+        completion_bytes = sum(
+            _body_bytes(generation.text)
+            for generations in response.generations
+            for generation in generations
+        )
+        usage = (response.llm_output or {}).get("usage") or {}
+        input_tokens = usage.get("prompt_tokens") or usage.get("input_tokens")
+        output_tokens = usage.get("completion_tokens") or usage.get("output_tokens")
+
+        self.metrics.inc("pipeline_llm_calls_total", stage=stage, status="ok")
+        self.metrics.observe("pipeline_llm_seconds", run["seconds"], stage=stage)
+        self.metrics.inc("pipeline_llm_prompt_bytes_total", run["prompt_bytes"], stage=stage)
+        self.metrics.inc("pipeline_llm_completion_bytes_total", completion_bytes, stage=stage)
+        self.metrics.inc(
+            "pipeline_llm_input_tokens_total",
+            input_tokens or run["prompt_bytes"] // 4,
+            stage=stage,
+        )
+        self.metrics.inc(
+            "pipeline_llm_output_tokens_total",
+            output_tokens or completion_bytes // 4,
+            stage=stage,
+        )
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        run = self._finish(run_id)
+        if run is None:
+            return
+        self.metrics.inc("pipeline_llm_calls_total", stage=run["stage"], status="error")
+        self.metrics.observe("pipeline_llm_seconds", run["seconds"], stage=run["stage"])
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        with self._lock:
+            run = self._runs.get(run_id)
+            if run is None or "first_token_at" in run:
+                return
+            run["first_token_at"] = time.perf_counter()
+        self.metrics.observe(
+            "pipeline_llm_time_to_first_token_seconds",
+            run["first_token_at"] - run["started_at"],
+            stage=run["stage"],
+        )
+
+    def on_pipeline_event(self, event):
+        stage = event["stage"]
+        if stage == "input_condensed":
+            self.metrics.inc("pipeline_input_bytes_saved_total", event["bytes_saved"])
+            self.metrics.inc("pipeline_input_tokens_saved_total", event["tokens_saved"])
+        elif stage == "memory":
+            self.metrics.observe(
+                "conversation_memory_tokens",
+                event["memory_tokens"],
+                buckets=MEMORY_TOKEN_BUCKETS,
+            )
+        elif stage == "revision_skipped":
+            self.metrics.inc(
+                "pipeline_revisions_skipped_total", principle=event.get("principle", "")
+            )
+        elif "duration_seconds" in event:
+            self.metrics.observe(
+                "pipeline_stage_seconds",
+                event["duration_seconds"],
+                stage=stage,
+                principle=event.get("principle", ""),
+            )
+
+
+class SamplingProfiler:
+    """Samples the stacks of every thread at a fixed interval.
+
+    Stacks are aggregated in collapsed form ("thread;module:function;... count"),
+    which flamegraph.pl and speedscope read directly. Sampling reads
+    sys._current_frames() from a daemon thread, so the profiled code is not
+    modified; at the default 10ms interval the overhead is a few percent.
+    """
+
+    def __init__(self, interval=0.01, max_depth=64, max_stacks=20000):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.max_stacks = max_stacks
+        self.samples = 0
+        self._lock = threading.Lock()
+        self._stacks = defaultdict(int)
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return self
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._sample_loop, name="sampling-profiler", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _sample_loop(self):
+        own_thread_id = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            frames = sys._current_frames()
+            stacks = []
+            for thread_id, frame in frames.items():
+                if thread_id == own_thread_id:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    module = frame.f_globals.get("__name__", "?")
+                    stack.append(f"{module}:{code.co_name}")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                stacks.append(";".join(reversed(stack)))
+            del frames
+
+            with self._lock:
+                self.samples += 1
+                for stack in stacks:
+                    if stack not in self._stacks and len(self._stacks) >= self.max_stacks:
+                        stack = "[truncated]"
+                    self._stacks[stack] += 1
+
+    def collapsed(self):
+        with self._lock:
+            stacks = sorted(self._stacks.items(), key=lambda item: -item[1])
+        return "".join(f"{stack} {count}\n" for stack, count in stacks)
+
+    def reset(self):
+        with self._lock:
+            self._stacks.clear()
+            self.samples = 0
+
+
+class MetricsExporter:
+    """Exposes the default MetricsRegistry, configured from the environment.
+
+    METRICS_PORT            serve /metrics (and /profile) over HTTP
+    METRICS_DUMP_PATH       rewrite this file every METRICS_DUMP_INTERVAL
+                            seconds (default 60) and at exit, e.g. for the
+                            node_exporter textfile collector
+    PROFILER_SAMPLE_INTERVAL  run the SamplingProfiler at this interval;
+                            stacks go to /profile and <dump path>.profile
+
+    start_from_environment() is idempotent, so it can be called on every
+    Streamlit rerun.
+    """
+
+    _lock = threading.Lock()
+    _started = False
+    server = None
+    profiler = None
+    dump_path = None
+    dump_interval = 60.0
+    _stopped = threading.Event()
+
+    @classmethod
+    def start_from_environment(cls):
+        with cls._lock:
+            if cls._started:
+                return
+            cls._started = True
+
+            interval = os.environ.get("PROFILER_SAMPLE_INTERVAL")
+            if interval:
+                cls.profiler = SamplingProfiler(interval=float(interval)).start()
+
+            port = os.environ.get("METRICS_PORT")
+            if port:
+                cls.start_server(int(port))
+
+            cls.dump_path = os.environ.get("METRICS_DUMP_PATH")
+            if cls.dump_path:
+                cls.dump_interval = float(os.environ.get("METRICS_DUMP_INTERVAL", "60"))
+                threading.Thread(
+                    target=cls._dump_loop, name="metrics-dump", daemon=True
+                ).start()
+                atexit.register(cls.stop)
+
+    @classmethod
+    def start_server(cls, port, host="0.0.0.0"):
+        exporter = cls
+
+        class MetricsRequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.startswith("/metrics"):
+                    body = MetricsRegistry.default().render()
+                    content_type = "text/plain; version=0.0.4"
+                elif self.path.startswith("/profile") and exporter.profiler:
+                    body = exporter.profiler.collapsed()
+                    content_type = "text/plain"
+                else:
+                    self.send_error(404)
+                    return
+                payload = body.encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        cls.server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+        cls.server.daemon_threads = True
+        threading.Thread(
+            target=cls.server.serve_forever, name="metrics-server", daemon=True
+        ).start()
+        print(f"Metrics available at http://{host}:{port}/metrics")
+        return cls.server
+
+    @classmethod
+    def _dump_loop(cls):
+        while not cls._stopped.wait(cls.dump_interval):
+            cls.dump()
+
+    @classmethod
+    def dump(cls):
+        if not cls.dump_path:
+            return
+        directory = os.path.dirname(os.path.abspath(cls.dump_path))
+        os.makedirs(directory, exist_ok=True)
+        outputs = [(cls.dump_path, MetricsRegistry.default().render())]
+        if cls.profiler is not None:
+            outputs.append((f"{cls.dump_path}.profile", cls.profiler.collapsed()))
+        for path, text in outputs:
+            # written aside and renamed, so readers never see a partial file
+            temporary_path = f"{path}.tmp"
+            with open(temporary_path, "w") as dump_file:
+                dump_file.write(text)
+            os.replace(temporary_path, path)
+
+    @classmethod
+    def stop(cls):
+        cls._stopped.set()
+        cls.dump()
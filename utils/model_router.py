@@ -0,0 +1,161 @@
+import threading
+from dataclasses import asdict, dataclass
+
+from utils.metrics import MetricsRegistry
+from utils.prompt_text import estimate_tokens
+
+# on-demand USD prices per 1,000 (input, output) tokens
+DEFAULT_PRICES_PER_1K_TOKENS = {
+    "anthropic.claude-instant-v1": (0.0008, 0.0024),
+    "anthropic.claude-v2": (0.008, 0.024),
+    "anthropic.claude-v2:1": (0.008, 0.024),
+    "meta.llama2-13b-chat-v1": (0.00075, 0.001),
+}
+
+
+@dataclass(frozen=True)
+class RoutingDecision:
+    stage: str
+    principle: str
+    tier: str
+    model_id: str
+    reason: str
+
+    def as_dict(self):
+        return asdict(self)
+
+
+class ModelRouter:
+    """Chooses the model tier for each critique and revision call.
+
+    The tier of a call is, in order of precedence:
+
+    - principle_tiers[(stage, principle name)], reason "principle"
+    - the escalation tier for revisions when escalate_flagged_revisions is
+      set (revisions only run for flagged critiques), reason "flagged"
+    - the escalation tier for a critique whose confidence is below
+      min_critic_confidence, reason "low_confidence"; the critique is then
+      run again on that tier
+    - stage_tiers[stage], or default_tier, reason "stage"
+
+    The chains for every (prompt, model) pair are registered by the pipeline
+    factory. record() accumulates calls, latency, estimated tokens and
+    estimated cost per tier.
+    """
+
+    def __init__(
+        self,
+        tiers,
+        stage_tiers=None,
+        principle_tiers=None,
+        default_tier="small",
+        escalation_tier="large",
+        escalate_flagged_revisions=False,
+        min_critic_confidence=0.0,
+        prices=None,
+        chars_per_token=4.0,
+        metrics=None,
+    ):
+        self.tiers = dict(tiers)
+        self.stage_tiers = dict(stage_tiers or {})
+        self.principle_tiers = dict(principle_tiers or {})
+        self.default_tier = default_tier
+        self.escalation_tier = escalation_tier
+        self.escalate_flagged_revisions = escalate_flagged_revisions
+        self.min_critic_confidence = min_critic_confidence
+        self.prices = dict(DEFAULT_PRICES_PER_1K_TOKENS, **(prices or {}))
+        self.chars_per_token = chars_per_token
+        self.metrics = metrics or MetricsRegistry.default()
+
+        used_tiers = {default_tier, escalation_tier}
+        used_tiers.update(self.stage_tiers.values())
+        used_tiers.update(self.principle_tiers.values())
+        unknown_tiers = used_tiers - set(self.tiers)
+        if unknown_tiers:
+            raise ValueError(f"Unknown model tiers: {', '.join(sorted(unknown_tiers))}")
+
+        self._chains = {}
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def route(self, stage, principle=None, confidence=None):
+        principle = principle or ""
+        if (stage, principle) in self.principle_tiers:
+            tier, reason = self.principle_tiers[(stage, principle)], "principle"
+        elif stage == "revision" and self.escalate_flagged_revisions:
+            tier, reason = self.escalation_tier, "flagged"
+        elif (
+            stage == "critique"
+            and confidence is not None
+            and confidence < self.min_critic_confidence
+        ):
+            tier, reason = self.escalation_tier, "low_confidence"
+        else:
+            tier, reason = self.stage_tiers.get(stage, self.default_tier), "stage"
+        return RoutingDecision(
+            stage=stage,
+            principle=principle,
+            tier=tier,
+            model_id=self.tiers[tier],
+            reason=reason,
+        )
+
+    def model_ids(self):
+        return sorted(set(self.tiers.values()))
+
+    def register_chain(self, prompt_name, model_id, chain):
+        self._chains[(prompt_name, model_id)] = chain
+
+    def chain(self, prompt_name, model_id):
+        return self._chains.get((prompt_name, model_id))
+
+    def estimate_tokens(self, text):
+        return estimate_tokens(text, self.chars_per_token)
+
+    def record(self, decision, prompt, completion, seconds):
+        input_tokens = self.estimate_tokens(prompt)
+        output_tokens = self.estimate_tokens(completion)
+        input_price, output_price = self.prices.get(decision.model_id, (0.0, 0.0))
+        cost = (input_tokens * input_price + output_tokens * output_price) / 1000
+
+        with self._lock:
+            stats = self._stats.setdefault(
+                decision.tier,
+                {
+                    "model_id": decision.model_id,
+                    "calls": 0,
+                    "seconds": 0.0,
+                    "input_tokens": 0,
+                    "output_tokens": 0,
+                    "estimated_cost_usd": 0.0,
+                    "reasons": {},
+                },
+            )
+            stats["calls"] += 1
+            stats["seconds"] += seconds
+            stats["input_tokens"] += input_tokens
+            stats["output_tokens"] += output_tokens
+            stats["estimated_cost_usd"] += cost
+            stats["reasons"][decision.reason] = stats["reasons"].get(decision.reason, 0) + 1
+
+        labels = dict(tier=decision.tier, stage=decision.stage)
+        self.metrics.inc("routing_calls_total", reason=decision.reason, **labels)
+        self.metrics.observe("routing_call_seconds", seconds, **labels)
+        self.metrics.inc("routing_estimated_tokens_total", input_tokens + output_tokens, **labels)
+        self.metrics.inc("routing_estimated_cost_usd_total", cost, **labels)
+        return {
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "estimated_cost_usd": cost,
+        }
+
+    def stats(self):
+        with self._lock:
+            stats = {}
+            for tier, tier_stats in self._stats.items():
+                tier_stats = dict(tier_stats, reasons=dict(tier_stats["reasons"]))
+                tier_stats["mean_seconds"] = (
+                    tier_stats["seconds"] / tier_stats["calls"] if tier_stats["calls"] else 0.0
+                )
+                stats[tier] = tier_stats
+            return stats
@@ -1,75 +1,130 @@
 import re
-from langchain.chains.conversation.memory import ConversationBufferWindowMemory
-from langchain import PromptTemplate
-from langchain.chains import ConversationChain
+from dataclasses import dataclass
 from langchain.schema.output_parser import BaseLLMOutputParser
 
+PREFIX_MODEL = "Model:"
+PREFIX_USER = "Human:"
+PREFIX_SYSTEM = "System:"
+PREFIX_ASSISTANT = "Assistant:"
+PREFIX_INITIAL_RESPONSE = "Initial response:"
+PREFIX_APPLYING = "Applying"
+PREFIX_CRITIQUE = "Critique:"
+PREFIX_CRITIQUE_REQUEST = "Critique Request:"
+PREFIX_UPDATED_RESPONSE = "Updated response:"
+PREFIX_UPDATES_DONE = "Updated response: No revisions needed."
+PREFIX_NO_REVISIONS_NEEDED = "No revisions needed."
+
+# Anthropic Claude prefixes and ConstitutionalChain response keys start a
+# segment at the beginning of a line; the critique verdict can appear anywhere.
+# Longer prefixes come first so that e.g. "Critique Request:" wins over
+# "Critique:".
+_SEGMENT_PATTERN = re.compile(
+    r"^(?P<updates_done>" + re.escape(PREFIX_UPDATES_DONE) + ")"
+    r"|^(?P<revision>" + re.escape(PREFIX_UPDATED_RESPONSE) + ")"
+    r"|^(?P<no_revisions_needed>" + re.escape(PREFIX_NO_REVISIONS_NEEDED) + ")"
+    r"|^(?P<initial_response>" + re.escape(PREFIX_INITIAL_RESPONSE) + ")"
+    r"|^(?P<applying>" + PREFIX_APPLYING + r" [^\n]+?\.{3})"
+    r"|^(?P<critique_request>" + re.escape(PREFIX_CRITIQUE_REQUEST) + ")"
+    r"|^(?P<critique>" + re.escape(PREFIX_CRITIQUE) + ")"
+    r"|^(?P<human>" + re.escape(PREFIX_USER) + ")"
+    r"|^(?P<system>" + re.escape(PREFIX_SYSTEM) + ")"
+    r"|^(?P<assistant>" + re.escape(PREFIX_ASSISTANT) + "|" + re.escape(PREFIX_MODEL) + ")"
+    r"|(?P<verdict>(?i:\bno\s+critique\s+needed\b|\bcritique\s+needed\b)\.?)",
+    re.MULTILINE,
+)
+
+# upper bound on the length of a marker (an "Applying <principle>..." line),
+# used to re-scan chunk boundaries in streaming mode
+_MAX_MARKER_LENGTH = 256
+
+
+@dataclass(frozen=True)
+class Segment:
+    kind: str
+    text: str
+    marker: str = ""
+
+
+def parse_segments(text):
+    segments = []
+    position = 0
+    kind = "text"
+    marker = ""
+    for match in _SEGMENT_PATTERN.finditer(text):
+        body = text[position : match.start()].strip()
+        if body or kind != "text":
+            segments.append(Segment(kind=kind, text=body, marker=marker))
+        kind = match.lastgroup
+        marker = match.group()
+        position = match.end()
+        if kind == "verdict":
+            segments.append(Segment(kind=kind, text=marker, marker=marker))
+            kind = "text"
+            marker = ""
+    body = text[position:].strip()
+    if body or kind != "text":
+        segments.append(Segment(kind=kind, text=body, marker=marker))
+    return segments
+
+
+class IncrementalOutputParser:
+    """Splits streamed model output into segments as the chunks arrive.
+
+    feed() returns the segments that are complete, i.e. followed by the next
+    marker; close() returns whatever is left once the stream has ended. Only
+    the tail of the buffer is re-scanned on each chunk.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        # (start, end) of the markers found in the buffer so far
+        self._markers = []
+
+    def feed(self, chunk):
+        rescan_from = max(0, len(self._buffer) - _MAX_MARKER_LENGTH)
+        self._buffer += chunk
+
+        # a marker may straddle the previous chunk boundary, or may still
+        # grow ("Updated response:" -> "Updated response: No revisions needed.")
+        kept = [marker for marker in self._markers if marker[1] <= rescan_from]
+        dropped = self._markers[len(kept) :]
+        if dropped:
+            rescan_from = dropped[0][0]
+        self._markers = kept + [
+            match.span() for match in _SEGMENT_PATTERN.finditer(self._buffer, rescan_from)
+        ]
+
+        # the buffer starts at a marker (or at the start of the stream), so
+        # everything before the last later marker is complete
+        cut = self._markers[-1][0] if self._markers else 0
+        if cut == 0:
+            return []
+        segments = parse_segments(self._buffer[:cut])
+        self._buffer = self._buffer[cut:]
+        start, end = self._markers[-1]
+        self._markers = [(0, end - start)]
+        return segments
+
+    def close(self):
+        segments = parse_segments(self._buffer)
+        self._buffer = ""
+        self._markers = []
+        return segments
+
 
 class MyOutputParser(BaseLLMOutputParser):
     def __init__(self):
         super().__init__()
 
     def parse_result(self, text):
-        print("Entering Output Parser...")
-        # print(text[0]['text'])
         text = text[0].text
-        text = text.replace("Model: ", "Assistant: ")
-        # if self.MERGE_CONSECUTIVE_MESSAGES:
-        #    prompt = self._merge_consecutive_messages(prompt)
-
-        # self.file_writer_response('DEBUG', text)
-
-        PREFIX_MODEL = "Model:"
-        PREFIX_USER = "Human:"
-        PREFIX_SYSTEM = "System:"
-        PREFIX_ASSISTANT = "Assistant:"
-        PREFIX_INITIAL_RESPONSE = "Initial response:"
-        PREFIX_APPLYING = "Applying"
-        PREFIX_CRITIQUE = "Critique:"
-        PREFIX_CRITIQUE_REQUEST = "Critique Request:"
-        PREFIX_UPDATED_RESPONSE = "Updated response:"
-        PREFIX_UPDATES_DONE = "Updated response: No revisions needed."
-        PREFIX_NO_REVISIONS_NEEDED = "No revisions needed."
-
-        # text = "Received below is a conversation between a human and an AI assistant."
-
-        starter_pattern = r"^Received below is a conversation between"
-        starter_match = re.search(starter_pattern, text)
-
-        # Recognize Anthropic Claude Prefixes
-        find_human_prompt = re.search(f"^{PREFIX_USER}", text)
-        find_system_prompt = re.search(f"^{PREFIX_SYSTEM}", text)
-        find_assistant_prompt = re.search(f"^{PREFIX_ASSISTANT}", text)
-
-        # Find ConsitutionalChain Reponse Keys
-        find_initial_response = re.search(f"^{PREFIX_INITIAL_RESPONSE}", text)
-        find_applying = re.search(f"^{PREFIX_APPLYING} .+?\.{3}'", text)
-        find_critique = re.search(f"^{PREFIX_CRITIQUE}", text)
-        find_updated_response = re.search(f"^{PREFIX_UPDATED_RESPONSE}", text)
-        find_updates_done = re.search(f"^{PREFIX_UPDATES_DONE}", text)
-        find_no_revisions_needed = re.search(f"^{PREFIX_NO_REVISIONS_NEEDED}", text)
-
-        # if find_critique:
-        #    text = PREFIX_HUMAN + text
-
-        if find_initial_response:
-            text = PREFIX_ASSISTANT + text
-        """
-        if find_applying
-        if find_critique
-        if find_critique_request
-
-        if find_updated_response:
-        if find_updates_done:
-        if find_no_revisions_needed:
-            text = PREFIX_ASSISTANT + text
+        # "Model: " -> "Assistant: " is covered by the "Model:" replacement
+        text = text.replace(PREFIX_MODEL, PREFIX_ASSISTANT)
 
-        else:
-            response_type = 'error'
-            #self.file_writer_response(response_type, text)
-            raise OutputParserException(f"^Could not parse LLM output: `{text}`")
-        """
+        if text.startswith(PREFIX_INITIAL_RESPONSE):
+            text = PREFIX_ASSISTANT + text
 
-        # self.file_writer_response(response_type, text)
-        text = text.replace("Model:", "Assistant:")
         return text
+
+    def parse_segments(self, text):
+        return parse_segments(text)
@@ -0,0 +1,73 @@
+import queue
+import time
+
+from langchain.callbacks.base import BaseCallbackHandler
+
+
+def emit_pipeline_event(run_manager, stage, **fields):
+    # stage events bypass on_text so they don't show up in verbose chain output
+    event = dict(stage=stage, **fields)
+    for handler in run_manager.handlers:
+        on_pipeline_event = getattr(handler, "on_pipeline_event", None)
+        if on_pipeline_event is not None:
+            on_pipeline_event(event)
+
+
+class PipelineEventHandler(BaseCallbackHandler):
+    """Collects the stages of a constitutional run as a stream of events.
+
+    Pass it in the run config (config={"callbacks": [handler]}) so that it is
+    inherited by every chain and LLM of the run. Tokens of the initial
+    response (the LLM running under the "original" chain) are reported as
+    "initial_token" events, the ConstitutionalReviewChain reports its
+    critique and revision stages, and the UI thread consumes everything
+    through drain(). Events may be produced on worker threads.
+    """
+
+    def __init__(self):
+        self.events = queue.Queue()
+        self.started_at = time.perf_counter()
+        self.first_token_at = None
+        self._initial_chain_runs = set()
+        self._initial_llm_runs = set()
+
+    @property
+    def time_to_first_token(self):
+        if self.first_token_at is None:
+            return None
+        return self.first_token_at - self.started_at
+
+    def on_chain_start(
+        self, serialized, inputs, *, run_id, parent_run_id=None, tags=None, **kwargs
+    ):
+        if tags and "original" in tags:
+            self._initial_chain_runs.add(run_id)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, **kwargs):
+        if parent_run_id in self._initial_chain_runs:
+            self._initial_llm_runs.add(run_id)
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        if run_id not in self._initial_llm_runs:
+            return
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+            self.on_pipeline_event(
+                {
+                    "stage": "first_token",
+                    "time_to_first_token": self.time_to_first_token,
+                }
+            )
+        self.on_pipeline_event({"stage": "initial_token", "token": token})
+
+    def on_pipeline_event(self, event):
+        event.setdefault("elapsed_seconds", time.perf_counter() - self.started_at)
+        self.events.put(event)
+
+    def drain(self):
+        events = []
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except queue.Empty:
+                return events
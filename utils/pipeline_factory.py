@@ -0,0 +1,363 @@
+import hashlib
+import json
+import threading
+
+from langchain.chains import LLMChain
+from langchain.prompts import PromptTemplate
+
+from utils.constitution import (
+    batched_critique_prompt,
+    combined_revision_prompt,
+    conversation_memory_max_summary_tokens,
+    conversation_memory_max_tokens,
+    conversation_memory_window_turns,
+    critique_execution_mode,
+    critique_max_concurrency,
+    critique_prompt,
+    escalate_flagged_revisions,
+    guardrail_principles,
+    input_condensation_enabled,
+    input_condensation_max_digest_tokens,
+    input_condensation_max_prompt_tokens,
+    map_reduce_enabled,
+    map_reduce_max_chunk_tokens,
+    map_reduce_max_concurrency,
+    map_reduce_min_document_tokens,
+    map_summary_prompt,
+    memory_summary_prompt,
+    min_critic_confidence,
+    model_routing_enabled,
+    model_tier_configurations,
+    model_tiers,
+    pipelined_max_segments,
+    pipelined_segment_min_chars,
+    pipelined_whole_response_principles,
+    principle_model_tiers,
+    reduce_summary_prompt,
+    revision_prompt,
+    segment_critique_prompt,
+    stage_deadline_seconds,
+    stage_model_tiers,
+)
+from utils.constitutional_chain import ConstitutionalReviewChain
+from utils.conversation_memory import ConversationWindow, TokenBudgetMemory
+from utils.inference_configuration_manager import InferenceConfigurationRegistry
+from utils.input_condenser import InputCondenser
+from utils.llm import LLM
+from utils.map_reduce import MapReduceSummarizer
+from utils.metrics import MetricsCallbackHandler
+from utils.model_router import ModelRouter
+from utils.parser import MyOutputParser
+
+
+# the parts of a run that are stored in and returned by the semantic cache
+CACHED_OUTPUT_KEYS = (
+    "output",
+    "initial_output",
+    "critiques_and_revisions",
+    "critique_verdicts",
+    "revision_calls_saved",
+    "input_condensation",
+)
+
+
+class ConstitutionalPipeline:
+    """The stateless parts of the constitutional pipeline, built once.
+
+    The Bedrock LLM, prompts, principles and the critique/revision chains
+    are shared by every caller. Anything stateful (the conversation memory
+    of the initial chain) is created per session by session_chain().
+    Only the initial chain (and the map-reduce merge, which stands in for
+    it) uses llm, which may stream; every other chain uses review_llm, a
+    non-streaming LLM, so those calls can be hedged and their deadline
+    covers the whole response. Every chain and the LLM report to the
+    process-wide metrics handler.
+    With a model_router, critique and revision chains are also built for
+    every routed model (routed_llms maps model ids to their LLMs). With
+    map_reduce, long notes are summarized section by section.
+    """
+
+    def __init__(
+        self,
+        key,
+        llm,
+        principles,
+        execution_mode,
+        max_concurrency,
+        callbacks=None,
+        input_condenser=None,
+        model_router=None,
+        routed_llms=None,
+        map_reduce=False,
+        review_llm=None,
+    ):
+        self.key = key
+        self.llm = llm
+        self.review_llm = review_llm = review_llm or llm
+        self.principles = principles
+        self.execution_mode = execution_mode
+        self.max_concurrency = max_concurrency
+        self.callbacks = callbacks
+        self.input_condenser = input_condenser
+        self.model_router = model_router
+        # semantic cache entries are only shared by identical pipelines
+        self.namespace = hashlib.sha256(repr(key).encode("utf-8")).hexdigest()[:16]
+
+        self.prompt = PromptTemplate(
+            template="""{input_text}""",
+            input_variables=["input_text"],
+        )
+        self.output_parser = MyOutputParser()
+        self.critique_chain = LLMChain(
+            llm=review_llm, prompt=critique_prompt, callbacks=callbacks
+        )
+        self.revision_chain = LLMChain(
+            llm=review_llm, prompt=revision_prompt, callbacks=callbacks
+        )
+        self.batched_critique_chain = LLMChain(
+            llm=review_llm, prompt=batched_critique_prompt, callbacks=callbacks
+        )
+        self.segment_critique_chain = LLMChain(
+            llm=review_llm, prompt=segment_critique_prompt, callbacks=callbacks
+        )
+        self.combined_revision_chain = LLMChain(
+            llm=review_llm, prompt=combined_revision_prompt, callbacks=callbacks
+        )
+        self.memory_summary_chain = LLMChain(
+            llm=review_llm, prompt=memory_summary_prompt, callbacks=callbacks
+        )
+        self.map_reduce = None
+        if map_reduce:
+            self.map_reduce = MapReduceSummarizer(
+                map_chain=LLMChain(
+                    llm=review_llm, prompt=map_summary_prompt, callbacks=callbacks
+                ),
+                reduce_chain=LLMChain(
+                    llm=llm,
+                    prompt=reduce_summary_prompt,
+                    output_parser=self.output_parser,
+                    callbacks=callbacks,
+                ),
+                max_chunk_tokens=map_reduce_max_chunk_tokens,
+                min_document_tokens=map_reduce_min_document_tokens,
+                max_concurrency=map_reduce_max_concurrency,
+            )
+
+        if model_router is not None:
+            stage_prompts = {
+                "critique": critique_prompt,
+                "revision": revision_prompt,
+                "batched_critique": batched_critique_prompt,
+                "segment_critique": segment_critique_prompt,
+                "combined_revision": combined_revision_prompt,
+            }
+            for routed_model_id, routed_llm in (routed_llms or {}).items():
+                for prompt_name, prompt in stage_prompts.items():
+                    model_router.register_chain(
+                        prompt_name,
+                        routed_model_id,
+                        LLMChain(llm=routed_llm, prompt=prompt, callbacks=callbacks),
+                    )
+
+    def build_chain(self, memory=None, verbose=True):
+        chain = LLMChain(
+            llm=self.llm,
+            prompt=self.prompt,
+            output_key="Assistant:",
+            output_parser=self.output_parser,
+            verbose=verbose,
+            memory=memory,
+            callbacks=self.callbacks,
+        )
+        constitutional_chain = ConstitutionalReviewChain(
+            chain=chain,
+            critique_chain=self.critique_chain,
+            revision_chain=self.revision_chain,
+            batched_critique_chain=self.batched_critique_chain,
+            combined_revision_chain=self.combined_revision_chain,
+            segment_critique_chain=self.segment_critique_chain,
+            constitutional_principles=self.principles,
+            return_intermediate_steps=True,
+            verbose=verbose,
+            execution_mode=self.execution_mode,
+            max_concurrency=self.max_concurrency,
+            input_condenser=self.input_condenser,
+            model_router=self.model_router,
+            stage_deadlines=stage_deadline_seconds,
+            map_reduce=self.map_reduce,
+            segment_min_chars=pipelined_segment_min_chars,
+            max_segments=pipelined_max_segments,
+            whole_response_principles=pipelined_whole_response_principles,
+            callbacks=self.callbacks,
+        )
+        return constitutional_chain
+
+    def semantic_lookup(self, prompt):
+        # returns (cached result or None, prompt embedding for semantic_store)
+        cache = LLM.semantic_cache()
+        if cache is None:
+            return None, None
+        try:
+            embedding = LLM().call_titan_embeddings(prompt)
+        except Exception as e:
+            print(f"Semantic cache lookup failed: {e}")
+            return None, None
+        hit = cache.get(embedding, self.namespace)
+        if hit is None:
+            return None, embedding
+        result = dict(hit["result"])
+        result["semantic_cache_similarity"] = hit["similarity"]
+        return result, embedding
+
+    def semantic_store(self, embedding, result):
+        cache = LLM.semantic_cache()
+        if cache is None or embedding is None:
+            return
+        cache.put(
+            embedding,
+            {name: result[name] for name in CACHED_OUTPUT_KEYS if name in result},
+            self.namespace,
+        )
+
+    def summarize_conversation(self, summary, new_lines):
+        return self.memory_summary_chain.run(summary=summary, new_lines=new_lines)
+
+    def build_memory(self):
+        # folding evicted turns costs a Bedrock call per eviction: only do it
+        # when the initial prompt actually reads the rendered {history}
+        reads_history = "history" in self.prompt.input_variables
+        window = ConversationWindow(
+            summarize=self.summarize_conversation if reads_history else None,
+            max_tokens=conversation_memory_max_tokens,
+            max_summary_tokens=conversation_memory_max_summary_tokens,
+            window_turns=conversation_memory_window_turns,
+        )
+        return TokenBudgetMemory(window=window)
+
+    def session_chain(self, session_state):
+        # one chain (and memory) per session and pipeline, kept across reruns
+        chains = session_state.setdefault("constitutional_chains", {})
+        if self.key not in chains:
+            chains[self.key] = self.build_chain(memory=self.build_memory())
+        return chains[self.key]
+
+
+class ConstitutionalPipelineFactory:
+    _lock = threading.Lock()
+    _pipelines = {}
+
+    @classmethod
+    def get(
+        cls,
+        model_id,
+        inference_configuration,
+        principles=None,
+        execution_mode=None,
+        max_concurrency=None,
+        streaming=False,
+        condense_input=None,
+        model_routing=None,
+        map_reduce=None,
+    ):
+        principles = guardrail_principles if principles is None else principles
+        execution_mode = execution_mode or critique_execution_mode
+        max_concurrency = max_concurrency or critique_max_concurrency
+        if condense_input is None:
+            condense_input = input_condensation_enabled
+        if model_routing is None:
+            model_routing = model_routing_enabled
+        if map_reduce is None:
+            map_reduce = map_reduce_enabled
+        key = (
+            model_id,
+            json.dumps(inference_configuration, sort_keys=True),
+            tuple(
+                (
+                    principle.name,
+                    principle.critique_request,
+                    principle.revision_request,
+                )
+                for principle in principles
+            ),
+            execution_mode,
+            max_concurrency,
+            streaming,
+            condense_input,
+            model_routing,
+            map_reduce,
+        )
+
+        pipeline = cls._pipelines.get(key)
+        if pipeline is not None:
+            return pipeline
+
+        with cls._lock:
+            pipeline = cls._pipelines.get(key)
+            if pipeline is None:
+                callbacks = [MetricsCallbackHandler.default()]
+                input_condenser = None
+                if condense_input:
+                    input_condenser = InputCondenser(
+                        max_prompt_tokens=input_condensation_max_prompt_tokens,
+                        max_digest_tokens=input_condensation_max_digest_tokens,
+                    )
+                llm = LLM().setup_langchain_bedrock_claude_instant(
+                    model_id,
+                    dict(inference_configuration),
+                    streaming=streaming,
+                    callbacks=callbacks,
+                )
+                # only the initial output streams, see ConstitutionalPipeline
+                review_llm = llm
+                if streaming:
+                    review_llm = LLM().setup_langchain_bedrock_claude_instant(
+                        model_id,
+                        dict(inference_configuration),
+                        callbacks=callbacks,
+                    )
+
+                model_router = None
+                routed_llms = {}
+                if model_routing:
+                    model_router = ModelRouter(
+                        tiers=model_tiers,
+                        stage_tiers=stage_model_tiers,
+                        principle_tiers=principle_model_tiers,
+                        escalate_flagged_revisions=escalate_flagged_revisions,
+                        min_critic_confidence=min_critic_confidence,
+                    )
+                    for routed_model_id in model_router.model_ids():
+                        if routed_model_id == model_id:
+                            routed_llms[routed_model_id] = review_llm
+                            continue
+                        routed_configuration = model_tier_configurations.get(
+                            routed_model_id
+                        ) or InferenceConfigurationRegistry.default().get(
+                            routed_model_id
+                        ).as_dict()
+                        routed_llms[routed_model_id] = LLM().setup_langchain_bedrock(
+                            routed_model_id,
+                            dict(routed_configuration),
+                            callbacks=callbacks,
+                        )
+
+                pipeline = ConstitutionalPipeline(
+                    key=key,
+                    llm=llm,
+                    principles=list(principles),
+                    execution_mode=execution_mode,
+                    max_concurrency=max_concurrency,
+                    callbacks=callbacks,
+                    input_condenser=input_condenser,
+                    model_router=model_router,
+                    routed_llms=routed_llms,
+                    map_reduce=map_reduce,
+                    review_llm=review_llm,
+                )
+                cls._pipelines[key] = pipeline
+        return pipeline
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._pipelines.clear()
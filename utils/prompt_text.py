@@ -0,0 +1,30 @@
+import functools
+import math
+import re
+
+
+def estimate_tokens(text, chars_per_token=4.0):
+    # the token heuristic every budget in the pipeline is computed with
+    return math.ceil(len(text) / chars_per_token)
+
+
+@functools.lru_cache(maxsize=None)
+def _document_pattern(document_tag):
+    return re.compile(rf"(<{document_tag}>)(.*?)(</{document_tag}>)", re.DOTALL)
+
+
+def split_document(text, document_tag="notes"):
+    """Returns (text before the document, document, text after it).
+
+    The document is the content of the longest <document_tag> element, as
+    the instructions may mention the tag too ("within the <notes></notes>
+    xml tags"). None when there is no such element.
+    """
+    match = max(
+        _document_pattern(document_tag).finditer(text),
+        key=lambda match: len(match.group(2)),
+        default=None,
+    )
+    if match is None:
+        return None
+    return text[: match.start(2)], match.group(2), text[match.end(2) :]
@@ -0,0 +1,331 @@
+import contextlib
+import contextvars
+import functools
+import heapq
+import itertools
+import os
+import threading
+import time
+
+from utils.metrics import MetricsRegistry
+
+THROTTLING_CODES = {
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "ServiceQuotaExceededException",
+}
+
+_current_session = contextvars.ContextVar("bedrock_scheduler_session", default=None)
+# model of the call admitted ahead of botocore's hook, see admitted()
+_admitted_model = contextvars.ContextVar("bedrock_scheduler_admitted", default=None)
+
+
+class AdmissionRejected(RuntimeError):
+    """A Bedrock call was not admitted (queue full or waited too long)."""
+
+    def __init__(self, model_id, reason, queue_depth):
+        super().__init__(
+            f"Bedrock request for {model_id} rejected ({reason}, {queue_depth} queued)"
+        )
+        self.model_id = model_id
+        self.reason = reason
+        self.queue_depth = queue_depth
+
+
+def is_throttled(parsed):
+    # parsed botocore response (or error response) of one attempt
+    return (
+        parsed.get("Error", {}).get("Code") in THROTTLING_CODES
+        or parsed.get("ResponseMetadata", {}).get("HTTPStatusCode") == 429
+    )
+
+
+def bind_context(function):
+    # run function with the caller's context variables (the scheduler
+    # session) on another thread; ThreadPoolExecutor does not carry them over
+    context = contextvars.copy_context()
+
+    @functools.wraps(function)
+    def bound(*args, **kwargs):
+        return context.copy().run(function, *args, **kwargs)
+
+    return bound
+
+
+class TokenBucket:
+    """Request rate limit that backs off on throttling.
+
+    rate requests per second are admitted on average, with bursts of up to
+    burst requests. A throttled response multiplies the rate by
+    decrease_factor (down to min_rate); every successful response adds
+    increase_step back (up to max_rate).
+    """
+
+    def __init__(
+        self,
+        rate,
+        burst,
+        min_rate=0.2,
+        max_rate=None,
+        decrease_factor=0.7,
+        increase_step=0.1,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate or rate * 4
+        self.decrease_factor = decrease_factor
+        self.increase_step = increase_step
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def take(self):
+        # returns 0 when a token was taken, otherwise the seconds until one is due
+        now = time.monotonic()
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def throttled(self):
+        self._refill(time.monotonic())
+        self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+        # what was left of the burst is what got us throttled
+        self.tokens = min(self.tokens, 0.0)
+
+    def succeeded(self):
+        self.rate = min(self.max_rate, self.rate + self.increase_step)
+
+
+class RequestScheduler:
+    """Process-wide admission control in front of every Bedrock runtime call.
+
+    Each model has a token bucket (see TokenBucket) and a queue of waiting
+    calls bounded at max_queue; a call that does not fit or waits longer
+    than max_wait_seconds raises AdmissionRejected. Waiting calls are
+    admitted by priority (lower first), then round-robin between sessions:
+    the n-th pending call of a session is ranked with the n-th pending call
+    of every other session, so one busy session cannot starve the others.
+
+    The session and priority of a call come from session() in the calling
+    context. Clients are hooked with instrument_client(), which admits calls
+    on botocore's before-parameter-build event and adapts the bucket to
+    throttling responses. A caller that must queue before anything else (a
+    per-model slot, see utils/bedrock_invoker.py) admits the call itself
+    with admitted(); the hook then lets it through.
+    """
+
+    enabled = os.environ.get("BEDROCK_SCHEDULER", "1") == "1"
+
+    _default = None
+    _default_lock = threading.Lock()
+
+    def __init__(
+        self,
+        default_rate=10.0,
+        default_burst=20,
+        model_rates=None,
+        max_queue=256,
+        max_wait_seconds=120.0,
+        metrics=None,
+    ):
+        self.default_rate = default_rate
+        self.default_burst = default_burst
+        self.model_rates = dict(model_rates or {})
+        self.max_queue = max_queue
+        self.max_wait_seconds = max_wait_seconds
+        self.metrics = metrics or MetricsRegistry.default()
+
+        self._condition = threading.Condition()
+        self._buckets = {}
+        self._queues = {}
+        self._pending = {}
+        self._sequence = itertools.count()
+        self._stats = {}
+
+    @classmethod
+    def default(cls):
+        if cls._default is None:
+            with cls._default_lock:
+                if cls._default is None:
+                    cls._default = cls(
+                        default_rate=float(
+                            os.environ.get("BEDROCK_REQUESTS_PER_SECOND", "10")
+                        ),
+                        default_burst=int(os.environ.get("BEDROCK_REQUEST_BURST", "20")),
+                        max_queue=int(os.environ.get("BEDROCK_SCHEDULER_QUEUE", "256")),
+                        max_wait_seconds=float(
+                            os.environ.get("BEDROCK_SCHEDULER_MAX_WAIT", "120")
+                        ),
+                    )
+        return cls._default
+
+    @staticmethod
+    @contextlib.contextmanager
+    def session(session_id, priority=0):
+        token = _current_session.set((session_id, priority))
+        try:
+            yield
+        finally:
+            _current_session.reset(token)
+
+    def _bucket(self, model_id):
+        # called under self._condition
+        bucket = self._buckets.get(model_id)
+        if bucket is None:
+            rate, burst = self.model_rates.get(
+                model_id, (self.default_rate, self.default_burst)
+            )
+            bucket = TokenBucket(rate, burst)
+            self._buckets[model_id] = bucket
+            self._queues[model_id] = []
+            self._stats[model_id] = {
+                "admitted": 0,
+                "rejected": 0,
+                "throttled": 0,
+                "wait_seconds": 0.0,
+            }
+        return bucket
+
+    def admit(self, model_id, max_wait=None):
+        # max_wait (e.g. what is left of the call's deadline) can only
+        # shorten max_wait_seconds
+        if max_wait is None or max_wait > self.max_wait_seconds:
+            max_wait = self.max_wait_seconds
+        session_id, priority = _current_session.get() or ("", 0)
+        queued_at = time.perf_counter()
+        with self._condition:
+            bucket = self._bucket(model_id)
+            queue = self._queues[model_id]
+            if len(queue) >= self.max_queue:
+                self._stats[model_id]["rejected"] += 1
+                self._reject(model_id, "queue_full", len(queue))
+
+            pending = self._pending.setdefault((model_id, session_id), 0)
+            self._pending[(model_id, session_id)] = pending + 1
+            ticket = (priority, pending, next(self._sequence), session_id)
+            heapq.heappush(queue, ticket)
+            try:
+                while True:
+                    delay = 0.05
+                    if queue[0] is ticket:
+                        delay = bucket.take()
+                        if not delay:
+                            heapq.heappop(queue)
+                            break
+                    remaining = max_wait - (time.perf_counter() - queued_at)
+                    if remaining <= 0:
+                        queue.remove(ticket)
+                        heapq.heapify(queue)
+                        self._stats[model_id]["rejected"] += 1
+                        self._reject(model_id, "timeout", len(queue))
+                    self._condition.wait(min(delay, remaining))
+            finally:
+                self._pending[(model_id, session_id)] -= 1
+                if not self._pending[(model_id, session_id)]:
+                    del self._pending[(model_id, session_id)]
+                self._condition.notify_all()
+
+            wait_seconds = time.perf_counter() - queued_at
+            self._stats[model_id]["admitted"] += 1
+            self._stats[model_id]["wait_seconds"] += wait_seconds
+        self.metrics.observe("scheduler_wait_seconds", wait_seconds, model=model_id)
+        return wait_seconds
+
+    @contextlib.contextmanager
+    def admitted(self, model_id, max_wait=None):
+        self.admit(model_id, max_wait)
+        token = _admitted_model.set(model_id)
+        try:
+            yield
+        finally:
+            _admitted_model.reset(token)
+
+    def _reject(self, model_id, reason, queue_depth):
+        self.metrics.inc("scheduler_rejected_total", model=model_id, reason=reason)
+        raise AdmissionRejected(model_id, reason, queue_depth)
+
+    def record_response(self, model_id, throttled):
+        with self._condition:
+            bucket = self._bucket(model_id)
+            if throttled:
+                bucket.throttled()
+                self._stats[model_id]["throttled"] += 1
+            else:
+                bucket.succeeded()
+        if throttled:
+            self.metrics.inc("scheduler_throttled_total", model=model_id)
+
+    def position(self, session_id):
+        # 1-based position of the session's first waiting call, None when it
+        # has nothing queued
+        with self._condition:
+            best = None
+            for queue in self._queues.values():
+                for position, ticket in enumerate(sorted(queue), start=1):
+                    if ticket[3] == session_id:
+                        best = position if best is None else min(best, position)
+                        break
+            return best
+
+    def stats(self):
+        with self._condition:
+            return {
+                model_id: dict(
+                    stats,
+                    rate=round(self._buckets[model_id].rate, 3),
+                    queued=len(self._queues[model_id]),
+                )
+                for model_id, stats in self._stats.items()
+            }
+
+    def instrument_client(self, client):
+        def before_parameter_build(params, context, **kwargs):
+            model_id = params.get("modelId")
+            if model_id and "scheduler_model_id" not in context:
+                if _admitted_model.get() != model_id:
+                    self.admit(model_id)
+                context["scheduler_model_id"] = model_id
+
+        def record_attempt(context, attempt, throttled):
+            # needs-retry and after-call both see the last attempt of a call:
+            # a throttled attempt lowers the rate once, whichever hook sees it
+            # first
+            model_id = context.get("scheduler_model_id")
+            if model_id is None:
+                return
+            if throttled:
+                recorded = context.setdefault("scheduler_throttled_attempts", set())
+                if attempt in recorded:
+                    return
+                recorded.add(attempt)
+            self.record_response(model_id, throttled)
+
+        def after_call(parsed, context, **kwargs):
+            retry_attempts = parsed.get("ResponseMetadata", {}).get("RetryAttempts", 0)
+            record_attempt(context, retry_attempts + 1, is_throttled(parsed))
+
+        def needs_retry(response=None, attempts=1, **kwargs):
+            # botocore's own retries of throttled attempts also slow the bucket
+            if response is None:
+                return None
+            parsed = response[1] or {}
+            context = (kwargs.get("request_dict") or {}).get("context", {})
+            if is_throttled(parsed):
+                record_attempt(context, attempts, True)
+            return None
+
+        events = client.meta.events
+        events.register(
+            "before-parameter-build",
+            before_parameter_build,
+            unique_id="scheduler-before-parameter-build",
+        )
+        events.register("after-call", after_call, unique_id="scheduler-after-call")
+        events.register("needs-retry", needs_retry, unique_id="scheduler-needs-retry")
+        return client
@@ -0,0 +1,229 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from langchain.schema import Generation
+from langchain.schema.cache import BaseCache
+
+from utils.metrics import MetricsRegistry
+
+
+def response_cache_key(model_id, inference_configuration, prompt):
+    # the prompt is part of the key on its own, never as part of the config
+    configuration = {
+        name: value
+        for name, value in (inference_configuration or {}).items()
+        if name != "prompt"
+    }
+    material = json.dumps(
+        [model_id, configuration, prompt], sort_keys=True, separators=(",", ":")
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class TieredCache:
+    """Two-tier key/value cache: an in-memory LRU in front of a SQLite file.
+
+    Values are bytes. Entries expire after ttl_seconds in both tiers and each
+    tier evicts its least recently used entries once it exceeds its size
+    limit; expired rows are also deleted from the file when it is opened.
+    Pass path=None for a memory-only cache.
+    """
+
+    def __init__(
+        self,
+        path=None,
+        table="responses",
+        max_memory_entries=512,
+        max_disk_entries=10000,
+        ttl_seconds=7 * 24 * 3600,
+    ):
+        self.path = path
+        self.table = table
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl_seconds = ttl_seconds
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._connection = None
+        self._disk_entries = 0
+        self._stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "writes": 0,
+            "memory_evictions": 0,
+            "disk_evictions": 0,
+            "expired": 0,
+        }
+
+        if path:
+            directory = os.path.dirname(os.path.abspath(path))
+            os.makedirs(directory, exist_ok=True)
+            self._connection = sqlite3.connect(path, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                "key TEXT PRIMARY KEY, value BLOB NOT NULL, "
+                "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._connection.execute(
+                f"CREATE INDEX IF NOT EXISTS {table}_accessed_at "
+                f"ON {table} (accessed_at)"
+            )
+            self._connection.execute(
+                f"CREATE INDEX IF NOT EXISTS {table}_expires_at "
+                f"ON {table} (expires_at)"
+            )
+            self._connection.execute(
+                f"DELETE FROM {table} WHERE expires_at <= ?", (time.time(),)
+            )
+            self._connection.commit()
+            (self._disk_entries,) = self._connection.execute(
+                f"SELECT COUNT(*) FROM {table}"
+            ).fetchone()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    self._count("memory_hit")
+                    return value
+                del self._memory[key]
+                self._stats["expired"] += 1
+
+            if self._connection is not None:
+                row = self._connection.execute(
+                    f"SELECT value, expires_at FROM {self.table} WHERE key = ?",
+                    (key,),
+                ).fetchone()
+                if row is not None:
+                    value, expires_at = row
+                    if expires_at > now:
+                        self._connection.execute(
+                            f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?",
+                            (now, key),
+                        )
+                        self._connection.commit()
+                        self._remember(key, value, expires_at)
+                        self._stats["disk_hits"] += 1
+                        self._count("disk_hit")
+                        return value
+                    self._connection.execute(
+                        f"DELETE FROM {self.table} WHERE key = ?", (key,)
+                    )
+                    self._connection.commit()
+                    self._disk_entries -= 1
+                    self._stats["expired"] += 1
+
+            self._stats["misses"] += 1
+            self._count("miss")
+            return None
+
+    def _count(self, result):
+        MetricsRegistry.default().inc("cache_lookups_total", cache=self.table, result=result)
+
+    def set(self, key, value):
+        now = time.time()
+        expires_at = now + self.ttl_seconds
+        with self._lock:
+            self._remember(key, value, expires_at)
+            self._stats["writes"] += 1
+
+            if self._connection is not None:
+                cursor = self._connection.execute(
+                    f"UPDATE {self.table} SET value = ?, expires_at = ?, "
+                    "accessed_at = ? WHERE key = ?",
+                    (value, expires_at, now, key),
+                )
+                if cursor.rowcount == 0:
+                    self._connection.execute(
+                        f"INSERT INTO {self.table} "
+                        "(key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                        (key, value, expires_at, now),
+                    )
+                    self._disk_entries += 1
+                    if self._disk_entries > self.max_disk_entries:
+                        self._evict_disk(now)
+                self._connection.commit()
+
+    def _remember(self, key, value, expires_at):
+        self._memory[key] = (value, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+            self._stats["memory_evictions"] += 1
+
+    def _evict_disk(self, now):
+        cursor = self._connection.execute(
+            f"DELETE FROM {self.table} WHERE expires_at <= ?", (now,)
+        )
+        self._disk_entries -= cursor.rowcount
+        self._stats["expired"] += cursor.rowcount
+        excess = self._disk_entries - self.max_disk_entries
+        if excess > 0:
+            self._connection.execute(
+                f"DELETE FROM {self.table} WHERE key IN ("
+                f"SELECT key FROM {self.table} ORDER BY accessed_at ASC LIMIT ?)",
+                (excess,),
+            )
+            self._disk_entries -= excess
+            self._stats["disk_evictions"] += excess
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+            stats["disk_entries"] = self._disk_entries
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        hits = stats["memory_hits"] + stats["disk_hits"]
+        stats["hit_rate"] = hits / lookups if lookups else 0.0
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._connection is not None:
+                self._connection.execute(f"DELETE FROM {self.table}")
+                self._connection.commit()
+                self._disk_entries = 0
+
+
+class LangChainResponseCache(BaseCache):
+    """Adapter that lets LangChain LLMs (e.g. Bedrock(cache=...)) use a TieredCache.
+
+    LangChain's llm_string already contains the model id and the sorted
+    model_kwargs, so it is hashed together with the rendered prompt.
+    """
+
+    def __init__(self, tiered_cache):
+        self.tiered_cache = tiered_cache
+
+    def _key(self, prompt, llm_string):
+        material = json.dumps([llm_string, prompt], separators=(",", ":"))
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def lookup(self, prompt, llm_string):
+        value = self.tiered_cache.get(self._key(prompt, llm_string))
+        if value is None:
+            return None
+        return [Generation(text=text) for text in json.loads(value)]
+
+    def update(self, prompt, llm_string, return_val):
+        texts = [generation.text for generation in return_val]
+        self.tiered_cache.set(
+            self._key(prompt, llm_string), json.dumps(texts).encode("utf-8")
+        )
+
+    def clear(self, **kwargs):
+        self.tiered_cache.clear()
@@ -0,0 +1,136 @@
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+
+
+class RunLogger:
+    """Append-only JSONL log of pipeline stage events.
+
+    log() only enqueues the record; a background thread writes records in
+    batches and rotates the file once it grows past max_bytes, keeping
+    backup_count older files (runs.jsonl.1, runs.jsonl.2, ...). When the
+    queue is full records are dropped and counted rather than blocking the
+    caller; a batch that cannot be written (full disk, permissions) is
+    counted in write_errors and the writer carries on with the next one.
+    """
+
+    _default = None
+    _default_lock = threading.Lock()
+
+    # high frequency or content-only stages that are not worth a log line
+    skipped_stages = {"initial_token"}
+
+    def __init__(
+        self,
+        path="./logs/runs.jsonl",
+        max_bytes=10 * 1024 * 1024,
+        backup_count=5,
+        flush_interval=1.0,
+        max_queue_size=10000,
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self.write_errors = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._closed = threading.Event()
+        self._thread = threading.Thread(
+            target=self._write_loop, name="run-logger", daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.close)
+
+    @classmethod
+    def default(cls):
+        if cls._default is None:
+            with cls._default_lock:
+                if cls._default is None:
+                    cls._default = cls(
+                        path=os.environ.get("RUN_LOG_PATH", "./logs/runs.jsonl")
+                    )
+        return cls._default
+
+    def record(self, run_id, event):
+        # turns a pipeline event into a log record: timings and sizes only
+        stage = event["stage"]
+        if stage in self.skipped_stages:
+            return None
+        record = {
+            "run_id": run_id,
+            "timestamp": time.time(),
+            "stage": stage,
+        }
+        for name, value in event.items():
+            if name == "stage":
+                continue
+            if isinstance(value, str) and name in (
+                "text",
+                "critique",
+                "revision",
+                "output",
+                "prompt",
+            ):
+                record[f"{name}_bytes"] = len(value.encode("utf-8"))
+            else:
+                record[name] = value
+        self.log(record)
+        return record
+
+    def log(self, record):
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def _write_loop(self):
+        while not (self._closed.is_set() and self._queue.empty()):
+            try:
+                batch = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            except Exception as e:
+                with self._lock:
+                    self.write_errors += 1
+                    self.dropped += len(batch)
+                print(f"Run log write failed, {len(batch)} records dropped: {e}")
+
+    def _write(self, batch):
+        lines = "".join(json.dumps(record, default=str) + "\n" for record in batch)
+        data = lines.encode("utf-8")
+        if (
+            os.path.exists(self.path)
+            and os.path.getsize(self.path) + len(data) > self.max_bytes
+        ):
+            self._rotate()
+        with open(self.path, "ab") as log_file:
+            log_file.write(data)
+
+    def _rotate(self):
+        for index in range(self.backup_count - 1, 0, -1):
+            source = f"{self.path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}")
+        if self.backup_count > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+    def close(self):
+        self._closed.set()
+        self._thread.join(timeout=max(self.flush_interval * 2, 1.0))
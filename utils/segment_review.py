@@ -0,0 +1,132 @@
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain.callbacks.base import BaseCallbackHandler
+
+from utils.request_scheduler import bind_context
+
+# a segment ends with a paragraph break or a closing </summary> tag
+_SEGMENT_BOUNDARY = re.compile(r"\n[ \t]*\n|</summary>", re.IGNORECASE)
+
+
+class SegmentSplitter:
+    """Cuts streamed text into completed segments.
+
+    feed() takes the next piece of the stream and returns the segments it
+    completed: text up to a paragraph break or a closing </summary> tag, at
+    least min_chars long (shorter paragraphs are merged with the next one).
+    After max_segments - 1 segments the rest of the stream is kept for the
+    last segment, which close() returns.
+    """
+
+    def __init__(self, min_chars=400, max_segments=4):
+        self.min_chars = min_chars
+        self.max_segments = max_segments
+        self.segments = 0
+        self._buffer = ""
+
+    def feed(self, text):
+        self._buffer += text
+        completed = []
+        while self.segments < self.max_segments - 1:
+            cut = next(
+                (
+                    match.end()
+                    for match in _SEGMENT_BOUNDARY.finditer(self._buffer)
+                    if len(self._buffer[: match.end()].strip()) >= self.min_chars
+                ),
+                None,
+            )
+            if cut is None:
+                break
+            completed.append(self._buffer[:cut].strip())
+            self._buffer = self._buffer[cut:]
+            self.segments += 1
+        return completed
+
+    def close(self):
+        segment, self._buffer = self._buffer.strip(), ""
+        if not segment:
+            return []
+        self.segments += 1
+        return [segment]
+
+
+class SegmentReviewer(BaseCallbackHandler):
+    """Critiques the initial output segment by segment while it streams.
+
+    Attach it to the callbacks of the initial generation: each token of the
+    stream goes through a SegmentSplitter and every completed segment is
+    critiqued against every principle on a worker pool (at most
+    max_concurrency calls in flight) while the rest is still being
+    generated. critique(index, segment, principle) returns the critique.
+
+    finish(response) is called once generation has returned: the last
+    segment is submitted (or, when the LLM did not stream, the whole
+    response is split), and the critiques are collected as one list per
+    segment, in principle order, with the timings of the overlap.
+    """
+
+    def __init__(self, critique, principles, splitter, max_concurrency=4):
+        self.critique = critique
+        self.principles = principles
+        self.splitter = splitter
+        self.tokens = 0
+        self.started_at = time.perf_counter()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_concurrency))
+        self._futures = []
+        self._timings = []
+        self._lock = threading.Lock()
+
+    def on_llm_new_token(self, token, **kwargs):
+        self.tokens += 1
+        for segment in self.splitter.feed(token):
+            self._submit(segment)
+
+    def _submit(self, segment):
+        index = len(self._futures)
+        self._futures.append(
+            [
+                self._executor.submit(bind_context(self._timed), index, segment, principle)
+                for principle in self.principles
+            ]
+        )
+
+    def _timed(self, index, segment, principle):
+        start = time.perf_counter()
+        critique = self.critique(index, segment, principle)
+        with self._lock:
+            self._timings.append((start, time.perf_counter()))
+        return critique
+
+    def finish(self, response):
+        generated_at = time.perf_counter()
+        streamed = self.tokens > 0
+        segments = [] if streamed else self.splitter.feed(response)
+        for segment in segments + self.splitter.close():
+            self._submit(segment)
+        try:
+            critiques = [[future.result() for future in futures] for futures in self._futures]
+        finally:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        finished_at = time.perf_counter()
+        with self._lock:
+            timings = list(self._timings)
+        return critiques, {
+            "streamed": streamed,
+            "segments": len(critiques),
+            "critique_calls": len(timings),
+            "generation_seconds": generated_at - self.started_at,
+            "critique_seconds": sum(end - start for start, end in timings),
+            # critique work done before the initial output was complete
+            "overlapped_seconds": sum(
+                max(0.0, min(end, generated_at) - start) for start, end in timings
+            ),
+            # what is left on the critical path once generation has returned
+            "review_wait_seconds": finished_at - generated_at,
+        }
+
+    def cancel(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
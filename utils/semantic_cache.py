@@ -0,0 +1,230 @@
+import atexit
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from utils.metrics import MetricsRegistry
+
+SIMILARITY_BUCKETS = (0.5, 0.7, 0.8, 0.9, 0.95, 0.97, 0.98, 0.99, 0.995, 1.0)
+
+
+class SemanticCache:
+    """Nearest-neighbour cache of results keyed by prompt embeddings.
+
+    Embeddings are L2-normalised and kept in one float32 matrix with a slot
+    per entry, so a lookup is a single matrix-vector product (cosine
+    similarity) over the entries of the caller's namespace. A lookup hits
+    when the most similar live entry reaches similarity_threshold.
+
+    Entries expire after ttl_seconds; once max_entries slots are used the
+    least recently used entry is replaced. With a path the matrix is a
+    memory-mapped file (<path>.vectors) and the results and slot metadata
+    are written to <path>.json every flush_every writes and at exit. Slots
+    whose vector changed after the last metadata write are dropped on load.
+    """
+
+    def __init__(
+        self,
+        dimension=1536,
+        max_entries=2000,
+        similarity_threshold=0.98,
+        ttl_seconds=7 * 24 * 3600,
+        path=None,
+        flush_every=16,
+    ):
+        self.dimension = dimension
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.path = path
+        self.flush_every = flush_every
+
+        self._lock = threading.Lock()
+        self._active = np.zeros(max_entries, dtype=bool)
+        self._namespace_of = np.full(max_entries, -1, dtype=np.int32)
+        self._accessed_at = np.zeros(max_entries, dtype=np.float64)
+        self._expires_at = np.zeros(max_entries, dtype=np.float64)
+        self._checksums = np.zeros(max_entries, dtype=np.float64)
+        self._entries = [None] * max_entries
+        self._namespaces = {}
+        self._used_slots = 0
+        self._unflushed = 0
+        self._stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+
+        if path:
+            self._vectors = self._open_vectors(path)
+            atexit.register(self.flush)
+        else:
+            self._vectors = np.zeros((max_entries, dimension), dtype=np.float32)
+
+    def _open_vectors(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        vectors_path = f"{path}.vectors"
+        index = None
+        if os.path.exists(vectors_path) and os.path.exists(f"{path}.json"):
+            with open(f"{path}.json") as index_file:
+                index = json.load(index_file)
+            if (index["dimension"], index["max_entries"]) != (
+                self.dimension,
+                self.max_entries,
+            ):
+                print(f"Semantic cache at {path} has a different shape, starting empty")
+                index = None
+
+        vectors = np.memmap(
+            vectors_path,
+            dtype=np.float32,
+            mode="r+" if index is not None else "w+",
+            shape=(self.max_entries, self.dimension),
+        )
+        if index is not None:
+            self._namespaces = {name: number for number, name in enumerate(index["namespaces"])}
+            for entry in index["entries"]:
+                slot = entry["slot"]
+                if not np.isclose(float(vectors[slot].sum()), entry["checksum"]):
+                    continue
+                self._checksums[slot] = entry["checksum"]
+                self._active[slot] = True
+                self._namespace_of[slot] = entry["namespace"]
+                self._accessed_at[slot] = entry["accessed_at"]
+                self._expires_at[slot] = entry["expires_at"]
+                self._entries[slot] = entry["result"]
+                self._used_slots = max(self._used_slots, slot + 1)
+        return vectors
+
+    def _normalize(self, vector):
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        if vector.shape[0] != self.dimension:
+            raise ValueError(
+                f"Expected a {self.dimension}-dimensional embedding, got {vector.shape[0]}"
+            )
+        norm = float(np.linalg.norm(vector))
+        return vector / norm if norm else None
+
+    def _similarities(self, query, namespace_id, now):
+        # cosine similarity of every live entry of the namespace, -inf elsewhere
+        used = self._used_slots
+        similarities = self._vectors[:used] @ query
+        live = (
+            self._active[:used]
+            & (self._namespace_of[:used] == namespace_id)
+            & (self._expires_at[:used] > now)
+        )
+        return np.where(live, similarities, -np.inf)
+
+    def get(self, vector, namespace=""):
+        query = self._normalize(vector)
+        now = time.time()
+        similarity = None
+        result = None
+        with self._lock:
+            namespace_id = self._namespaces.get(namespace)
+            if query is not None and namespace_id is not None and self._used_slots:
+                similarities = self._similarities(query, namespace_id, now)
+                slot = int(np.argmax(similarities))
+                if np.isfinite(similarities[slot]):
+                    similarity = float(similarities[slot])
+                    if similarity >= self.similarity_threshold:
+                        self._accessed_at[slot] = now
+                        result = self._entries[slot]
+            self._stats["hits" if result is not None else "misses"] += 1
+
+        metrics = MetricsRegistry.default()
+        metrics.inc(
+            "cache_lookups_total",
+            cache="semantic",
+            result="hit" if result is not None else "miss",
+        )
+        if similarity is not None:
+            metrics.observe(
+                "semantic_cache_best_similarity", similarity, buckets=SIMILARITY_BUCKETS
+            )
+        if result is None:
+            return None
+        return {"result": result, "similarity": similarity}
+
+    def put(self, vector, result, namespace=""):
+        query = self._normalize(vector)
+        if query is None:
+            return
+        now = time.time()
+        with self._lock:
+            namespace_id = self._namespaces.setdefault(namespace, len(self._namespaces))
+            slot = self._slot_for(query, namespace_id, now)
+            self._vectors[slot] = query
+            self._checksums[slot] = float(query.sum())
+            self._active[slot] = True
+            self._namespace_of[slot] = namespace_id
+            self._accessed_at[slot] = now
+            self._expires_at[slot] = now + self.ttl_seconds
+            self._entries[slot] = result
+            self._used_slots = max(self._used_slots, slot + 1)
+            self._stats["writes"] += 1
+            self._unflushed += 1
+            flush = self.path and self._unflushed >= self.flush_every
+        if flush:
+            self.flush()
+
+    def _slot_for(self, query, namespace_id, now):
+        # a near-duplicate is replaced in place, otherwise the first free or
+        # expired slot is used, otherwise the least recently used entry
+        if self._used_slots:
+            similarities = self._similarities(query, namespace_id, now)
+            slot = int(np.argmax(similarities))
+            if similarities[slot] >= self.similarity_threshold:
+                return slot
+        if self._used_slots < self.max_entries:
+            return self._used_slots
+        free = np.flatnonzero(~self._active | (self._expires_at <= now))
+        if free.size:
+            return int(free[0])
+        self._stats["evictions"] += 1
+        return int(np.argmin(self._accessed_at))
+
+    def flush(self):
+        if not self.path:
+            return
+        with self._lock:
+            if isinstance(self._vectors, np.memmap):
+                self._vectors.flush()
+            index = {
+                "dimension": self.dimension,
+                "max_entries": self.max_entries,
+                "namespaces": sorted(self._namespaces, key=self._namespaces.get),
+                "entries": [
+                    {
+                        "slot": int(slot),
+                        "namespace": int(self._namespace_of[slot]),
+                        "accessed_at": float(self._accessed_at[slot]),
+                        "expires_at": float(self._expires_at[slot]),
+                        "checksum": float(self._checksums[slot]),
+                        "result": self._entries[slot],
+                    }
+                    for slot in np.flatnonzero(self._active)
+                ],
+            }
+            self._unflushed = 0
+        temporary_path = f"{self.path}.json.tmp"
+        with open(temporary_path, "w") as index_file:
+            json.dump(index, index_file)
+        os.replace(temporary_path, f"{self.path}.json")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = int(self._active.sum())
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._active[:] = False
+            self._namespace_of[:] = -1
+            self._entries = [None] * self.max_entries
+            self._namespaces = {}
+            self._used_slots = 0
+        self.flush()
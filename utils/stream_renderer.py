@@ -0,0 +1,71 @@
+import time
+
+
+class StreamRenderer:
+    """Keyed Streamlit placeholders, redrawn only when their content changes.
+
+    Each element of a streamed run (the initial output, its timing, one
+    critique or revision per principle, ...) is a placeholder registered
+    under a key. update() records what the element should show; flush()
+    redraws the elements whose content differs from what was last drawn,
+    at most max_fps times per second unless forced. Elements never get
+    appended twice, so the page does not grow with the number of updates.
+
+    Groups keep the slots of one principle together: add_group() creates a
+    container in the parent with one placeholder per slot, in slot order,
+    the first time the principle shows up.
+    """
+
+    def __init__(self, max_fps=10):
+        self.min_interval = 1.0 / max_fps if max_fps else 0.0
+        self._placeholders = {}
+        self._rendered = {}
+        self._pending = {}
+        self._flushed_at = 0.0
+        self._stats = {"updates": 0, "unchanged": 0, "redraws": 0, "frames": 0}
+
+    def add(self, key, placeholder):
+        self._placeholders[key] = placeholder
+
+    def add_group(self, key, parent, slots, divider=True):
+        if (key, slots[0]) in self._placeholders:
+            return
+        container = parent.container()
+        for slot in slots:
+            self._placeholders[(key, slot)] = container.empty()
+        if divider:
+            container.divider()
+
+    def has(self, key):
+        return key in self._placeholders
+
+    def update(self, key, method, body="", **kwargs):
+        # method is the placeholder method to draw with ("markdown",
+        # "caption", "warning", ...) or "empty" to clear the element
+        content = (method, body, tuple(sorted(kwargs.items())))
+        self._stats["updates"] += 1
+        if self._rendered.get(key) == content:
+            self._pending.pop(key, None)
+            self._stats["unchanged"] += 1
+            return
+        self._pending[key] = content
+
+    def flush(self, force=False):
+        now = time.perf_counter()
+        if not self._pending or (not force and now - self._flushed_at < self.min_interval):
+            return 0
+        pending, self._pending = self._pending, {}
+        for key, (method, body, kwargs) in pending.items():
+            placeholder = self._placeholders[key]
+            if method == "empty":
+                placeholder.empty()
+            else:
+                getattr(placeholder, method)(body, **dict(kwargs))
+            self._rendered[key] = (method, body, kwargs)
+        self._flushed_at = now
+        self._stats["frames"] += 1
+        self._stats["redraws"] += len(pending)
+        return len(pending)
+
+    def stats(self):
+        return dict(self._stats)